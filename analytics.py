@@ -0,0 +1,315 @@
+"""
+Agregados de resultados para la página de administración "resultados".
+
+`ResultsAggregator` lee las respuestas del backend de almacenamiento
+configurado (storage.py) de forma incremental: en cada refresco solo pide las
+filas añadidas desde la lectura anterior, las codifica
+(ver codebook.py) y suma sus totales a los acumulados por cliente. Cada
+agregador cuenta solo las filas de un cuestionario (columna Encuesta).
+No guarda las filas en memoria, solo sumas y conteos, de modo que el coste de
+un refresco depende de las filas nuevas y no del tamaño total de los datos.
+
+Para los informes de confiabilidad también acumula, por cliente, los momentos
+de las siete dimensiones (n, sumas y productos cruzados de las filas
+completas), de los que salen el alfa de Cronbach y las correlaciones sin volver
+a leer las filas, y los conteos Probabilidad x Impacto por evento (matriz de
+riesgo). Los informes se cachean por cliente junto con la versión de sus datos
+(filas procesadas de ese cliente): solo se recalculan los de los clientes que
+recibieron filas nuevas.
+
+pandas se importa dentro de las funciones para no cargarlo en el arranque.
+"""
+import os
+import threading
+import time
+
+from codebook import CODEBOOKS
+from schema import ESCALAS, HEADERS, LEGACY_SURVEY
+
+# Segundos que se reutilizan los agregados antes de buscar filas nuevas
+RESULTS_TTL = float(os.environ.get("CCK_RESULTS_TTL", "60"))
+
+# Filas que se piden a la API en cada lectura
+READ_CHUNK_ROWS = int(os.environ.get("CCK_RESULTS_CHUNK_ROWS", "20000"))
+
+DIMENSIONES = list(ESCALAS)
+
+# Agrupaciones disponibles (además de Nombre_Cliente)
+AGRUPACIONES = ("Evento", "Departamento", "Nivel_Cargo")
+
+# Dimensiones de la tabla de correlaciones del informe de confiabilidad
+CORRELACIONES = ("Detección", "Autoeficacia", "Impacto")
+
+
+def codificar(df):
+    """
+    Devuelve un DataFrame con las dimensiones de `df` como códigos (float, NaN
+    si el valor no es válido) y la columna Riesgo = Probabilidad x Impacto.
+
+    Las filas con Version_Codigos ya vienen codificadas; las filas antiguas
+    con etiquetas se convierten con Categorical (vectorizado).
+    """
+    import pandas as pd
+
+    codificadas = df["Version_Codigos"] != ""
+    codigos = pd.DataFrame(index=df.index)
+    for dimension, opciones in ESCALAS.items():
+        etiquetas = pd.Categorical(df[dimension], categories=opciones).codes.astype("float32") + 1
+        etiquetas[etiquetas < 1] = float("nan")
+        numericos = pd.to_numeric(df[dimension], errors="coerce").astype("float32")
+        codigos[dimension] = numericos.where(codificadas, etiquetas)
+    codigos["Riesgo"] = codigos["Probabilidad"] * codigos["Impacto"]
+    return codigos
+
+
+def decodificar_etiquetas(df, campos=AGRUPACIONES):
+    """Sustituye en `df` los códigos de `campos` por sus etiquetas, según la versión de cada fila."""
+    for version in df["Version_Codigos"].unique():
+        if version == "":
+            continue
+        filas = df["Version_Codigos"] == version
+        libro = CODEBOOKS[int(version)]
+        for campo in campos:
+            mapa = {str(i + 1): etiqueta for i, etiqueta in enumerate(libro[campo])}
+            df.loc[filas, campo] = df.loc[filas, campo].map(mapa).fillna(df.loc[filas, campo])
+    return df
+
+
+class ResultsAggregator:
+    """Agregados de las respuestas, refrescados de forma incremental y cacheados con TTL."""
+
+    def __init__(self, storage, encuesta=None, ttl=RESULTS_TTL, chunk_rows=READ_CHUNK_ROWS):
+        self.storage = storage
+        self.encuesta = encuesta  # None = todos los cuestionarios
+        self.ttl = ttl
+        self.chunk_rows = chunk_rows
+        self.rows = 0
+        self.refreshed_at = None
+        self._offsets = {}  # shard -> filas de datos ya procesadas
+        self._sums = {}
+        self._counts = {}
+        self._autoeficacia = None
+        self._momentos = {}  # cliente -> (n, sumas, productos cruzados) de las filas completas
+        self._riesgo = None
+        self._versiones = {}  # cliente -> filas procesadas de ese cliente
+        self._informes = {}  # (informe, cliente, ...) -> (versión, resultado)
+        self._lock = threading.Lock()
+
+    def refresh(self, force=False):
+        """
+        Añade a los agregados las filas nuevas del almacenamiento si el TTL
+        expiró. Devuelve el número de filas nuevas procesadas.
+        """
+        with self._lock:
+            if not force and self.refreshed_at is not None and time.monotonic() - self.refreshed_at < self.ttl:
+                return 0
+
+            nuevas = 0
+            for shard in self.storage.shards():
+                for values in self.storage.iter_rows(self.chunk_rows, self._offsets.get(shard, 0), shard):
+                    self._process(values)
+                    self._offsets[shard] = self._offsets.get(shard, 0) + len(values)
+                    nuevas += len(values)
+            self.rows += nuevas
+            self.refreshed_at = time.monotonic()
+            return nuevas
+
+    def _process(self, values):
+        import pandas as pd
+
+        width = len(HEADERS)
+        # Sheets devuelve texto; la hoja en memoria y los backends locales, enteros
+        df = pd.DataFrame([list(r[:width]) + [""] * (width - len(r)) for r in values],
+                          columns=HEADERS).fillna("").astype(str)
+        if self.encuesta is not None:
+            # Las filas sin Encuesta son del cuestionario original
+            df = df[df["Encuesta"].replace("", LEGACY_SURVEY) == self.encuesta].copy()
+            if df.empty:
+                return
+        codigos = codificar(df)
+        df = decodificar_etiquetas(df)
+        columnas = DIMENSIONES + ["Riesgo"]
+
+        base = codigos.assign(Nombre_Cliente=df["Nombre_Cliente"])
+        for agrupacion in AGRUPACIONES:
+            grupos = base.assign(**{agrupacion: df[agrupacion]}).groupby(
+                ["Nombre_Cliente", agrupacion])[columnas]
+            sumas, conteos = grupos.sum(), grupos.count()
+            if agrupacion in self._sums:
+                sumas = sumas.add(self._sums[agrupacion], fill_value=0)
+                conteos = conteos.add(self._counts[agrupacion], fill_value=0)
+            self._sums[agrupacion], self._counts[agrupacion] = sumas, conteos
+
+        # Distribución de Autoeficacia por cliente y evento (conteo por código)
+        distribucion = pd.crosstab(
+            [df["Nombre_Cliente"], df["Evento"]], codigos["Autoeficacia"]
+        ).reindex(columns=range(1, len(ESCALAS["Autoeficacia"]) + 1), fill_value=0)
+        if self._autoeficacia is not None:
+            distribucion = distribucion.add(self._autoeficacia, fill_value=0)
+        self._autoeficacia = distribucion
+
+        # Conteos Probabilidad x Impacto por cliente y evento (matriz de riesgo)
+        riesgo = codigos[["Probabilidad", "Impacto"]].dropna().astype(int).assign(
+            Nombre_Cliente=df["Nombre_Cliente"], Evento=df["Evento"]
+        ).value_counts(["Nombre_Cliente", "Evento", "Probabilidad", "Impacto"])
+        if self._riesgo is not None:
+            riesgo = riesgo.add(self._riesgo, fill_value=0)
+        self._riesgo = riesgo
+
+        # Momentos de las filas con las siete dimensiones válidas, por cliente
+        completas = codigos[DIMENSIONES].astype("float64").dropna()
+        clientes = df.loc[completas.index, "Nombre_Cliente"]
+        for cliente, filas in completas.groupby(clientes):
+            x = filas.to_numpy()
+            n, sumas, cruzados = self._momentos.get(cliente, (0, 0.0, 0.0))
+            self._momentos[cliente] = (n + len(x), sumas + x.sum(axis=0), cruzados + x.T @ x)
+        for cliente, filas in df.groupby("Nombre_Cliente").size().items():
+            self._versiones[cliente] = self._versiones.get(cliente, 0) + filas
+
+    def clientes(self):
+        with self._lock:
+            if "Evento" not in self._counts:
+                return []
+            return sorted(self._counts["Evento"].index.get_level_values(0).unique())
+
+    def resumen(self, agrupacion="Evento", cliente=None):
+        """
+        Medias de cada dimensión y del riesgo (Probabilidad x Impacto) por
+        `agrupacion`, para un cliente o para todos (cliente=None).
+        """
+        import pandas as pd
+
+        with self._lock:
+            sums = self._sums.get(agrupacion)
+            counts = self._counts.get(agrupacion)
+        if sums is None:
+            return pd.DataFrame()
+        if cliente is not None:
+            if cliente not in sums.index.get_level_values(0):
+                return pd.DataFrame()
+            sums, counts = sums.xs(cliente, level=0), counts.xs(cliente, level=0)
+        else:
+            sums, counts = sums.groupby(level=1).sum(), counts.groupby(level=1).sum()
+
+        resultado = (sums / counts.where(counts > 0)).round(2)
+        resultado.insert(0, "N", counts["Probabilidad"].astype(int))
+        return resultado.sort_values("Riesgo", ascending=False)
+
+    def distribucion_autoeficacia(self, cliente=None):
+        """Porcentaje de respuestas de cada opción de Autoeficacia por evento."""
+        import pandas as pd
+
+        with self._lock:
+            distribucion = self._autoeficacia
+        if distribucion is None:
+            return pd.DataFrame()
+        if cliente is not None:
+            if cliente not in distribucion.index.get_level_values(0):
+                return pd.DataFrame()
+            distribucion = distribucion.xs(cliente, level=0)
+        else:
+            distribucion = distribucion.groupby(level=1).sum()
+        totales = distribucion.sum(axis=1)
+        porcentajes = (distribucion.div(totales.where(totales > 0), axis=0) * 100).round(1)
+        porcentajes.columns = ESCALAS["Autoeficacia"]
+        return porcentajes
+
+    def _version(self, cliente):
+        return self.rows if cliente is None else self._versiones.get(cliente, 0)
+
+    def _cached(self, clave, cliente, calcular):
+        """Resultado de `calcular()` cacheado hasta que lleguen filas nuevas del cliente."""
+        with self._lock:
+            version = self._version(cliente)
+            guardado = self._informes.get(clave)
+            if guardado is not None and guardado[0] == version:
+                return guardado[1]
+            resultado = calcular()
+            self._informes[clave] = (version, resultado)
+            return resultado
+
+    def _covarianza(self, cliente):
+        """(n, matriz de covarianzas) de las filas completas del cliente (o de todos)."""
+        import pandas as pd
+
+        momentos = list(self._momentos.values()) if cliente is None else [self._momentos.get(cliente)]
+        momentos = [m for m in momentos if m is not None]
+        n = sum(m[0] for m in momentos)
+        if n < 2:
+            return n, None
+        sumas = sum(m[1] for m in momentos)
+        cruzados = sum(m[2] for m in momentos)
+        media = sumas / n
+        covarianza = (cruzados - n * media[:, None] * media[None, :]) / (n - 1)
+        return n, pd.DataFrame(covarianza, index=DIMENSIONES, columns=DIMENSIONES)
+
+    def confiabilidad(self, cliente=None):
+        """
+        Alfa de Cronbach de las siete dimensiones y correlaciones entre
+        Detección, Autoeficacia e Impacto, sobre las filas con todas las
+        dimensiones válidas. Devuelve {"n", "alfa", "correlaciones"}; alfa y
+        correlaciones son None si hay menos de dos filas.
+        """
+        def calcular():
+            n, covarianza = self._covarianza(cliente)
+            if covarianza is None:
+                return {"n": n, "alfa": None, "correlaciones": None}
+            k = len(DIMENSIONES)
+            total = covarianza.to_numpy().sum()
+            alfa = k / (k - 1) * (1 - covarianza.to_numpy().trace() / total) if total > 0 else None
+            sub = covarianza.loc[list(CORRELACIONES), list(CORRELACIONES)]
+            desviaciones = sub.to_numpy().diagonal() ** 0.5
+            correlaciones = (sub / desviaciones[:, None] / desviaciones[None, :]).round(3)
+            return {"n": n, "alfa": None if alfa is None else round(float(alfa), 3),
+                    "correlaciones": correlaciones}
+        return self._cached(("confiabilidad", cliente), cliente, calcular)
+
+    def matriz_riesgo(self, cliente=None, evento=None):
+        """
+        Número de respuestas por Probabilidad (filas) e Impacto (columnas),
+        con las etiquetas de la escala, para un cliente y/o evento (None = todos).
+        """
+        import pandas as pd
+
+        def calcular():
+            riesgo = self._riesgo
+            vacia = pd.DataFrame(0, index=ESCALAS["Probabilidad"], columns=ESCALAS["Impacto"])
+            if riesgo is None:
+                return vacia
+            if cliente is not None:
+                if cliente not in riesgo.index.get_level_values(0):
+                    return vacia
+                riesgo = riesgo.xs(cliente, level="Nombre_Cliente")
+            if evento is not None:
+                if evento not in riesgo.index.get_level_values("Evento"):
+                    return vacia
+                riesgo = riesgo.xs(evento, level="Evento")
+            matriz = riesgo.groupby(level=["Probabilidad", "Impacto"]).sum().unstack(fill_value=0)
+            matriz = matriz.reindex(index=range(1, len(ESCALAS["Probabilidad"]) + 1),
+                                    columns=range(1, len(ESCALAS["Impacto"]) + 1), fill_value=0)
+            matriz.index, matriz.columns = ESCALAS["Probabilidad"], ESCALAS["Impacto"]
+            return matriz.astype(int)
+        return self._cached(("riesgo", cliente, evento), cliente, calcular)
+
+    def eventos(self, cliente=None):
+        with self._lock:
+            if self._riesgo is None:
+                return []
+            riesgo = self._riesgo
+            if cliente is not None:
+                if cliente not in riesgo.index.get_level_values(0):
+                    return []
+                riesgo = riesgo.xs(cliente, level="Nombre_Cliente")
+            return sorted(riesgo.index.get_level_values("Evento").unique())
+
+
+_aggregators = {}
+_aggregator_lock = threading.Lock()
+
+
+# Función para obtener el agregador de un cuestionario, compartido por todo el proceso
+def get_results_aggregator(storage, encuesta=None):
+    with _aggregator_lock:
+        if encuesta not in _aggregators:
+            _aggregators[encuesta] = ResultsAggregator(storage, encuesta)
+        return _aggregators[encuesta]
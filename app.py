@@ -1,16 +1,64 @@
 import streamlit as st
-import pandas as pd
-import gspread
 import os
 import json
-from google.oauth2.service_account import Credentials
-from google.oauth2 import service_account
 from datetime import datetime
 import uuid
+import time
+import hmac
+import cProfile
+import warnings
+import metrics
+from codebook import encode_rows
+from credentials import get_credential_provider
+from dedup import get_submission_index
+from localdb import DATA_DIR
+from schema import (DEPARTAMENTOS, NIVELES_CARGO, RESPONSE_COLUMNS,
+                    ensure_codebook_dictionary, ensure_header)
+from sharding import SHARD_MAP, SHARDING, acquire_write_budget, shard_for, shard_from_title, shard_target
+from sheets import (SHEETS_BACKEND, InstrumentedSpreadsheet, InstrumentedWorksheet, append_response_rows,
+                    build_rows, rows_to_csv, get_cached_worksheet, get_connectivity_check,
+                    get_memory_worksheet, invalidate_cached_worksheets, is_auth_error,
+                    is_permission_error, memory_worksheet_titles)
+from progress import get_progress_store
+from session_record import ResponseRecord
+from sampling import SAMPLE_TARGET, SAMPLING, get_coverage_sampler, select_events
+from resilience import SHEETS_TIMEOUT, CircuitOpenError, call_with_retry
+from spool import get_spool_worker
+from storage import SYNC_TO_SHEETS, get_storage
+from survey import get_survey
 
 # Configuración de la página
 st.set_page_config(page_title="Encuesta CCK", layout="wide")
 
+# Métricas: exportadores del proceso (CCK_METRICS_PORT / CCK_METRICS_FILE)
+metrics.start_exporters()
+inicio_rerun = time.perf_counter()
+pagina_rerun = st.session_state.get("page", "inicio")
+
+# Modo de perfilado por rerun (CCK_PROFILE=1): un archivo .prof por rerun
+PROFILE_DIR = os.path.join(DATA_DIR, "perfiles")
+profiler = None
+if os.environ.get("CCK_PROFILE") == "1":
+    profiler = cProfile.Profile()
+    profiler.enable()
+
+# Hoja de cálculo donde se guardan las respuestas
+SPREADSHEET_KEY = "10vcVWojXWDOZPlXnwIqPtinDtSSwq6evz4mDwTdkz-o"
+
+# Función para identificar la fuente de credenciales sin cargarlas
+def credentials_source():
+    """
+    Devuelve un identificador de la fuente que usará get_gcp_credentials,
+    siguiendo el mismo orden de preferencia. Sirve como clave de caché.
+    """
+    if hasattr(st, 'secrets') and 'google_credentials' in st.secrets:
+        return "secrets"
+    if 'GOOGLE_APPLICATION_CREDENTIALS_JSON' in os.environ:
+        return "env_json"
+    if 'GOOGLE_APPLICATION_CREDENTIALS' in os.environ:
+        return "env_file:" + os.environ['GOOGLE_APPLICATION_CREDENTIALS']
+    return "file:credentials.json"
+
 # Función para obtener credenciales
 def get_gcp_credentials():
     """
@@ -19,6 +67,10 @@ def get_gcp_credentials():
     2. Variables de entorno 
     3. Archivo local de credenciales
     """
+    # Importación diferida: google-auth solo se carga al conectar con Sheets
+    from google.oauth2 import service_account
+    from google.oauth2.service_account import Credentials
+    
     scope = ['https://spreadsheets.google.com/feeds',
              'https://www.googleapis.com/auth/spreadsheets',
              'https://www.googleapis.com/auth/drive']
@@ -56,465 +108,607 @@ def get_gcp_credentials():
         st.error("No se pudieron cargar las credenciales. Asegúrate de tener las credenciales correctamente configuradas.")
         return None
 
-# Función para conectar con Google Sheets
-def connect_to_gsheets(spreadsheet_name):
-    credentials = get_gcp_credentials()
+# Función para abrir una hoja de respuestas (autorización + búsqueda de la hoja)
+def _open_respuestas_worksheet(spreadsheet_key=SPREADSHEET_KEY, worksheet_name="Respuestas"):
+    """Abre la hoja `worksheet_name` y la crea (con encabezados) si no existe."""
+    # Importación diferida: gspread solo se carga al conectar con Sheets
+    import gspread
     
-    if credentials is None:
-        return None
+    # Credenciales, token y cliente autorizado compartidos por el proceso
+    # (ver credentials.py): solo la primera conexión los carga
+    provider = get_credential_provider(credentials_source(), get_gcp_credentials)
+    with metrics.timed("cck_connect_seconds", step="authorize"):
+        gc = provider.client(timeout=SHEETS_TIMEOUT)
     
-    gc = gspread.authorize(credentials)
+    if gc is None:
+        return None
     
     # Abrir una hoja específica por ID
+    with metrics.timed("cck_connect_seconds", step="open_by_key"):
+        spreadsheet = InstrumentedSpreadsheet(
+            call_with_retry(gc.open_by_key, spreadsheet_key, operation="open_by_key"))
+    
+    # Asegurarse de que existe la hoja de trabajo
     try:
-        spreadsheet = gc.open_by_key("10vcVWojXWDOZPlXnwIqPtinDtSSwq6evz4mDwTdkz-o")
+        with metrics.timed("cck_connect_seconds", step="worksheet"):
+            worksheet = spreadsheet.worksheet(worksheet_name)
         
-        # Asegurarse de que existe la hoja de trabajo
-        try:
-            worksheet = spreadsheet.worksheet("Respuestas")
-            
-            # Añadir encabezados siempre (aunque la hoja ya exista)
-            headers = [
-                "ID_Respuesta", "Nombre_Cliente", "Fecha_Respuesta", 
-                "Nivel_Cargo", "Fecha_Inicio", "Departamento",
-                "Evento", "Probabilidad", "Ocurrencia", "Detección", 
-                "Estructura", "Impacto", "Responsabilidad", "Autoeficacia"
-            ]
-            worksheet.update('A1', [headers])
-            
-        except gspread.WorksheetNotFound:
-            worksheet = spreadsheet.add_worksheet(title="Respuestas", rows=1000, cols=50)
-            
-            # Añadir encabezados a la hoja (columnas específicas)
-            headers = [
-                "ID_Respuesta", "Nombre_Cliente", "Fecha_Respuesta", 
-                "Nivel_Cargo", "Fecha_Inicio", "Departamento",
-                "Evento", "Probabilidad", "Ocurrencia", "Detección", 
-                "Estructura", "Impacto", "Responsabilidad", "Autoeficacia"
-            ]
-            worksheet.update('A1', [headers])
+        # Escribir encabezados solo si faltan o no coinciden con el esquema
+        ensure_header(worksheet)
         
-        return worksheet
+    except gspread.WorksheetNotFound:
+        worksheet = spreadsheet.add_worksheet(title=worksheet_name, rows=1000, cols=50)
+        
+        # Añadir encabezados a la hoja nueva (sin leerla, está vacía)
+        ensure_header(worksheet, known_empty=True)
+    
+    # Publicar el diccionario de etiquetas del libro de códigos (una vez por versión).
+    # Un fallo no impide guardar respuestas: se registra y se reintenta en la
+    # próxima conexión; los errores de credenciales sí se propagan.
+    try:
+        ensure_codebook_dictionary(spreadsheet)
     except Exception as e:
+        if is_auth_error(e):
+            raise
+        metrics.inc("cck_errors_total", operation="codebook_dictionary", error=type(e).__name__)
+        warnings.warn(f"No se pudo publicar el diccionario de códigos: {e}")
+    
+    metrics.inc("cck_connections_opened_total")
+    return worksheet
+
+# Función para conectar con Google Sheets
+def connect_to_gsheets(spreadsheet_name, shard=""):
+    """
+    Devuelve la hoja "Respuestas" (o la del shard, ver sharding.py). La conexión
+    se cachea a nivel de proceso, de modo que todas las sesiones comparten el
+    mismo cliente autorizado.
+    """
+    try:
+        return _spool_worksheet(shard)
+    except Exception as e:
+        # 403: sin acceso al libro del shard; el resto de errores de
+        # autorización invalidan también las credenciales
+        if is_permission_error(e):
+            invalidate_cached_worksheets(shard_target(shard, SPREADSHEET_KEY)[0])
+        elif is_auth_error(e):
+            invalidate_cached_worksheets()
         st.error(f"Error al conectar con Google Sheets: {str(e)}")
         return None
 
+# Función que usa el hilo de envío para obtener la hoja destino
+def _spool_worksheet(shard=""):
+    spreadsheet_key, worksheet_name = shard_target(shard, SPREADSHEET_KEY)
+    # Backend local en memoria (pruebas y desarrollo sin credenciales)
+    if SHEETS_BACKEND == "memory":
+        if spreadsheet_key != SPREADSHEET_KEY:
+            worksheet_name = f"{spreadsheet_key}/{worksheet_name}"
+        return InstrumentedWorksheet(get_memory_worksheet(worksheet_name))
+    return get_cached_worksheet(spreadsheet_key, worksheet_name, credentials_source(),
+                                lambda: _open_respuestas_worksheet(spreadsheet_key, worksheet_name))
+
+# Función para listar los shards con respuestas (hoja principal = "")
+def _list_shards():
+    if SHARDING != "cliente":
+        return [""]
+    if SHEETS_BACKEND == "memory":
+        titulos = memory_worksheet_titles()
+    else:
+        spreadsheet = InstrumentedSpreadsheet(_spool_worksheet().spreadsheet)
+        titulos = [w.title for w in spreadsheet.worksheets()]
+    shards = [s for s in map(shard_from_title, titulos) if s]
+    return [""] + shards + sorted(s for s in SHARD_MAP if s not in shards)
+
 # Función para guardar respuestas en Google Sheets
-def save_response(worksheet, response_data):
+def save_response(worksheet, filas):
+    """
+    Guarda todas las filas de una respuesta (una por evento) con una sola
+    llamada a la API, sin leer la hoja para calcular la siguiente fila.
+    """
     if worksheet is None:
         return False
         
     try:
-        # Obtener todas las filas actuales
-        all_values = worksheet.get_all_values()
-        
-        # La nueva fila será después de la última fila existente
-        row_to_update = len(all_values) + 1
-        
-        # Preparar valores
-        values = list(response_data.values())
-        
-        # Actualizar la celda directamente usando rangos
-        cell_range = f'A{row_to_update}'
-        
-        # Actualizar como una lista de listas
-        worksheet.update(cell_range, [values])
-        
-        return True
+        return append_response_rows(worksheet, filas)
+    except CircuitOpenError:
+        st.error("Google Sheets no está disponible en este momento.")
+        return False
     except Exception as e:
+        # Credenciales caducadas o revocadas: forzar una nueva conexión
+        if is_auth_error(e):
+            invalidate_cached_worksheets()
         st.error(f"Error al guardar en Google Sheets: {str(e)}")
         return False
         
-# Lista de posibles eventos críticos
-eventos_criticos = [
-    "Fuga de información confidencial",
-    "Caída prolongada de los sistemas informáticos",
-    "Incumplimiento regulatorio",
-    "Fraude interno",
-    "Crisis reputacional en redes sociales",
-    "Falla en la cadena de suministro",
-    "Desastre natural que afecta las instalaciones",
-    "Ciberataque",
-    "Conflicto laboral grave",
-    "Error crítico en producto o servicio"
-]
-
-# Inicializar el estado de la sesión
-if 'page' not in st.session_state:
-    st.session_state.page = "inicio"
-if 'respuestas' not in st.session_state:
-    st.session_state.respuestas = {}
-if 'evento_actual' not in st.session_state:
-    st.session_state.evento_actual = None
-if 'n_eventos_respondidos' not in st.session_state:
-    st.session_state.n_eventos_respondidos = 0
-if 'total_eventos' not in st.session_state:
-    st.session_state.total_eventos = 3  # Número de eventos a evaluar por participante
-if 'error_credenciales' not in st.session_state:
-    st.session_state.error_credenciales = False
-if 'nombre_cliente' not in st.session_state:
-    st.session_state.nombre_cliente = ""
-if 'response_id' not in st.session_state:
-    st.session_state.response_id = str(uuid.uuid4())[:8]  # ID único para cada sesión de respuesta
-
-# Función para cambiar de página
-def cambiar_pagina(nueva_pagina, evento=None):
-    st.session_state.page = nueva_pagina
-    if evento is not None:
-        st.session_state.evento_actual = evento
-
-# Verificar credenciales al inicio
-if 'credenciales_verificadas' not in st.session_state:
+# Cuerpo del rerun: el bloque finally mide y perfila también los reruns que
+# terminan con st.rerun() o st.stop()
+try:
+    # Cuestionario a usar (?encuesta=<id>); la definición se carga una vez por proceso
+    if 'encuesta' not in st.session_state:
+        st.session_state.encuesta = st.query_params.get("encuesta")
     try:
-        test_worksheet = connect_to_gsheets("Test_Conexion_CCK")
-        if test_worksheet is not None:
-            st.session_state.credenciales_verificadas = True
-        else:
-            st.session_state.credenciales_verificadas = False
-            st.session_state.error_credenciales = True
-    except Exception as e:
-        st.session_state.credenciales_verificadas = False
-        st.session_state.error_credenciales = True
-        st.session_state.error_mensaje = str(e)
-
-# Página de inicio y consentimiento
-if st.session_state.page == "inicio":
-    st.title("CCK")
-    st.markdown("### Introducción y Consentimiento")
-    st.markdown("""
-    El propósito de este cuestionario es evaluar su percepción sobre la probabilidad, el impacto 
-    y la preparación de su organización frente a una serie de posibles eventos críticos. Sus 
-    respuestas nos ayudarán a identificar áreas clave para mejorar los procesos internos, la 
-    detección temprana y la preparación organizacional.
-    
-    La participación es completamente anónima y voluntaria, y sus respuestas serán utilizadas 
-    únicamente con fines de evaluación interna. No serán compartidas con terceros bajo ninguna 
-    circunstancia.
-    
-    Por favor, responda cada pregunta basándose en su experiencia y percepción actual sobre estos eventos. 
-    No existen respuestas correctas o incorrectas.
-    
-    El tiempo estimado para completar el cuestionario es de 5 a 10 minutos.
-    """)
-    
-    # Añadir campo para nombre del cliente
-    st.session_state.nombre_cliente = st.text_input("Nombre del cliente/organización:", 
-                                                   value=st.session_state.nombre_cliente)
-    
-    consentimiento = st.radio("Por favor, indique su consentimiento a continuación:", 
-                             ["Estoy de acuerdo, deseo continuar", "No estoy de acuerdo, deseo salir."])
-    
-    if st.button("Continuar"):
-        if consentimiento == "Estoy de acuerdo, deseo continuar":
-            # Generar un nuevo ID de respuesta al comenzar una nueva encuesta
-            st.session_state.response_id = str(uuid.uuid4())[:8]
-            cambiar_pagina("instrucciones")
+        definicion = get_survey(st.session_state.encuesta)
+    except KeyError:
+        st.error(f"No existe la encuesta \"{st.session_state.encuesta}\".")
+        st.stop()
+
+    # Inicializar el estado de la sesión
+    if 'page' not in st.session_state:
+        st.session_state.page = "inicio"
+    if 'registro' not in st.session_state:
+        st.session_state.registro = ResponseRecord()  # Respuestas codificadas (session_record.py)
+    if 'evento_actual' not in st.session_state:
+        st.session_state.evento_actual = None
+    if 'n_eventos_respondidos' not in st.session_state:
+        st.session_state.n_eventos_respondidos = 0
+    if 'total_eventos' not in st.session_state:
+        st.session_state.total_eventos = definicion.total_eventos  # Número de eventos a evaluar por participante
+    if 'error_credenciales' not in st.session_state:
+        st.session_state.error_credenciales = False
+    if 'nombre_cliente' not in st.session_state:
+        st.session_state.nombre_cliente = ""
+    if 'response_id' not in st.session_state:
+        st.session_state.response_id = str(uuid.uuid4())  # ID único para cada sesión de respuesta
+
+    # Función para cambiar de página
+    def cambiar_pagina(nueva_pagina, evento=None):
+        st.session_state.page = nueva_pagina
+        if evento is not None:
+            st.session_state.evento_actual = evento
+
+    # Progreso de las encuestas en curso, guardado en cada formulario enviado
+    progreso_encuestas = get_progress_store()
+
+    # Retomar una encuesta sin terminar (?r=<response_id>) al abrir una sesión nueva
+    if 'progreso_revisado' not in st.session_state:
+        st.session_state.progreso_revisado = True
+        response_id_url = st.query_params.get("r")
+        guardado = progreso_encuestas.load(response_id_url) if response_id_url else None
+        if guardado is not None and not guardado["completed"]:
+            # La encuesta continúa con el cuestionario con el que se empezó
+            if guardado["encuesta"] and guardado["encuesta"] != definicion.id:
+                try:
+                    definicion = get_survey(guardado["encuesta"])
+                    st.session_state.encuesta = definicion.id
+                except KeyError:
+                    pass
+            st.session_state.response_id = response_id_url
+            st.session_state.nombre_cliente = guardado["nombre_cliente"]
+            st.session_state.registro = ResponseRecord(guardado["eventos"])
+            for evento, respuestas in guardado["respuestas"].items():
+                st.session_state.registro.set(evento, respuestas)
+            st.session_state.n_eventos_respondidos = len(guardado["respuestas"])
+            if guardado["eventos"]:
+                st.session_state.total_eventos = len(guardado["eventos"])
+            if guardado["demograficos"] is not None:
+                st.session_state.demograficos = guardado["demograficos"]
+                cambiar_pagina("guardar")
+            elif not guardado["eventos"]:
+                cambiar_pagina("instrucciones")
+            elif st.session_state.n_eventos_respondidos < st.session_state.total_eventos:
+                cambiar_pagina("evaluacion", guardado["eventos"][st.session_state.n_eventos_respondidos])
+            else:
+                cambiar_pagina("demograficos")
+
+    # Backend de almacenamiento configurado (CCK_STORAGE) y si las respuestas
+    # se envían también a Google Sheets
+    almacenamiento = get_storage(_spool_worksheet, list_shards=_list_shards)
+    usa_sheets = not almacenamiento.is_local or SYNC_TO_SHEETS
+
+    # Verificar credenciales en segundo plano: la comprobación se hace una vez por
+    # proceso (se repite cada CCK_CONNECTIVITY_TTL segundos) y no bloquea el render
+    if usa_sheets:
+        verificacion_conexion = get_connectivity_check(_spool_worksheet)
+        estado_conexion = verificacion_conexion.status()
+    else:
+        verificacion_conexion = None
+        estado_conexion = True
+    st.session_state.credenciales_verificadas = estado_conexion is not False
+    st.session_state.error_credenciales = estado_conexion is False
+    if estado_conexion is False:
+        st.session_state.error_mensaje = verificacion_conexion.error
+    # Con conexión, arrancar el hilo de envío aunque esta sesión no guarde nada:
+    # así se envía lo que quede en el diario (ejecuciones anteriores, replay.py)
+    if usa_sheets and estado_conexion is True:
+        get_spool_worker(_spool_worksheet, spreadsheet_key=SPREADSHEET_KEY)
+
+    # Fragmentos de Streamlit (st.fragment en versiones recientes)
+    fragment = getattr(st, "fragment", None) or st.experimental_fragment
+
+    # Función para validar el token de la página de resultados
+    def token_admin_valido(token):
+        """
+        El token se configura en la variable CCK_ADMIN_TOKEN o en el secreto
+        "admin_token". Sin token configurado la página de resultados no existe.
+        """
+        esperado = os.environ.get("CCK_ADMIN_TOKEN")
+        if not esperado:
+            # Sin secrets.toml, st.secrets lanza FileNotFoundError al consultarlo
+            try:
+                esperado = st.secrets["admin_token"]
+            except (FileNotFoundError, KeyError):
+                return False
+        return bool(esperado) and hmac.compare_digest(str(token).encode("utf-8"), str(esperado).encode("utf-8"))
+
+    # Acceso a la página de resultados: ?admin=<token>
+    if "admin" in st.query_params and token_admin_valido(st.query_params["admin"]):
+        st.session_state.page = "resultados"
+        pagina_rerun = "resultados"
+
+    # Página de resultados (administración)
+    if st.session_state.page == "resultados":
+        from analytics import get_results_aggregator
+    
+        st.title("CCK")
+        st.subheader("Resultados")
+        # Cada cuestionario tiene sus propios resultados (?encuesta=<id>)
+        st.caption(f"Cuestionario: {definicion.nombre} ({definicion.id})")
+    
+        agregador = get_results_aggregator(almacenamiento, definicion.id)
+        try:
+            agregador.refresh(force=st.button("Actualizar ahora"))
+        except Exception as e:
+            st.error(f"Error al leer las respuestas ({almacenamiento.name}): {str(e)}")
+    
+        st.caption(f"Filas procesadas: {agregador.rows}. Los datos se actualizan cada "
+                   f"{agregador.ttl:.0f} segundos solo con las filas nuevas.")
+    
+        cliente = st.selectbox("Cliente", ["Todos"] + agregador.clientes())
+        cliente = None if cliente == "Todos" else cliente
+    
+        st.markdown("### Riesgo por evento (Probabilidad × Impacto)")
+        st.dataframe(agregador.resumen("Evento", cliente), use_container_width=True)
+    
+        st.markdown("### Distribución de Autoeficacia por evento (%)")
+        st.dataframe(agregador.distribucion_autoeficacia(cliente), use_container_width=True)
+    
+        st.markdown("### Por departamento")
+        st.dataframe(agregador.resumen("Departamento", cliente), use_container_width=True)
+    
+        st.markdown("### Por nivel de cargo")
+        st.dataframe(agregador.resumen("Nivel_Cargo", cliente), use_container_width=True)
+
+        st.markdown("### Confiabilidad")
+        confiabilidad = agregador.confiabilidad(cliente)
+        if confiabilidad["alfa"] is None:
+            st.caption("No hay suficientes respuestas completas para calcular la confiabilidad.")
         else:
-            st.error("Ha decidido no participar en la encuesta. Gracias por su tiempo.")
-            st.stop()
-    
-    # Mostrar advertencia de credenciales si es necesario
-    if st.session_state.error_credenciales:
-        st.warning("⚠️ Advertencia: Hay un problema con las credenciales de Google Sheets. Las respuestas se guardarán localmente, pero no se enviarán a Google Sheets.")
-
-# Página de instrucciones
-elif st.session_state.page == "instrucciones":
-    st.title("CCK")
-    st.markdown("### Cómo llenar el cuestionario")
-    st.markdown("""
-    Se le presentará una serie de posibles eventos o situaciones sobre los cuales queremos conocer su opinión.
-    
-    Para cada uno de ellos, le pedimos que:
-    
-    1. Lea cuidadosamente cada pregunta
-    2. Seleccione la opción que mejor refleje su percepción o experiencia con respecto a la situación planteada
-    3. Use las escalas provistas para evaluar su respuesta. Cada escala está diseñada para capturar diferentes niveles de probabilidad, impacto o preparación
-    
-    Si tiene dudas sobre alguna pregunta, elija la respuesta que mejor se acerque a su opinión actual.
-    """)
-    
-    if st.button("Comenzar encuesta"):
-        # Seleccionar aleatoriamente eventos para evaluar
-        import random
-        eventos_seleccionados = random.sample(eventos_criticos, st.session_state.total_eventos)
-        st.session_state.eventos_seleccionados = eventos_seleccionados
-        cambiar_pagina("evaluacion", eventos_seleccionados[0])
-
-# Página de evaluación de eventos
-elif st.session_state.page == "evaluacion":
-    evento = st.session_state.evento_actual
-    st.title("CCK")
-    st.subheader(f"Evaluación del evento: {evento}")
-    
-    # Container para realizar un seguimiento del progreso
-    progreso = st.container()
-    progreso.progress((st.session_state.n_eventos_respondidos) / st.session_state.total_eventos)
-    progreso.write(f"Evento {st.session_state.n_eventos_respondidos + 1} de {st.session_state.total_eventos}")
-    
-    # Inicializar respuestas para este evento si no existen
-    if evento not in st.session_state.respuestas:
-        st.session_state.respuestas[evento] = {}
-    
-    # Preguntas sobre el evento
-    with st.form(key=f"form_{evento}"):
-        # Probabilidad
-        st.markdown("### Probabilidad")
-        probabilidad = st.radio(
-            f"¿Qué tan probable considera que es la ocurrencia de un evento como {evento}?",
-            ["Extremadamente improbable", "Algo improbable", "Ni probable ni improbable", 
-             "Algo probable", "Extremadamente probable"],
-            key=f"probabilidad_{evento}"
-        )
-        
-        # Ocurrencia
-        st.markdown("### Ocurrencia pasada")
-        ocurrencia = st.radio(
-            f"¿Con qué frecuencia se han presentado situaciones de {evento} en el pasado?",
-            ["Nunca", "1 vez", "Entre 2 y 3 veces", "Más de 4 veces"],
-            key=f"ocurrencia_{evento}"
-        )
-        
-        # Detección
-        st.markdown("### Detección")
-        deteccion = st.radio(
-            f"¿Qué tan fácil considera que es anticipar una situación de {evento} antes de que ocurra?",
-            ["Extremadamente difícil", "Algo difícil", "Ni fácil ni difícil", 
-             "Algo fácil", "Extremadamente fácil"],
-            key=f"deteccion_{evento}"
-        )
-        
-        # Estructura
-        st.markdown("### Estructura Organizacional")
-        estructura = st.radio(
-            f'¿Qué tan de acuerdo está con la siguiente afirmación? "La estructura y los procesos internos de la organización favorecen la probabilidad de que una situación como {evento} ocurra."',
-            ["Totalmente en desacuerdo", "Algo en desacuerdo", "Ni de acuerdo ni en desacuerdo", 
-             "Algo de acuerdo", "Totalmente de acuerdo"],
-            key=f"estructura_{evento}"
-        )
-        
-        # Impacto
-        st.markdown("### Impacto")
-        impacto = st.radio(
-            f"Si {evento} ocurriera, ¿qué tan negativo considera que sería para la organización?",
-            ["Nada negativo", "Poco negativo", "Moderadamente negativo", 
-             "Muy negativo", "Extremadamente negativo"],
-            key=f"impacto_{evento}"
-        )
-        
-        # Responsabilidad
-        st.markdown("### Responsabilidad")
-        responsabilidad = st.radio(
-            f"En caso de que ocurriera {evento}, ¿qué nivel de responsabilidad tendría la organización?",
-            ["Ninguna", "Poca", "Moderada", "Mucha", "Muchísima"],
-            key=f"responsabilidad_{evento}"
-        )
-        
-        # Autoeficacia
-        st.markdown("### Autoeficacia")
-        autoeficacia = st.radio(
-            f"¿Qué tan preparado considera que está su organización para responder ante {evento} en caso de que ocurriera?",
-            ["Nada preparado", "Poco preparada", "Moderadamente preparada", 
-             "Muy preparada", "Totalmente preparado"],
-            key=f"autoeficacia_{evento}"
-        )
+            st.metric("Alfa de Cronbach (7 dimensiones)", confiabilidad["alfa"])
+            st.caption(f"Respuestas completas: {confiabilidad['n']}")
+            st.dataframe(confiabilidad["correlaciones"], use_container_width=True)
+
+        st.markdown("### Matriz de riesgo (Probabilidad × Impacto)")
+        evento_matriz = st.selectbox("Evento", ["Todos"] + agregador.eventos(cliente))
+        evento_matriz = None if evento_matriz == "Todos" else evento_matriz
+        st.dataframe(agregador.matriz_riesgo(cliente, evento_matriz), use_container_width=True)
+
+        # Cobertura de la asignación de eventos (contadores de sampling.py)
+        if SAMPLING == "cobertura" and cliente is not None:
+            st.markdown("### Cobertura de eventos")
+            eventos_cliente, _ = definicion.variante(cliente)
+            st.dataframe(
+                [{"Evento": evento, "Asignados": asignados, "Completados": completados}
+                 for evento, asignados, completados in
+                 get_coverage_sampler().coverage(definicion.id, cliente, eventos_cliente)],
+                use_container_width=True, hide_index=True)
+            if SAMPLE_TARGET:
+                st.caption(f"Objetivo: {SAMPLE_TARGET} respuestas completas por evento.")
+
+        # Exportación completa: se escribe por bloques en un archivo local y se
+        # ofrece para descarga desde el disco
+        st.markdown("### Exportar respuestas")
+        with st.form(key="exportar_form"):
+            col_desde, col_hasta, col_formato, col_valores = st.columns(4)
+            desde = col_desde.date_input("Desde", value=None, format="DD/MM/YYYY")
+            hasta = col_hasta.date_input("Hasta", value=None, format="DD/MM/YYYY")
+            formato = col_formato.selectbox("Formato", ["csv", "parquet"])
+            valores = col_valores.selectbox("Valores", ["Etiquetas", "Códigos", "Códigos y etiquetas"])
+            exportar = st.form_submit_button("Generar exportación")
+
+        if exportar:
+            from export import EXPORT_DIR, export_responses, prune_exports
+
+            # Las exportaciones antiguas se borran antes de escribir una nueva
+            prune_exports()
+            ruta = os.path.join(EXPORT_DIR, f"respuestas_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{formato}")
+            try:
+                total = export_responses(almacenamiento, ruta, formato,
+                                         cliente=cliente, desde=desde, hasta=hasta, encuesta=definicion.id,
+                                         decodificar=valores == "Etiquetas",
+                                         etiquetas=valores == "Códigos y etiquetas")
+            except Exception as e:
+                st.error(f"Error al exportar las respuestas: {str(e)}")
+            else:
+                # El botón se muestra solo en el rerun que genera el archivo, de modo
+                # que el archivo se lee una vez y no en cada rerun de la página
+                with open(ruta, "rb") as archivo:
+                    st.download_button(
+                        label=f"Descargar {os.path.basename(ruta)} ({total} filas)",
+                        data=archivo,
+                        file_name=os.path.basename(ruta),
+                        mime="text/csv" if ruta.endswith(".csv") else "application/octet-stream"
+                    )
+
+    # Página de inicio y consentimiento
+    elif st.session_state.page == "inicio":
+        st.title("CCK")
+        st.markdown("### Introducción y Consentimiento")
+        st.markdown("""
+        El propósito de este cuestionario es evaluar su percepción sobre la probabilidad, el impacto 
+        y la preparación de su organización frente a una serie de posibles eventos críticos. Sus 
+        respuestas nos ayudarán a identificar áreas clave para mejorar los procesos internos, la 
+        detección temprana y la preparación organizacional.
+    
+        La participación es completamente anónima y voluntaria, y sus respuestas serán utilizadas 
+        únicamente con fines de evaluación interna. No serán compartidas con terceros bajo ninguna 
+        circunstancia.
+    
+        Por favor, responda cada pregunta basándose en su experiencia y percepción actual sobre estos eventos. 
+        No existen respuestas correctas o incorrectas.
+    
+        El tiempo estimado para completar el cuestionario es de 5 a 10 minutos.
+        """)
+    
+        # Añadir campo para nombre del cliente
+        st.session_state.nombre_cliente = st.text_input("Nombre del cliente/organización:", 
+                                                       value=st.session_state.nombre_cliente)
+    
+        consentimiento = st.radio("Por favor, indique su consentimiento a continuación:", 
+                                 ["Estoy de acuerdo, deseo continuar", "No estoy de acuerdo, deseo salir."])
+    
+        if st.button("Continuar"):
+            if consentimiento == "Estoy de acuerdo, deseo continuar":
+                # Generar un nuevo ID de respuesta al comenzar una nueva encuesta
+                st.session_state.response_id = str(uuid.uuid4())
+                progreso_encuestas.start(st.session_state.response_id, st.session_state.nombre_cliente,
+                                         definicion.id)
+                st.query_params["r"] = st.session_state.response_id
+                cambiar_pagina("instrucciones")
+            else:
+                st.error("Ha decidido no participar en la encuesta. Gracias por su tiempo.")
+                st.stop()
+    
+        # Mostrar advertencia de credenciales si es necesario. Mientras la
+        # verificación sigue en curso, el fragmento se refresca solo cada 2 segundos
+        @fragment(run_every=2 if estado_conexion is None else None)
+        def aviso_credenciales():
+            if verificacion_conexion.status() is False:
+                st.warning("⚠️ Advertencia: Hay un problema con las credenciales de Google Sheets. Las respuestas se guardarán localmente, pero no se enviarán a Google Sheets.")
+    
+        if usa_sheets:
+            aviso_credenciales()
+
+    # Página de instrucciones
+    elif st.session_state.page == "instrucciones":
+        st.title("CCK")
+        st.markdown("### Cómo llenar el cuestionario")
+        st.markdown("""
+        Se le presentará una serie de posibles eventos o situaciones sobre los cuales queremos conocer su opinión.
+    
+        Para cada uno de ellos, le pedimos que:
+    
+        1. Lea cuidadosamente cada pregunta
+        2. Seleccione la opción que mejor refleje su percepción o experiencia con respecto a la situación planteada
+        3. Use las escalas provistas para evaluar su respuesta. Cada escala está diseñada para capturar diferentes niveles de probabilidad, impacto o preparación
+    
+        Si tiene dudas sobre alguna pregunta, elija la respuesta que mejor se acerque a su opinión actual.
+        """)
+    
+        if st.button("Comenzar encuesta"):
+            # Seleccionar los eventos a evaluar (según la variante del cliente): por defecto
+            # los menos cubiertos para el cliente, ver sampling.py
+            eventos_cliente, st.session_state.total_eventos = definicion.variante(st.session_state.nombre_cliente)
+            eventos_seleccionados = select_events(definicion.id, st.session_state.nombre_cliente,
+                                                  eventos_cliente, st.session_state.total_eventos)
+            st.session_state.registro = ResponseRecord(eventos_seleccionados)
+            progreso_encuestas.start(st.session_state.response_id, st.session_state.nombre_cliente,
+                                     definicion.id, eventos_seleccionados)
+            cambiar_pagina("evaluacion", eventos_seleccionados[0])
+
+    # Página de evaluación de eventos
+    elif st.session_state.page == "evaluacion":
+        evento = st.session_state.evento_actual
+        st.title("CCK")
+        st.subheader(f"Evaluación del evento: {evento}")
+    
+        # Container para realizar un seguimiento del progreso
+        progreso = st.container()
+        progreso.progress((st.session_state.n_eventos_respondidos) / st.session_state.total_eventos)
+        progreso.write(f"Evento {st.session_state.n_eventos_respondidos + 1} de {st.session_state.total_eventos}")
+    
+        # Preguntas sobre el evento, generadas a partir de la definición del cuestionario
+        with st.form(key=f"form_{evento}"):
+            valores = {}
+            for campo, clave, titulo, texto, opciones in definicion.preguntas(evento):
+                st.markdown(f"### {titulo}")
+                valores[campo] = st.radio(texto, opciones, key=clave)
         
-        # Botón para enviar respuestas
-        submitted = st.form_submit_button("Siguiente")
+            # Botón para enviar respuestas
+            submitted = st.form_submit_button("Siguiente")
         
-        if submitted:
-            # Guardar respuestas
-            st.session_state.respuestas[evento] = {
-                "Evento": evento,
-                "Probabilidad": probabilidad,
-                "Ocurrencia": ocurrencia,
-                "Detección": deteccion,
-                "Estructura": estructura,
-                "Impacto": impacto,
-                "Responsabilidad": responsabilidad,
-                "Autoeficacia": autoeficacia
-            }
+            if submitted:
+                # Guardar respuestas
+                st.session_state.registro.set(evento, valores)
+                progreso_encuestas.save_answer(st.session_state.response_id, evento,
+                                               {"Evento": evento, **valores})
             
-            # Incrementar contador de eventos respondidos
-            st.session_state.n_eventos_respondidos += 1
+                # Incrementar contador de eventos respondidos
+                st.session_state.n_eventos_respondidos += 1
             
-            # Determinar si pasar al siguiente evento o a los datos demográficos
-            if st.session_state.n_eventos_respondidos < st.session_state.total_eventos:
-                siguiente_evento = st.session_state.eventos_seleccionados[st.session_state.n_eventos_respondidos]
-                cambiar_pagina("evaluacion", siguiente_evento)
-            else:
-                cambiar_pagina("demograficos")
+                # Determinar si pasar al siguiente evento o a los datos demográficos
+                if st.session_state.n_eventos_respondidos < st.session_state.total_eventos:
+                    siguiente_evento = st.session_state.registro.etiquetas_eventos[st.session_state.n_eventos_respondidos]
+                    cambiar_pagina("evaluacion", siguiente_evento)
+                else:
+                    cambiar_pagina("demograficos")
             
-            st.rerun()
+                st.rerun()
 
-# Página de datos demográficos
-elif st.session_state.page == "demograficos":
-    st.title("CCK")
-    st.subheader("Datos demográficos")
-    
-    st.markdown("""
-    Por último... Antes de finalizar quisiéramos reunir algunos datos sobre su cargo y 
-    experiencia en la organización. La información suministrada es estrictamente confidencial y no 
-    será compartida con otros miembros de la organización. Su uso se limitará estrictamente para 
-    el análisis de vulnerabilidades.
-    """)
-    
-    with st.form(key="demograficos_form"):
-        # Nivel de cargo
-        nivel = st.selectbox(
-            "¿Cuál es su nivel de cargo actual dentro de la organización?",
-            ["C-Level (Ejecutivo: CEO, CFO, COO, etc.)", "Director", "Gerente", 
-             "Coordinador/Supervisor", "Analista/Especialista", "Asistente/Operativo"]
-        )
+    # Página de datos demográficos
+    elif st.session_state.page == "demograficos":
+        st.title("CCK")
+        st.subheader("Datos demográficos")
+    
+        st.markdown("""
+        Por último... Antes de finalizar quisiéramos reunir algunos datos sobre su cargo y 
+        experiencia en la organización. La información suministrada es estrictamente confidencial y no 
+        será compartida con otros miembros de la organización. Su uso se limitará estrictamente para 
+        el análisis de vulnerabilidades.
+        """)
+    
+        with st.form(key="demograficos_form"):
+            # Nivel de cargo
+            nivel = st.selectbox(
+                "¿Cuál es su nivel de cargo actual dentro de la organización?",
+                NIVELES_CARGO
+            )
         
-        # Fecha de inicio
-        antiguedad = st.date_input(
-            "¿En qué fecha comenzó a trabajar en la organización?",
-            format="DD/MM/YYYY"
-        )
+            # Fecha de inicio
+            antiguedad = st.date_input(
+                "¿En qué fecha comenzó a trabajar en la organización?",
+                format="DD/MM/YYYY"
+            )
         
-        # Departamento
-        departamento = st.selectbox(
-            "¿A qué área o departamento pertenece dentro de la organización?",
-            ["Dirección General", "Recursos Humanos", "Finanzas", "Operaciones", 
-             "Tecnología/IT", "Marketing y Ventas", "Logística y Cadena de Suministro", 
-             "Legal y Cumplimiento", "Investigación y Desarrollo"]
-        )
+            # Departamento
+            departamento = st.selectbox(
+                "¿A qué área o departamento pertenece dentro de la organización?",
+                DEPARTAMENTOS
+            )
         
-        # Botón para enviar datos demográficos
-        submit_demo = st.form_submit_button("Finalizar encuesta")
+            # Botón para enviar datos demográficos
+            submit_demo = st.form_submit_button("Finalizar encuesta")
         
-        if submit_demo:
-            # Guardar datos demográficos
-            st.session_state.demograficos = {
-                "Nivel_Cargo": nivel,
-                "Fecha_Inicio": antiguedad.strftime("%d/%m/%Y"),
-                "Departamento": departamento
-            }
+            if submit_demo:
+                # Guardar datos demográficos
+                st.session_state.demograficos = {
+                    "Nivel_Cargo": nivel,
+                    "Fecha_Inicio": antiguedad.strftime("%d/%m/%Y"),
+                    "Departamento": departamento
+                }
+                progreso_encuestas.save_demograficos(st.session_state.response_id, st.session_state.demograficos)
             
-            cambiar_pagina("guardar")
-            st.rerun()
+                cambiar_pagina("guardar")
+                st.rerun()
 
-# Página para guardar los datos
-elif st.session_state.page == "guardar":
-    st.title("CCK")
-    st.subheader("Guardando sus respuestas")
+    # Página para guardar los datos
+    elif st.session_state.page == "guardar":
+        st.title("CCK")
+        st.subheader("Guardando sus respuestas")
     
-    # Fecha y hora actual
-    fecha_hora_actual = datetime.now().strftime("%d/%m/%Y %H:%M:%S")
+        # Fecha y hora actual
+        fecha_hora_actual = datetime.now().strftime("%d/%m/%Y %H:%M:%S")
     
-    # Obtener el worksheet para guardar datos
-    worksheet = None
-    if st.session_state.credenciales_verificadas:
-        try:
-            worksheet = connect_to_gsheets("Respuestas Encuesta CCK")
-        except Exception as e:
-            st.error(f"Error al conectar con Google Sheets: {str(e)}")
-            st.session_state.error_credenciales = True
-    
-    # Crear un diccionario con todas las respuestas (una fila por evento)
-    guardar_exitoso = True
-    progress_bar = st.progress(0)
-    
-    for i, (evento, respuestas) in enumerate(st.session_state.respuestas.items()):
-        # Preparar datos para este evento específico
-        datos_evento = {
-            "ID_Respuesta": st.session_state.response_id,
-            "Nombre_Cliente": st.session_state.nombre_cliente,
-            "Fecha_Respuesta": fecha_hora_actual,
-            "Nivel_Cargo": st.session_state.demograficos["Nivel_Cargo"],
-            "Fecha_Inicio": st.session_state.demograficos["Fecha_Inicio"],
-            "Departamento": st.session_state.demograficos["Departamento"],
-            "Evento": evento,
-            "Probabilidad": respuestas["Probabilidad"],
-            "Ocurrencia": respuestas["Ocurrencia"],
-            "Detección": respuestas["Detección"],
-            "Estructura": respuestas["Estructura"],
-            "Impacto": respuestas["Impacto"],
-            "Responsabilidad": respuestas["Responsabilidad"],
-            "Autoeficacia": respuestas["Autoeficacia"]
-        }
-        
-        # Guardar datos en Google Sheets para este evento
-        if worksheet and not st.session_state.error_credenciales:
+        # Preparar todas las filas de la respuesta (una fila por evento)
+        filas = build_rows(
+            st.session_state.response_id,
+            st.session_state.nombre_cliente,
+            fecha_hora_actual,
+            st.session_state.demograficos,
+            st.session_state.registro.as_dict(),
+            definicion.id
+        )
+    
+        # Las filas se guardan codificadas con el libro de códigos vigente
+        filas_codificadas = encode_rows(filas, RESPONSE_COLUMNS)
+    
+        guardar_exitoso = True
+    
+        # Si la encuesta ya se marcó como terminada (p. ej. un rerun de esta página)
+        # no se vuelve a enviar
+        ya_guardada = progreso_encuestas.is_completed(st.session_state.response_id)
+    
+        # Con un backend local (SQLite o Parquet) la respuesta se escribe en el momento
+        # (una sola vez por respuesta aunque la página se ejecute varias veces a la vez)
+        indice_envios = get_submission_index()
+        if (almacenamiento.is_local and not ya_guardada
+                and indice_envios.claim(st.session_state.response_id, almacenamiento.name)):
             try:
-                if not save_response(worksheet, datos_evento):
-                    st.session_state.error_credenciales = True
-                    guardar_exitoso = False
-                    break
+                almacenamiento.append_rows(filas_codificadas)
             except Exception as e:
-                st.error(f"Error al guardar respuesta para evento {evento}: {str(e)}")
-                st.session_state.error_credenciales = True
+                indice_envios.release(st.session_state.response_id, almacenamiento.name)
+                st.error(f"Error al guardar las respuestas ({almacenamiento.name}): {str(e)}")
                 guardar_exitoso = False
-                break
-        
-        # Actualizar barra de progreso
-        progress_bar.progress((i + 1) / len(st.session_state.respuestas))
     
-    # Mensajes de éxito o error
-    if not st.session_state.error_credenciales and guardar_exitoso:
-        st.success("¡Gracias por completar la encuesta! Sus respuestas han sido guardadas correctamente.")
+        # Registrar la respuesta en el diario local; un hilo en segundo plano
+        # la enviará a Google Sheets junto con las de otras sesiones
+        if usa_sheets and not ya_guardada:
+            try:
+                get_spool_worker(_spool_worksheet, spreadsheet_key=SPREADSHEET_KEY).submit(st.session_state.response_id, filas_codificadas)
+            except Exception as e:
+                st.error(f"Error al registrar las respuestas: {str(e)}")
+                if not almacenamiento.is_local:
+                    guardar_exitoso = False
     
-    # Si hay problemas con las credenciales, ofrecer descarga
-    if st.session_state.error_credenciales or not guardar_exitoso:
-        st.warning("No se pudieron guardar todas las respuestas en Google Sheets.")
-        st.info("Sus respuestas están listas para ser descargadas como archivo CSV.")
-        
-        # Preparar datos para descarga
-        todas_respuestas = []
-        for evento, respuestas in st.session_state.respuestas.items():
-            datos_evento = {
-                "ID_Respuesta": st.session_state.response_id,
-                "Nombre_Cliente": st.session_state.nombre_cliente,
-                "Fecha_Respuesta": fecha_hora_actual,
-                "Nivel_Cargo": st.session_state.demograficos["Nivel_Cargo"],
-                "Fecha_Inicio": st.session_state.demograficos["Fecha_Inicio"],
-                "Departamento": st.session_state.demograficos["Departamento"],
-                "Evento": evento,
-                "Probabilidad": respuestas["Probabilidad"],
-                "Ocurrencia": respuestas["Ocurrencia"],
-                "Detección": respuestas["Detección"],
-                "Estructura": respuestas["Estructura"],
-                "Impacto": respuestas["Impacto"],
-                "Responsabilidad": respuestas["Responsabilidad"],
-                "Autoeficacia": respuestas["Autoeficacia"]
-            }
-            todas_respuestas.append(datos_evento)
-        
-        # Crear DataFrame para descargar
-        df_respuestas = pd.DataFrame(todas_respuestas)
-        csv = df_respuestas.to_csv(index=False)
-        
-        st.download_button(
-            label="Descargar respuestas como CSV",
-            data=csv,
-            file_name=f"encuesta_cck_respuestas_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
-            mime="text/csv"
-        )
+        # Si no se pudo usar el diario local, intentar escribir directamente en la hoja
+        # (compartiendo el presupuesto de escrituras con el hilo de envío)
+        if not guardar_exitoso and not almacenamiento.is_local and st.session_state.credenciales_verificadas:
+            shard = shard_for(st.session_state.nombre_cliente)
+            if not indice_envios.claim(st.session_state.response_id, "sheets"):
+                # Otra ejecución de esta página ya la registró
+                guardar_exitoso = True
+            else:
+                if acquire_write_budget(shard, timeout=10):
+                    worksheet = connect_to_gsheets("Respuestas Encuesta CCK", shard)
+                    guardar_exitoso = save_response(worksheet, filas_codificadas)
+                if not guardar_exitoso:
+                    indice_envios.release(st.session_state.response_id, "sheets")
+    
+        # La respuesta completa ya está enviada: solo queda marcarla como terminada
+        if guardar_exitoso and not ya_guardada:
+            # La cobertura se cuenta una sola vez por respuesta: complete()
+            # devuelve False si otra sesión o un rerun ya la había terminado
+            if progreso_encuestas.complete(st.session_state.response_id) and SAMPLING == "cobertura":
+                get_coverage_sampler().complete(definicion.id, st.session_state.nombre_cliente,
+                                                st.session_state.registro.etiquetas_eventos)
     
-    # Botón para reiniciar la encuesta
-    if st.button("Iniciar nueva encuesta"):
-        # Mantener solo el estado de las credenciales y nombre del cliente
-        credenciales_verificadas = st.session_state.credenciales_verificadas
-        error_credenciales = st.session_state.error_credenciales
-        nombre_cliente = st.session_state.nombre_cliente
+        # Mensajes de éxito o error
+        if guardar_exitoso:
+            st.success("¡Gracias por completar la encuesta! Sus respuestas han sido guardadas correctamente.")
+    
+        # Si no se pudieron guardar, ofrecer descarga
+        else:
+            st.warning("No se pudieron guardar todas las respuestas.")
+            st.info("Sus respuestas están listas para ser descargadas como archivo CSV.")
         
-        if hasattr(st.session_state, 'error_mensaje'):
-            error_mensaje = st.session_state.error_mensaje
+            # Generar el CSV para descargar
+            csv = rows_to_csv(filas)
         
-        # Reiniciar el resto de valores del estado de sesión
-        for key in list(st.session_state.keys()):
-            del st.session_state[key]
+            st.download_button(
+                label="Descargar respuestas como CSV",
+                data=csv,
+                file_name=f"encuesta_cck_respuestas_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
+                mime="text/csv"
+            )
+    
+        # Botón para reiniciar la encuesta
+        if st.button("Iniciar nueva encuesta"):
+            # Mantener solo el nombre del cliente y el cuestionario (el estado de las credenciales
+            # se obtiene de la verificación del proceso en cada rerun)
+            nombre_cliente = st.session_state.nombre_cliente
+            encuesta = st.session_state.encuesta
         
-        # Restaurar el estado de las credenciales y nombre del cliente
-        st.session_state.credenciales_verificadas = credenciales_verificadas
-        st.session_state.error_credenciales = error_credenciales
-        st.session_state.nombre_cliente = nombre_cliente
+            # Reiniciar el resto de valores del estado de sesión
+            st.session_state.clear()
         
-        if 'error_mensaje' in locals():
-            st.session_state.error_mensaje = error_mensaje
+            # Restaurar el nombre del cliente
+            st.session_state.nombre_cliente = nombre_cliente
+            st.session_state.encuesta = encuesta
+            st.session_state.progreso_revisado = True
+            if "r" in st.query_params:
+                del st.query_params["r"]
         
-        st.rerun()
+            st.rerun()
+
+    # Añadir información en el pie de página
+    st.markdown("---")
+    st.info("Esta encuesta es confidencial y los datos recopilados serán utilizados únicamente con fines estadísticos.")
+
+finally:
+    # Registrar el tiempo de render de la página, también en los reruns
+    # cortados por st.rerun() o st.stop() (envíos de formularios)
+    metrics.observe("cck_page_render_seconds", time.perf_counter() - inicio_rerun, page=pagina_rerun)
 
-# Añadir información en el pie de página
-st.markdown("---")
-st.info("Esta encuesta es confidencial y los datos recopilados serán utilizados únicamente con fines estadísticos.")
\ No newline at end of file
+    if profiler is not None:
+        profiler.disable()
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        profiler.dump_stats(os.path.join(
+            PROFILE_DIR, f"{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}_{pagina_rerun}.prof"))
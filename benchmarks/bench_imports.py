@@ -0,0 +1,126 @@
+"""
+Benchmark del tiempo de arranque (importaciones) de app.py.
+
+Ejecuta varias veces, cada una en un proceso nuevo con `python -X importtime`,
+el primer rerun de app.py (página "inicio") con AppTest y la hoja en memoria.
+Streamlit y AppTest se importan antes de medir, de modo que solo se cuenta lo
+que carga la propia aplicación. Informa:
+  - el tiempo del primer rerun en frío y de un rerun posterior (mediana),
+  - el tiempo acumulado de importación de cada módulo de primer nivel cargado
+    durante el primer rerun (mediana), ordenado de mayor a menor,
+  - si se cargaron las dependencias pesadas que deben ser diferidas.
+
+Uso:
+    python benchmarks/bench_imports.py --runs 5
+"""
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Dependencias que no deben cargarse en la primera página
+DEFERRED_MODULES = ("pandas", "gspread", "google.oauth2", "pyarrow", "numpy")
+
+_RUNNER = """
+import sys, time
+from streamlit.testing.v1 import AppTest
+sys.stderr.write("INICIO_APP\\n")
+sys.stderr.flush()
+at = AppTest.from_file(sys.argv[1], default_timeout=60)
+start = time.perf_counter()
+at.run()
+cold = time.perf_counter() - start
+start = time.perf_counter()
+at.run()
+warm = time.perf_counter() - start
+print("TIEMPOS:%f,%f" % (cold, warm))
+print("CARGADOS:" + ",".join(m for m in {deferred!r} if m in sys.modules))
+"""
+
+_IMPORTTIME = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|( *)(\S+)")
+
+
+def run_once(env):
+    code = _RUNNER.format(deferred=DEFERRED_MODULES)
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code, os.path.join(ROOT, "app.py")],
+        cwd=ROOT, env=env, capture_output=True, text=True,
+    )
+
+    cumulative = {}
+    measuring = False
+    for line in result.stderr.splitlines():
+        if line.startswith("INICIO_APP"):
+            measuring = True
+            continue
+        match = _IMPORTTIME.match(line)
+        # Solo módulos de primer nivel importados durante el rerun
+        if measuring and match and len(match.group(3)) == 1:
+            cumulative[match.group(4)] = int(match.group(2)) / 1000.0
+    cold = warm = None
+    loaded = []
+    for line in result.stdout.splitlines():
+        if line.startswith("TIEMPOS:"):
+            cold, warm = (float(v) for v in line[len("TIEMPOS:"):].split(","))
+        if line.startswith("CARGADOS:"):
+            loaded = [m for m in line[len("CARGADOS:"):].split(",") if m]
+    return cold, warm, cumulative, loaded, result.returncode
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="procesos a lanzar")
+    parser.add_argument("--top", type=int, default=15, help="módulos a mostrar")
+    parser.add_argument("--output", default=None, help="archivo donde guardar también el informe")
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    env["CCK_SHEETS_BACKEND"] = "memory"
+    env.setdefault("CCK_DATA_DIR", tempfile.mkdtemp(prefix="cck_bench_"))
+
+    colds, warms = [], []
+    per_module = defaultdict(list)
+    loaded = set()
+    for _ in range(args.runs):
+        cold, warm, cumulative, run_loaded, returncode = run_once(env)
+        if returncode != 0 or cold is None:
+            print("No se pudo ejecutar app.py con AppTest (¿están instaladas las dependencias?)")
+            return 1
+        colds.append(cold)
+        warms.append(warm)
+        for module, ms in cumulative.items():
+            per_module[module].append(ms)
+        loaded.update(run_loaded)
+
+    lines = [
+        f"Ejecuciones: {args.runs}",
+        f"Primer rerun (frío): mediana {statistics.median(colds) * 1000:.0f} ms, "
+        f"mínimo {min(colds) * 1000:.0f} ms",
+        f"Rerun posterior: mediana {statistics.median(warms) * 1000:.0f} ms",
+        "",
+        f"{'Módulo':<40}{'ms (mediana)':>14}",
+    ]
+    ranking = sorted(per_module.items(), key=lambda item: statistics.median(item[1]), reverse=True)
+    for module, values in ranking[:args.top]:
+        lines.append(f"{module:<40}{statistics.median(values):>14.1f}")
+    lines += [
+        "",
+        "Dependencias diferidas cargadas al arrancar: " + (", ".join(sorted(loaded)) or "ninguna"),
+    ]
+
+    report = "\n".join(lines)
+    print(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(report + "\n")
+    return 1 if loaded else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,93 @@
+"""
+Benchmark de la asignación de eventos: participantes necesarios para que
+cada evento reúna `--target` respuestas completas.
+
+Simula participantes de un cliente que reciben `--events` eventos elegidos:
+  - "aleatorio": random.sample, como antes,
+  - "cobertura": sampling.CoverageSampler (contadores en una base temporal).
+Cada participante abandona la encuesta con probabilidad `--abandono` (sus
+eventos quedan asignados pero no completados). Se repite `--runs` veces y se
+muestra la media de participantes y de filas guardadas hasta alcanzar el
+objetivo en todos los eventos, y el tiempo por asignación.
+
+Uso:
+    python benchmarks/bench_sampling.py --target 30 --events 3 --runs 20
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from sampling import CoverageSampler  # noqa: E402
+from schema import EVENTOS  # noqa: E402
+
+
+def simulate(assign, complete, target, n_events, abandono):
+    """Participantes y filas completas hasta que todos los eventos llegan al objetivo."""
+    completados = dict.fromkeys(EVENTOS, 0)
+    participantes = filas = 0
+    while min(completados.values()) < target:
+        participantes += 1
+        eventos = assign(n_events)
+        if random.random() < abandono:
+            continue
+        complete(eventos)
+        filas += len(eventos)
+        for evento in eventos:
+            completados[evento] += 1
+    return participantes, filas
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target", type=int, default=30, help="respuestas completas por evento")
+    parser.add_argument("--events", type=int, default=3, help="eventos por participante")
+    parser.add_argument("--abandono", type=float, default=0.1, help="probabilidad de abandonar la encuesta")
+    parser.add_argument("--runs", type=int, default=20, help="repeticiones de la simulación")
+    args = parser.parse_args()
+
+    resultados = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for estrategia in ("aleatorio", "cobertura"):
+            totales, segundos, asignaciones = [], 0.0, 0
+            for run in range(args.runs):
+                if estrategia == "aleatorio":
+                    def assign(n):
+                        return random.sample(EVENTOS, n)
+
+                    def complete(eventos):
+                        pass
+                else:
+                    sampler = CoverageSampler(os.path.join(tmp, f"cobertura_{run}.sqlite3"),
+                                              target=args.target)
+
+                    def assign(n, sampler=sampler):
+                        return sampler.assign("bench", "Cliente", EVENTOS, n)
+
+                    def complete(eventos, sampler=sampler):
+                        sampler.complete("bench", "Cliente", eventos)
+
+                inicio = time.perf_counter()
+                participantes, filas = simulate(assign, complete, args.target, args.events, args.abandono)
+                segundos += time.perf_counter() - inicio
+                asignaciones += participantes
+                totales.append((participantes, filas))
+            resultados[estrategia] = (sum(p for p, _ in totales) / args.runs,
+                                      sum(f for _, f in totales) / args.runs,
+                                      segundos / asignaciones * 1e6)
+
+    print(f"{'Estrategia':>12}{'Participantes':>16}{'Filas':>10}{'µs/asignación':>16}")
+    for estrategia, (participantes, filas, us) in resultados.items():
+        print(f"{estrategia:>12}{participantes:>16.0f}{filas:>10.0f}{us:>16.0f}")
+    ahorro = 1 - resultados["cobertura"][0] / resultados["aleatorio"][0]
+    print(f"Participantes necesarios con cobertura: {ahorro:.0%} menos")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,79 @@
+"""
+Benchmark de memoria de las respuestas guardadas por sesión.
+
+Crea N sesiones simuladas con todos los eventos respondidos y mide con
+tracemalloc los bytes asignados por sesión en dos representaciones:
+  - "dict": diccionario evento -> {campo: etiqueta} (la representación anterior),
+  - "record": session_record.ResponseRecord (códigos en arrays de bytes).
+Las etiquetas son las cadenas del libro de códigos, compartidas por todas las
+sesiones como en la aplicación, así que solo se mide la estructura de cada sesión.
+
+Falla (código 1) si un ResponseRecord supera SESSION_BUDGET_BYTES.
+
+Uso:
+    python benchmarks/bench_session.py --sessions 1000 10000 --events 3
+"""
+import argparse
+import os
+import random
+import sys
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from schema import DIMENSIONES, ESCALAS, EVENTOS  # noqa: E402
+from session_record import SESSION_BUDGET_BYTES, ResponseRecord  # noqa: E402
+
+
+def synthetic_answers(n_events):
+    eventos = random.sample(EVENTOS, n_events)
+    return eventos, {e: {c: random.choice(ESCALAS[c]) for c in DIMENSIONES} for e in eventos}
+
+
+def build_dict(eventos, respuestas):
+    return {e: {"Evento": e, **respuestas[e]} for e in eventos}
+
+
+def build_record(eventos, respuestas):
+    registro = ResponseRecord(eventos)
+    for evento in eventos:
+        registro.set(evento, respuestas[evento])
+    return registro
+
+
+def measure(builder, inputs):
+    """Bytes asignados (y retenidos) por sesión al construir todas las sesiones."""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    sessions = [builder(eventos, respuestas) for eventos, respuestas in inputs]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    # La lista que contiene las sesiones no es parte de ninguna sesión
+    return (after - before - sys.getsizeof(sessions)) / len(sessions)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1000, 10000], help="sesiones simuladas")
+    parser.add_argument("--events", type=int, default=3, help="eventos respondidos por sesión")
+    args = parser.parse_args()
+
+    print(f"{'Sesiones':>10}{'dict bytes/sesión':>20}{'record bytes/sesión':>22}{'Total record':>16}")
+    over_budget = False
+    for n in args.sessions:
+        inputs = [synthetic_answers(args.events) for _ in range(n)]
+        dict_bytes = measure(build_dict, inputs)
+        record_bytes = measure(build_record, inputs)
+        over_budget |= record_bytes > SESSION_BUDGET_BYTES
+        print(f"{n:>10}{dict_bytes:>20.0f}{record_bytes:>22.0f}{record_bytes * n / 1024:>13.0f} KB")
+
+    print(f"Presupuesto por registro: {SESSION_BUDGET_BYTES} bytes")
+    if over_budget:
+        print("ERROR: ResponseRecord supera el presupuesto de memoria por sesión")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
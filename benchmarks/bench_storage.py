@@ -0,0 +1,99 @@
+"""
+Benchmark de escritura y lectura de los backends de almacenamiento locales.
+
+Escribe respuestas sintéticas codificadas (una fila por evento) en lotes del
+tamaño de una respuesta, como lo hace la página "guardar", y después las lee
+completas en bloques. Informa filas/s de escritura y de lectura por backend
+y, con parquet, el tiempo de la compactación (que en la aplicación hace un
+hilo en segundo plano, fuera de la escritura) y los archivos que quedan.
+
+Uso:
+    python benchmarks/bench_storage.py --rows 20000 --backends sqlite parquet
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+import uuid
+from datetime import date, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from codebook import CODEBOOK, CODEBOOK_VERSION  # noqa: E402
+from schema import DIMENSIONES, EVENTOS  # noqa: E402
+
+
+def synthetic_response(clientes, dias):
+    response_id = uuid.uuid4().hex[:8]
+    cliente = random.choice(clientes)
+    fecha = (date(2025, 1, 1) + timedelta(days=random.randrange(dias))).strftime("%d/%m/%Y 10:00:00")
+    nivel = random.randint(1, len(CODEBOOK["Nivel_Cargo"]))
+    departamento = random.randint(1, len(CODEBOOK["Departamento"]))
+    return [
+        [response_id, cliente, fecha, nivel, "2020", departamento, evento]
+        + [random.randint(1, len(CODEBOOK[d])) for d in DIMENSIONES]
+        + [CODEBOOK_VERSION]
+        for evento in random.sample(range(1, len(EVENTOS) + 1), 5)
+    ]
+
+
+def run(backend, args, directory):
+    from storage import ParquetStorage, SQLiteStorage
+
+    if backend == "sqlite":
+        storage = SQLiteStorage(os.path.join(directory, "respuestas.sqlite3"))
+    else:
+        # Sin espera para compactar: el benchmark escribe en pocos segundos
+        storage = ParquetStorage(os.path.join(directory, "parquet"), compact_age=0)
+    compact_elapsed = 0.0
+
+    clientes = [f"Cliente {i}" for i in range(args.clients)]
+    responses = [synthetic_response(clientes, args.days) for _ in range(args.rows // 5)]
+    rows = sum(len(r) for r in responses)
+
+    start = time.perf_counter()
+    for response in responses:
+        storage.append_rows(response)
+    write_elapsed = time.perf_counter() - start
+
+    if backend == "parquet":
+        start = time.perf_counter()
+        storage.compact()
+        compact_elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    read = sum(len(chunk) for chunk in storage.iter_rows(args.chunk_rows))
+    read_elapsed = time.perf_counter() - start
+    files = len(storage.files()) if backend == "parquet" else 1
+    return rows, write_elapsed, compact_elapsed, read, read_elapsed, files
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=20000, help="filas a escribir (5 por respuesta)")
+    parser.add_argument("--clients", type=int, default=5, help="clientes distintos")
+    parser.add_argument("--days", type=int, default=5, help="fechas distintas (particiones por cliente)")
+    parser.add_argument("--chunk-rows", type=int, default=20000, help="filas por bloque de lectura")
+    parser.add_argument("--backends", nargs="+", default=["sqlite", "parquet"],
+                        choices=["sqlite", "parquet"])
+    args = parser.parse_args()
+
+    print(f"{'Backend':<10}{'Filas':>8}{'Escritura filas/s':>20}{'Compactación s':>16}"
+          f"{'Lectura filas/s':>18}{'Archivos':>10}")
+    for backend in args.backends:
+        with tempfile.TemporaryDirectory(prefix="cck_storage_") as directory:
+            try:
+                rows, write_elapsed, compact_elapsed, read, read_elapsed, files = run(backend, args, directory)
+            except RuntimeError as e:
+                print(f"{backend:<10}{str(e)}")
+                continue
+        print(f"{backend:<10}{rows:>8}{rows / write_elapsed:>20.0f}{compact_elapsed:>16.2f}"
+              f"{read / read_elapsed:>18.0f}{files:>10}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,201 @@
+"""
+Benchmark de carga de la encuesta.
+
+Recorre el flujo completo de páginas (inicio -> instrucciones -> evaluacion x
+total_eventos -> demograficos -> guardar) para N encuestados simulados con
+`streamlit.testing.v1.AppTest`, sin navegador, contra la hoja en memoria de
+sheets.py con latencia y errores configurables.
+
+AppTest no admite ejecuciones simultáneas en el mismo proceso, así que los
+reruns se serializan: `--concurrency` es el número de sesiones en curso a la
+vez (intercaladas), mientras el hilo de envío escribe en paralelo.
+
+Informa p50/p95/p99 del tiempo de render por página, respuestas por segundo y
+llamadas a la API por respuesta.
+
+Uso:
+    python benchmarks/bench_survey.py --respondents 100 --concurrency 10 \\
+        --latency-ms 200 --error-rate 0.05
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# AppTest parchea el runtime global de Streamlit en cada ejecución
+_run_lock = threading.Lock()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--respondents", type=int, default=100, help="encuestados simulados")
+    parser.add_argument("--concurrency", type=int, default=10, help="encuestados simultáneos")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="latencia simulada por llamada a la API")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="probabilidad de error 503 por llamada")
+    parser.add_argument("--timeout", type=float, default=120.0, help="segundos máximos para vaciar el diario")
+    parser.add_argument("--max-calls-per-submission", type=float, default=None,
+                        help="falla (código 1) si se supera este número de llamadas por respuesta")
+    parser.add_argument("--output", default=None, help="archivo donde guardar también el informe")
+    return parser.parse_args()
+
+
+def configure_environment(args):
+    # Debe hacerse antes de importar los módulos de la aplicación
+    os.environ["CCK_SHEETS_BACKEND"] = "memory"
+    os.environ["CCK_FAKE_LATENCY_MS"] = str(args.latency_ms)
+    os.environ["CCK_FAKE_ERROR_RATE"] = str(args.error_rate)
+    os.environ.setdefault("CCK_DATA_DIR", tempfile.mkdtemp(prefix="cck_bench_"))
+    os.environ.setdefault("CCK_SPOOL_WINDOW", "0.2")
+    os.environ.setdefault("CCK_SPOOL_FLUSH_INTERVAL", "0.5")
+    os.environ.setdefault("CCK_SPOOL_MAX_BACKOFF", "2")
+    sys.path.insert(0, ROOT)
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(p / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def _prune_stale_widgets(node):
+    """
+    Tras un st.rerun() dentro de un formulario, AppTest (1.34) conserva en el
+    árbol los widgets sobrantes del formulario anterior, cuyo estado ya no
+    existe. El navegador los descarta; aquí se eliminan antes de cada clic.
+    """
+    children = getattr(node, "children", None)
+    if not children:
+        return
+    form_ids = [c.form_id for c in children.values() if getattr(c, "form_id", "")]
+    if form_ids:
+        stale = [k for k, c in children.items() if getattr(c, "form_id", form_ids[0]) not in ("", form_ids[0])]
+        for k in stale:
+            del children[k]
+    for child in children.values():
+        _prune_stale_widgets(child)
+
+
+def _click(at, label):
+    _prune_stale_widgets(at._tree)
+    buttons = [b for b in at.button if b.label == label]
+    if not buttons:
+        raise RuntimeError(f"No se encontró el botón {label!r}")
+    buttons[0].click()
+
+
+def run_respondent(index, timings, lock):
+    """Completa una encuesta y registra el tiempo de render de cada página."""
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(os.path.join(ROOT, "app.py"), default_timeout=60)
+
+    def step(page, action=None):
+        with _run_lock:
+            if action is not None:
+                action()
+            start = time.perf_counter()
+            at.run()
+            elapsed = time.perf_counter() - start
+        if at.exception:
+            raise RuntimeError(f"Excepción en la página {page}: {at.exception[0].message}")
+        with lock:
+            timings[page].append(elapsed)
+
+    # Los botones "Continuar" y "Comenzar encuesta" cambian de página sin
+    # st.rerun(): la página nueva se dibuja en el siguiente rerun, igual que
+    # en el navegador. El rerun del clic cuenta como render de la página actual.
+    step("inicio")
+    at.text_input[0].input(f"Cliente {index % 5}")
+    step("inicio", lambda: _click(at, "Continuar"))
+    step("instrucciones")
+    step("instrucciones", lambda: _click(at, "Comenzar encuesta"))
+    step("evaluacion")
+    total_eventos = at.session_state["total_eventos"]
+    for i in range(total_eventos):
+        page = "evaluacion" if i + 1 < total_eventos else "demograficos"
+        step(page, lambda: _click(at, "Siguiente"))
+    step("guardar", lambda: _click(at, "Finalizar encuesta"))
+
+
+def main():
+    args = parse_args()
+    configure_environment(args)
+
+    import sheets
+    import spool
+    from streamlit import logger
+
+    # Evitar los avisos "missing ScriptRunContext" de los hilos del benchmark
+    logger.set_log_level("error")
+
+    worksheet = sheets.get_memory_worksheet("Respuestas")
+    timings = defaultdict(list)
+    lock = threading.Lock()
+    failures = []
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        futures = [pool.submit(run_respondent, i, timings, lock) for i in range(args.respondents)]
+        for future in futures:
+            try:
+                future.result()
+            except Exception as e:
+                failures.append(str(e))
+    ui_elapsed = time.perf_counter() - start
+
+    # Esperar a que el hilo de envío vacíe el diario
+    drained = True
+    if spool._worker is not None:
+        deadline = time.monotonic() + args.timeout
+        while spool._worker.spool.pending_count() and time.monotonic() < deadline:
+            time.sleep(0.1)
+        drained = spool._worker.spool.pending_count() == 0
+    total_elapsed = time.perf_counter() - start
+
+    completed = args.respondents - len(failures)
+    calls = worksheet.total_calls
+    lines = [
+        f"Encuestados: {args.respondents} (concurrencia {args.concurrency}), "
+        f"latencia {args.latency_ms:.0f} ms, errores {args.error_rate:.0%}",
+        "",
+        f"{'Página':<14}{'n':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}",
+    ]
+    for page in ("inicio", "instrucciones", "evaluacion", "demograficos", "guardar"):
+        values = [t * 1000 for t in timings[page]]
+        lines.append(f"{page:<14}{len(values):>7}{percentile(values, 50):>10.1f}"
+                     f"{percentile(values, 95):>10.1f}{percentile(values, 99):>10.1f}")
+    lines += [
+        "",
+        f"Respuestas completadas: {completed} (fallidas: {len(failures)})",
+        f"Respuestas/s (interfaz): {completed / ui_elapsed:.1f}",
+        f"Respuestas/s (hasta escribir en la hoja): {completed / total_elapsed:.1f}"
+        + ("" if drained else " [el diario no se vació a tiempo]"),
+        f"Llamadas a la API: {calls} ({worksheet.calls}), errores simulados: {worksheet.errors}",
+        f"Llamadas por respuesta: {calls / max(completed, 1):.3f}",
+        f"Bytes enviados por respuesta: {worksheet.bytes_sent / max(completed, 1):.0f}",
+    ]
+    for message in sorted(set(failures))[:5]:
+        lines.append(f"Error: {message}")
+
+    report = "\n".join(lines)
+    print(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(report + "\n")
+
+    if args.max_calls_per_submission is not None and calls / max(completed, 1) > args.max_calls_per_submission:
+        print(f"Regresión: más de {args.max_calls_per_submission} llamadas por respuesta")
+        return 1
+    return 1 if failures or not drained else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
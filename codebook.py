@@ -0,0 +1,117 @@
+"""
+Libro de códigos versionado de la encuesta.
+
+Cada campo categórico (evento, respuestas de la evaluación y datos
+demográficos) se guarda en la hoja como un entero pequeño: la posición de la
+etiqueta en la lista del campo + 1. La columna "Version_Codigos" de cada fila
+indica con qué versión del libro se codificó, de modo que las filas se
+pueden decodificar aunque las listas cambien más adelante.
+
+Una versión publicada no debe modificarse: para cambiar, añadir o reordenar
+opciones se crea una versión nueva con las listas completas.
+"""
+
+CODEBOOKS = {
+    1: {
+        "Evento": [
+            "Fuga de información confidencial",
+            "Caída prolongada de los sistemas informáticos",
+            "Incumplimiento regulatorio",
+            "Fraude interno",
+            "Crisis reputacional en redes sociales",
+            "Falla en la cadena de suministro",
+            "Desastre natural que afecta las instalaciones",
+            "Ciberataque",
+            "Conflicto laboral grave",
+            "Error crítico en producto o servicio",
+        ],
+        "Nivel_Cargo": [
+            "C-Level (Ejecutivo: CEO, CFO, COO, etc.)", "Director", "Gerente",
+            "Coordinador/Supervisor", "Analista/Especialista", "Asistente/Operativo",
+        ],
+        "Departamento": [
+            "Dirección General", "Recursos Humanos", "Finanzas", "Operaciones",
+            "Tecnología/IT", "Marketing y Ventas", "Logística y Cadena de Suministro",
+            "Legal y Cumplimiento", "Investigación y Desarrollo",
+        ],
+        "Probabilidad": ["Extremadamente improbable", "Algo improbable", "Ni probable ni improbable",
+                         "Algo probable", "Extremadamente probable"],
+        "Ocurrencia": ["Nunca", "1 vez", "Entre 2 y 3 veces", "Más de 4 veces"],
+        "Detección": ["Extremadamente difícil", "Algo difícil", "Ni fácil ni difícil",
+                      "Algo fácil", "Extremadamente fácil"],
+        "Estructura": ["Totalmente en desacuerdo", "Algo en desacuerdo", "Ni de acuerdo ni en desacuerdo",
+                       "Algo de acuerdo", "Totalmente de acuerdo"],
+        "Impacto": ["Nada negativo", "Poco negativo", "Moderadamente negativo",
+                    "Muy negativo", "Extremadamente negativo"],
+        "Responsabilidad": ["Ninguna", "Poca", "Moderada", "Mucha", "Muchísima"],
+        "Autoeficacia": ["Nada preparado", "Poco preparada", "Moderadamente preparada",
+                         "Muy preparada", "Totalmente preparado"],
+    },
+}
+
+CODEBOOK_VERSION = max(CODEBOOKS)
+
+# Libro vigente: campo -> lista de etiquetas
+CODEBOOK = CODEBOOKS[CODEBOOK_VERSION]
+
+# Índices etiqueta -> código por versión, precalculados
+_CODES = {
+    version: {campo: {etiqueta: i + 1 for i, etiqueta in enumerate(etiquetas)}
+              for campo, etiquetas in libro.items()}
+    for version, libro in CODEBOOKS.items()
+}
+
+
+def encode(campo, etiqueta, version=CODEBOOK_VERSION):
+    """Código de `etiqueta` en `campo`, o la etiqueta sin cambios si no está en el libro."""
+    return _CODES[version].get(campo, {}).get(etiqueta, etiqueta)
+
+
+def decode(campo, codigo, version=CODEBOOK_VERSION):
+    """Etiqueta del `codigo` (int o texto numérico), o el valor sin cambios si no es un código."""
+    etiquetas = CODEBOOKS[version].get(campo)
+    try:
+        indice = int(codigo)
+    except (TypeError, ValueError):
+        return codigo
+    if etiquetas is None or not 1 <= indice <= len(etiquetas):
+        return codigo
+    return etiquetas[indice - 1]
+
+
+def encode_rows(rows, headers, version=CODEBOOK_VERSION):
+    """
+    Codifica filas con etiquetas en el orden de `headers`, que debe incluir
+    Version_Codigos: esa columna se rellena con la versión del libro.
+    """
+    campos = [(i, campo) for i, campo in enumerate(headers) if campo in CODEBOOKS[version]]
+    i_version = headers.index("Version_Codigos")
+    codificadas = []
+    for row in rows:
+        row = list(row) + [""] * (len(headers) - len(row))
+        for i, campo in campos:
+            row[i] = encode(campo, row[i], version)
+        row[i_version] = version
+        codificadas.append(row)
+    return codificadas
+
+
+def decode_row(row, headers):
+    """
+    Decodifica una fila leída de la hoja (en el orden de `headers`, que debe
+    incluir Version_Codigos). Las filas antiguas sin versión se devuelven tal cual.
+    """
+    row = list(row) + [""] * (len(headers) - len(row))
+    version = row[headers.index("Version_Codigos")]
+    if version in ("", None):
+        return row
+    version = int(version)
+    return [decode(campo, valor, version) if campo in CODEBOOKS[version] else valor
+            for campo, valor in zip(headers, row)]
+
+
+def dictionary_rows(version=CODEBOOK_VERSION):
+    """Filas (Version, Campo, Codigo, Etiqueta) del diccionario de etiquetas de una versión."""
+    return [[version, campo, i + 1, etiqueta]
+            for campo, etiquetas in CODEBOOKS[version].items()
+            for i, etiqueta in enumerate(etiquetas)]
@@ -0,0 +1,142 @@
+"""
+Credenciales de la cuenta de servicio compartidas por todo el proceso.
+
+`CredentialProvider` carga las credenciales una sola vez (la lectura de los
+secretos y el análisis de la clave privada se hacen al primer uso), guarda el
+token de acceso y lo renueva en un hilo en segundo plano poco antes de que
+caduque, de modo que ninguna escritura tiene que esperar a pedir un token.
+El cliente de gspread autorizado con esas credenciales también se comparte:
+abrir otra hoja (p. ej. un shard) no vuelve a autorizar.
+
+google-auth y gspread se importan dentro de las funciones para no cargarlos
+en el arranque.
+"""
+import os
+import threading
+from datetime import datetime, timezone
+
+import metrics
+
+# Segundos antes de la caducidad del token en los que se renueva
+TOKEN_REFRESH_MARGIN = float(os.environ.get("CCK_TOKEN_REFRESH_MARGIN", "300"))
+
+# Segundos de espera tras un error al renovar el token
+TOKEN_RETRY_INTERVAL = float(os.environ.get("CCK_TOKEN_RETRY_INTERVAL", "30"))
+
+
+def _seconds_to_expiry(credentials):
+    expiry = getattr(credentials, "expiry", None)
+    if expiry is None:
+        return None
+    # google-auth usa datetimes UTC sin zona horaria
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    return (expiry - now).total_seconds()
+
+
+class CredentialProvider:
+    """
+    Credenciales de una fuente (ver app.credentials_source). `loader` es una
+    función sin argumentos que devuelve las credenciales o None.
+    """
+
+    def __init__(self, loader, refresh_margin=TOKEN_REFRESH_MARGIN, retry_interval=TOKEN_RETRY_INTERVAL):
+        self.loader = loader
+        self.refresh_margin = refresh_margin
+        self.retry_interval = retry_interval
+        self.refreshes = 0
+        self.last_error = None
+        self._credentials = None
+        self._client = None
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stopping = threading.Event()
+
+    def credentials(self):
+        """Devuelve las credenciales con un token vigente (o None si no se pudieron cargar)."""
+        with self._lock:
+            if self._credentials is None:
+                credentials = self.loader()
+                if credentials is None:
+                    return None
+                metrics.inc("cck_credentials_loads_total")
+                self._credentials = credentials
+            if self._needs_refresh():
+                self._refresh()
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="cck-token-refresh", daemon=True)
+                self._thread.start()
+            return self._credentials
+
+    def client(self, timeout=None):
+        """Cliente de gspread autorizado con las credenciales del proceso (o None)."""
+        import gspread
+
+        credentials = self.credentials()
+        if credentials is None:
+            return None
+        with self._lock:
+            if self._client is None:
+                self._client = gspread.authorize(credentials)
+                if timeout is not None:
+                    self._client.set_timeout(timeout)
+            return self._client
+
+    def _needs_refresh(self):
+        if not getattr(self._credentials, "token", None):
+            return True
+        restante = _seconds_to_expiry(self._credentials)
+        return restante is not None and restante <= self.refresh_margin
+
+    def _refresh(self):
+        from google.auth.transport.requests import Request
+
+        with metrics.timed("cck_token_refresh_seconds"):
+            self._credentials.refresh(Request())
+        self.refreshes += 1
+        self.last_error = None
+
+    def _run(self):
+        while not self._stopping.is_set():
+            with self._lock:
+                restante = _seconds_to_expiry(self._credentials)
+            if restante is None:
+                return
+            espera = restante - self.refresh_margin
+            if espera > 0 and self._stopping.wait(espera):
+                return
+            try:
+                with self._lock:
+                    if self._needs_refresh():
+                        self._refresh()
+            except Exception as e:
+                self.last_error = str(e)
+                metrics.inc("cck_errors_total", operation="token_refresh")
+                self._stopping.wait(self.retry_interval)
+
+    def invalidate(self):
+        """Olvida las credenciales y el cliente (p. ej. tras un error de autenticación)."""
+        with self._lock:
+            self._credentials = None
+            self._client = None
+
+    def stop(self):
+        self._stopping.set()
+
+
+_providers = {}
+_providers_lock = threading.Lock()
+
+
+# Función para obtener el proveedor de credenciales de una fuente
+def get_credential_provider(source, loader):
+    with _providers_lock:
+        if source not in _providers:
+            _providers[source] = CredentialProvider(loader)
+        return _providers[source]
+
+
+def invalidate_credentials():
+    with _providers_lock:
+        providers = list(_providers.values())
+    for provider in providers:
+        provider.invalidate()
@@ -0,0 +1,95 @@
+"""
+Índice de respuestas ya enviadas, para que los envíos sean idempotentes.
+
+Antes de escribir una respuesta en un destino ("sheets", "sqlite",
+"parquet"), quien escribe la reclama con `claim(response_id, destino)`: solo
+la primera reclamación tiene éxito, de modo que los reruns de la página
+"guardar", los dobles clics y las sesiones retomadas no vuelven a escribirla
+ni gastan llamadas a la API. Si la escritura falla se libera con `release`.
+
+Las reclamaciones se guardan en SQLite (compartido por todos los procesos,
+INSERT OR IGNORE es atómico) y las más recientes se recuerdan en memoria para
+responder a los duplicados sin consultar la base.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+from localdb import DATA_DIR, connect
+
+SUBMISSIONS_PATH = os.path.join(DATA_DIR, "enviadas.sqlite3")
+
+# Reclamaciones recordadas en memoria por proceso
+MEMORY_ENTRIES = int(os.environ.get("CCK_DEDUP_MEMORY_ENTRIES", "100000"))
+
+
+class SubmissionIndex:
+    """Tabla `enviadas` (response_id, destino) con una caché LRU en memoria."""
+
+    def __init__(self, path=SUBMISSIONS_PATH, memory_entries=MEMORY_ENTRIES):
+        self.path = path
+        self.memory_entries = memory_entries
+        self._recent = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = connect(path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS enviadas ("
+            " response_id TEXT NOT NULL,"
+            " destino TEXT NOT NULL,"
+            " created REAL NOT NULL,"
+            " PRIMARY KEY (response_id, destino))"
+        )
+
+    def _remember(self, key):
+        self._recent[key] = True
+        self._recent.move_to_end(key)
+        while len(self._recent) > self.memory_entries:
+            self._recent.popitem(last=False)
+
+    def claim(self, response_id, destino):
+        """Reclama la escritura de la respuesta en `destino`. Devuelve False si ya estaba reclamada."""
+        key = (response_id, destino)
+        with self._lock:
+            if key in self._recent:
+                self._recent.move_to_end(key)
+                claimed = False
+            else:
+                cur = self._conn.execute(
+                    "INSERT OR IGNORE INTO enviadas (response_id, destino, created) VALUES (?, ?, ?)",
+                    (response_id, destino, time.time()),
+                )
+                claimed = cur.rowcount > 0
+                self._remember(key)
+        if not claimed:
+            metrics.inc("cck_duplicate_submissions_total", destination=destino)
+        return claimed
+
+    def release(self, response_id, destino):
+        """Libera una reclamación cuya escritura falló, para poder reintentarla."""
+        with self._lock:
+            self._recent.pop((response_id, destino), None)
+            self._conn.execute("DELETE FROM enviadas WHERE response_id = ? AND destino = ?",
+                               (response_id, destino))
+
+    def contains(self, response_id, destino):
+        key = (response_id, destino)
+        with self._lock:
+            if key in self._recent:
+                return True
+            return self._conn.execute(
+                "SELECT 1 FROM enviadas WHERE response_id = ? AND destino = ?", key).fetchone() is not None
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+# Función para obtener el índice compartido por todo el proceso
+def get_submission_index(path=SUBMISSIONS_PATH):
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = SubmissionIndex(path)
+        return _index
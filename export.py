@@ -0,0 +1,184 @@
+"""
+Exportación masiva de las respuestas a CSV o Parquet.
+
+Las filas se leen del backend de almacenamiento (storage.py) en bloques de
+`chunk_rows` y cada bloque se escribe en el destino antes de leer el
+siguiente, de modo que la memoria usada depende del tamaño del bloque y no
+del total de filas. Se puede filtrar por Nombre_Cliente, cuestionario
+(Encuesta) y rango de fechas de Fecha_Respuesta, y decodificar los códigos a
+etiquetas (codebook.py) o conservarlos y añadir al final una columna
+<campo>_Etiqueta por cada campo codificado.
+
+Uso (con un backend local en CCK_STORAGE):
+    python export.py respuestas.csv --cliente "ACME" --desde 2025-01-01 --hasta 2025-03-31
+    python export.py respuestas.csv --encuesta cck
+    python export.py respuestas.parquet --codigos
+    python export.py respuestas.csv --etiquetas
+"""
+import argparse
+import csv
+import os
+import sys
+import time
+from datetime import date
+
+from codebook import CODEBOOK, decode_row
+from localdb import DATA_DIR
+from schema import HEADERS
+
+# Filas leídas y escritas por bloque
+EXPORT_CHUNK_ROWS = int(os.environ.get("CCK_EXPORT_CHUNK_ROWS", "10000"))
+
+# Directorio de las exportaciones de la página de resultados
+EXPORT_DIR = os.path.join(DATA_DIR, "exportaciones")
+
+# Horas que se conservan las exportaciones de la página de resultados
+EXPORT_RETENTION_HOURS = float(os.environ.get("CCK_EXPORT_RETENTION_HOURS", "24"))
+
+FORMATS = ("csv", "parquet")
+
+# Campos codificados y columnas de etiquetas que se añaden con etiquetas=True
+_CAMPOS_CODIFICADOS = [(i, c) for i, c in enumerate(HEADERS) if c in CODEBOOK]
+LABEL_COLUMNS = [f"{c}_Etiqueta" for _, c in _CAMPOS_CODIFICADOS]
+
+
+def export_headers(decodificar=True, etiquetas=False):
+    """Columnas de la exportación: HEADERS, más las de etiquetas si se conservan los códigos."""
+    return HEADERS + LABEL_COLUMNS if etiquetas and not decodificar else HEADERS
+
+
+def iter_export_rows(storage, cliente=None, desde=None, hasta=None, encuesta=None, decodificar=True,
+                     etiquetas=False, chunk_rows=EXPORT_CHUNK_ROWS):
+    """Genera bloques de filas (en el orden de export_headers) que cumplen el filtro."""
+    width = len(HEADERS)
+    i_version = HEADERS.index("Version_Codigos")
+    for rows in storage.iter_filtered(chunk_rows, cliente=cliente, desde=desde, hasta=hasta,
+                                      encuesta=encuesta):
+        if decodificar:
+            # Con etiquetas la fila ya no está codificada: sin versión del libro
+            decodificadas = [decode_row(r, HEADERS) for r in rows]
+            for r in decodificadas:
+                r[i_version] = ""
+            yield decodificadas
+        elif etiquetas:
+            # Códigos tal cual y, al final, la etiqueta de cada campo codificado
+            completas = []
+            for r in rows:
+                r = list(r[:width]) + [""] * (width - len(r))
+                decodificada = decode_row(r, HEADERS)
+                completas.append(r + [decodificada[i] for i, _ in _CAMPOS_CODIFICADOS])
+            yield completas
+        else:
+            yield [list(r[:width]) + [""] * (width - len(r)) for r in rows]
+
+
+def write_csv(storage, out, **filtros):
+    """Escribe las filas en el archivo de texto `out` (con encabezados). Devuelve las filas escritas."""
+    writer = csv.writer(out, lineterminator="\n")
+    writer.writerow(export_headers(filtros.get("decodificar", True), filtros.get("etiquetas", False)))
+    total = 0
+    for rows in iter_export_rows(storage, **filtros):
+        writer.writerows(rows)
+        total += len(rows)
+    return total
+
+
+def write_parquet(storage, path, **filtros):
+    """
+    Escribe las filas en el archivo Parquet `path`, un grupo de filas por
+    bloque. Todas las columnas se guardan como texto. Requiere pyarrow.
+    Devuelve las filas escritas.
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("La exportación a Parquet requiere pyarrow (pip install pyarrow)")
+
+    columnas_export = export_headers(filtros.get("decodificar", True), filtros.get("etiquetas", False))
+    schema = pa.schema([(c, pa.string()) for c in columnas_export])
+    total = 0
+    with pq.ParquetWriter(path, schema) as writer:
+        for rows in iter_export_rows(storage, **filtros):
+            columnas = {c: [None if r[i] in (None, "") else str(r[i]) for r in rows]
+                        for i, c in enumerate(columnas_export)}
+            writer.write_table(pa.table(columnas, schema=schema))
+            total += len(rows)
+    return total
+
+
+# Función para exportar a un archivo según su formato
+def export_responses(storage, path, formato=None, **filtros):
+    """
+    Exporta a `path` en `formato` ("csv" o "parquet"; por defecto según la
+    extensión). El archivo se escribe con un nombre temporal y se renombra al
+    terminar. Devuelve las filas escritas.
+    """
+    formato = formato or ("parquet" if path.endswith(".parquet") else "csv")
+    if formato not in FORMATS:
+        raise ValueError(f"Formato de exportación desconocido: {formato}")
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp = os.path.join(directory, "." + os.path.basename(path) + ".tmp")
+    try:
+        if formato == "csv":
+            with open(tmp, "w", newline="", encoding="utf-8") as out:
+                total = write_csv(storage, out, **filtros)
+        else:
+            total = write_parquet(storage, tmp, **filtros)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return total
+
+
+# Función para borrar las exportaciones antiguas
+def prune_exports(directory=EXPORT_DIR, max_age_hours=EXPORT_RETENTION_HOURS):
+    """Elimina los archivos de `directory` con más de `max_age_hours` horas. Devuelve cuántos borró."""
+    if not os.path.isdir(directory):
+        return 0
+    limite = time.time() - max_age_hours * 3600
+    borrados = 0
+    for nombre in os.listdir(directory):
+        ruta = os.path.join(directory, nombre)
+        if os.path.isfile(ruta) and os.path.getmtime(ruta) < limite:
+            os.remove(ruta)
+            borrados += 1
+    return borrados
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("salida", help="archivo de destino (.csv o .parquet)")
+    parser.add_argument("--formato", choices=FORMATS, help="formato (por defecto, según la extensión)")
+    parser.add_argument("--cliente", help="solo las respuestas de este Nombre_Cliente")
+    parser.add_argument("--encuesta", help="solo las respuestas de este cuestionario (id)")
+    parser.add_argument("--desde", type=date.fromisoformat, help="fecha inicial AAAA-MM-DD (incluida)")
+    parser.add_argument("--hasta", type=date.fromisoformat, help="fecha final AAAA-MM-DD (incluida)")
+    valores = parser.add_mutually_exclusive_group()
+    valores.add_argument("--codigos", action="store_true", help="exportar los códigos sin decodificar")
+    valores.add_argument("--etiquetas", action="store_true",
+                         help="exportar los códigos y una columna <campo>_Etiqueta por campo codificado")
+    parser.add_argument("--chunk-rows", type=int, default=EXPORT_CHUNK_ROWS, help="filas por bloque")
+    args = parser.parse_args()
+
+    from storage import STORAGE_BACKEND, get_storage
+
+    if STORAGE_BACKEND == "sheets":
+        print("Con CCK_STORAGE=sheets la exportación se hace desde la página de resultados.",
+              file=sys.stderr)
+        return 1
+    storage = get_storage(None)
+
+    total = export_responses(storage, args.salida, args.formato, cliente=args.cliente,
+                             desde=args.desde, hasta=args.hasta, encuesta=args.encuesta,
+                             decodificar=not (args.codigos or args.etiquetas),
+                             etiquetas=args.etiquetas, chunk_rows=args.chunk_rows)
+    print(f"{total} filas exportadas a {args.salida}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,23 @@
+"""
+Datos locales del proceso: el directorio CCK_DATA_DIR y las bases SQLite.
+
+Todas las bases locales (diario de envíos, progreso, índice de envíos,
+respuestas, cobertura) se abren igual: en modo WAL con synchronous=NORMAL,
+en autocommit (las transacciones se abren con BEGIN explícito) y compartidas
+entre hilos; cada clase protege su conexión con su propio lock.
+"""
+import os
+import sqlite3
+
+DATA_DIR = os.environ.get("CCK_DATA_DIR", "datos_locales")
+
+
+def connect(path):
+    """Abre (y crea si hace falta, con su directorio) la base SQLite `path`."""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
@@ -0,0 +1,199 @@
+"""
+Métricas de rendimiento de la encuesta (contadores, gauges e histogramas).
+
+Las métricas se guardan en un registro del proceso y se exportan en formato
+de texto de Prometheus, ya sea por HTTP (CCK_METRICS_PORT) o escribiéndolas
+periódicamente en un archivo (CCK_METRICS_FILE).
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Límites (segundos) de los buckets de los histogramas de tiempo
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+METRICS_PORT = os.environ.get("CCK_METRICS_PORT")
+METRICS_FILE = os.environ.get("CCK_METRICS_FILE")
+METRICS_FILE_INTERVAL = float(os.environ.get("CCK_METRICS_FILE_INTERVAL", "15"))
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.sum += value
+        self.count += 1
+        for i, limit in enumerate(self.buckets):
+            if value <= limit:
+                self.counts[i] += 1
+
+
+class Registry:
+    """Registro de métricas, seguro para varios hilos."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            self.gauges[self._key(name, labels)] = value
+
+    def observe(self, name, value, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            self.histograms[key].observe(value)
+
+    def value(self, name, **labels):
+        """Valor de un contador o gauge (0 si no existe)."""
+        key = self._key(name, labels)
+        with self._lock:
+            return self.counters.get(key, self.gauges.get(key, 0))
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.gauges.clear()
+            self.histograms.clear()
+
+    def render_prometheus(self):
+        """Devuelve todas las métricas en formato de texto de Prometheus."""
+        def fmt_labels(labels, extra=()):
+            items = list(labels) + list(extra)
+            if not items:
+                return ""
+            return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in items) + "}"
+
+        lines = []
+        with self._lock:
+            for kind, series in (("counter", self.counters), ("gauge", self.gauges)):
+                for name in sorted({n for n, _ in series}):
+                    lines.append(f"# TYPE {name} {kind}")
+                    for (n, labels), value in sorted(series.items()):
+                        if n == name:
+                            lines.append(f"{name}{fmt_labels(labels)} {value}")
+            for name in sorted({n for n, _ in self.histograms}):
+                lines.append(f"# TYPE {name} histogram")
+                for (n, labels), h in sorted(self.histograms.items(), key=lambda i: i[0]):
+                    if n != name:
+                        continue
+                    for limit, count in zip(h.buckets, h.counts):
+                        lines.append(f"{name}_bucket{fmt_labels(labels, [('le', limit)])} {count}")
+                    lines.append(f"{name}_bucket{fmt_labels(labels, [('le', '+Inf')])} {h.count}")
+                    lines.append(f"{name}_sum{fmt_labels(labels)} {h.sum}")
+                    lines.append(f"{name}_count{fmt_labels(labels)} {h.count}")
+        return "\n".join(lines) + "\n"
+
+    def write_file(self, path):
+        """Escribe las métricas en `path` de forma atómica."""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(self.render_prometheus())
+        os.replace(tmp, path)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+REGISTRY = Registry()
+
+
+def inc(name, value=1, **labels):
+    REGISTRY.inc(name, value, **labels)
+
+
+def set_gauge(name, value, **labels):
+    REGISTRY.set(name, value, **labels)
+
+
+def observe(name, value, **labels):
+    REGISTRY.observe(name, value, **labels)
+
+
+@contextmanager
+def timed(name, **labels):
+    """
+    Mide la duración del bloque en el histograma `name`. Si el bloque lanza
+    una excepción se cuenta además en `cck_errors_total{operation=name}`.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        inc("cck_errors_total", operation=name, **labels)
+        raise
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+
+_exporters_started = False
+_exporters_lock = threading.Lock()
+
+
+def _metrics_server(port):
+    # Importación diferida: http.server solo se carga si se expone el puerto
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = REGISTRY.render_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return ThreadingHTTPServer(("0.0.0.0", port), MetricsHandler)
+
+
+def _file_exporter(path, interval):
+    while True:
+        try:
+            REGISTRY.write_file(path)
+        except OSError:
+            pass
+        time.sleep(interval)
+
+
+# Función para arrancar (una sola vez por proceso) los exportadores configurados
+def start_exporters(port=METRICS_PORT, path=METRICS_FILE, interval=METRICS_FILE_INTERVAL):
+    global _exporters_started
+    with _exporters_lock:
+        if _exporters_started:
+            return
+        _exporters_started = True
+
+    if port:
+        server = _metrics_server(int(port))
+        threading.Thread(target=server.serve_forever, name="cck-metrics-http", daemon=True).start()
+    if path:
+        threading.Thread(target=_file_exporter, args=(path, interval),
+                         name="cck-metrics-file", daemon=True).start()
@@ -0,0 +1,155 @@
+"""
+Progreso de las encuestas en curso, guardado por evento.
+
+Cada formulario enviado (evento evaluado, datos demográficos) se guarda en el
+momento en una base SQLite local, identificado por `response_id`. Si el
+servidor se reinicia o se pierde la conexión, la encuesta se retoma desde la
+URL (`?r=<response_id>`) con las respuestas ya dadas. La página "guardar"
+solo envía la respuesta completa si todavía no está marcada como terminada y
+después la marca, de modo que un rerun de esa página no la reenvía.
+"""
+import json
+import os
+import threading
+import time
+
+import metrics
+from localdb import DATA_DIR, connect
+
+PROGRESS_PATH = os.path.join(DATA_DIR, "progreso.sqlite3")
+
+# Días que se conservan las encuestas terminadas o abandonadas
+PROGRESS_RETENTION_DAYS = float(os.environ.get("CCK_PROGRESS_RETENTION_DAYS", "30"))
+
+
+class ProgressStore:
+    """Encuestas en curso (tabla `encuestas`) y sus respuestas por evento (`respuestas_evento`)."""
+
+    def __init__(self, path=PROGRESS_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = connect(path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS encuestas ("
+            " response_id TEXT PRIMARY KEY,"
+            " nombre_cliente TEXT NOT NULL,"
+            " eventos TEXT NOT NULL DEFAULT '[]',"
+            " demograficos TEXT,"
+            " completed INTEGER NOT NULL DEFAULT 0,"
+            " updated REAL NOT NULL,"
+            " encuesta TEXT)"
+        )
+        # Bases creadas antes de guardar el cuestionario de cada encuesta
+        columnas = [r[1] for r in self._conn.execute("PRAGMA table_info(encuestas)")]
+        if "encuesta" not in columnas:
+            self._conn.execute("ALTER TABLE encuestas ADD COLUMN encuesta TEXT")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS respuestas_evento ("
+            " response_id TEXT NOT NULL,"
+            " evento TEXT NOT NULL,"
+            " respuestas TEXT NOT NULL,"
+            " PRIMARY KEY (response_id, evento))"
+        )
+
+    def start(self, response_id, nombre_cliente, encuesta, eventos=()):
+        """Registra (o actualiza) una encuesta del cuestionario `encuesta` con los eventos que se van a evaluar."""
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO encuestas (response_id, nombre_cliente, encuesta, eventos, updated)"
+                " VALUES (?, ?, ?, ?, ?)"
+                " ON CONFLICT (response_id) DO UPDATE SET"
+                " nombre_cliente = excluded.nombre_cliente, encuesta = excluded.encuesta,"
+                " eventos = excluded.eventos, updated = excluded.updated",
+                (response_id, nombre_cliente, encuesta, json.dumps(list(eventos), ensure_ascii=False),
+                 time.time()),
+            )
+
+    def save_answer(self, response_id, evento, respuestas):
+        """Guarda las respuestas de un evento (sustituye las anteriores del mismo evento)."""
+        with self._lock:
+            with self._conn:
+                self._conn.execute("BEGIN")
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO respuestas_evento (response_id, evento, respuestas)"
+                    " VALUES (?, ?, ?)",
+                    (response_id, evento, json.dumps(respuestas, ensure_ascii=False)),
+                )
+                self._conn.execute("UPDATE encuestas SET updated = ? WHERE response_id = ?",
+                                   (time.time(), response_id))
+        metrics.inc("cck_progress_checkpoints_total", step="evento")
+
+    def save_demograficos(self, response_id, demograficos):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE encuestas SET demograficos = ?, updated = ? WHERE response_id = ?",
+                (json.dumps(demograficos, ensure_ascii=False), time.time(), response_id),
+            )
+        metrics.inc("cck_progress_checkpoints_total", step="demograficos")
+
+    def load(self, response_id):
+        """
+        Devuelve el progreso de la encuesta como diccionario (nombre_cliente,
+        encuesta, eventos, respuestas por evento en el orden de `eventos`,
+        demograficos, completed), o None si no existe.
+        """
+        with self._lock:
+            encuesta = self._conn.execute(
+                "SELECT nombre_cliente, encuesta, eventos, demograficos, completed FROM encuestas"
+                " WHERE response_id = ?", (response_id,)).fetchone()
+            if encuesta is None:
+                return None
+            guardadas = dict(self._conn.execute(
+                "SELECT evento, respuestas FROM respuestas_evento WHERE response_id = ?",
+                (response_id,)).fetchall())
+        nombre_cliente, id_encuesta, eventos, demograficos, completed = encuesta
+        eventos = json.loads(eventos)
+        return {
+            "nombre_cliente": nombre_cliente,
+            "encuesta": id_encuesta,
+            "eventos": eventos,
+            "respuestas": {e: json.loads(guardadas[e]) for e in eventos if e in guardadas},
+            "demograficos": json.loads(demograficos) if demograficos else None,
+            "completed": bool(completed),
+        }
+
+    def is_completed(self, response_id):
+        with self._lock:
+            row = self._conn.execute("SELECT completed FROM encuestas WHERE response_id = ?",
+                                     (response_id,)).fetchone()
+        return bool(row and row[0])
+
+    def complete(self, response_id):
+        """Marca la encuesta como terminada. Devuelve False si ya lo estaba."""
+        with self._lock:
+            cur = self._conn.execute(
+                "UPDATE encuestas SET completed = 1, updated = ? WHERE response_id = ? AND completed = 0",
+                (time.time(), response_id),
+            )
+        return cur.rowcount > 0
+
+    def purge(self, max_age_days=PROGRESS_RETENTION_DAYS):
+        """Elimina las encuestas sin cambios en los últimos `max_age_days` días."""
+        limite = time.time() - max_age_days * 86400
+        with self._lock:
+            with self._conn:
+                self._conn.execute("BEGIN")
+                self._conn.execute(
+                    "DELETE FROM respuestas_evento WHERE response_id IN"
+                    " (SELECT response_id FROM encuestas WHERE updated < ?)", (limite,))
+                cur = self._conn.execute("DELETE FROM encuestas WHERE updated < ?", (limite,))
+        return cur.rowcount
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+# Función para obtener el almacén de progreso compartido por todo el proceso
+def get_progress_store(path=PROGRESS_PATH):
+    """La primera vez también elimina las encuestas antiguas."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ProgressStore(path)
+            _store.purge()
+        return _store
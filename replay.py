@@ -0,0 +1,294 @@
+"""
+Carga masiva de respuestas guardadas en CSV.
+
+Cuando no se pueden guardar las respuestas, la página "guardar" ofrece
+descargarlas como CSV (columnas de RESPONSE_COLUMNS, con etiquetas). Esta
+herramienta recorre un directorio con esos archivos (también acepta los de
+versiones anteriores del esquema y los CSV de export.py), valida cada fila contra el
+esquema y el libro de códigos y carga las válidas en el backend configurado:
+
+- con un backend local (CCK_STORAGE=sqlite/parquet), en escrituras de hasta
+  `batch_rows` filas;
+- con Google Sheets (o CCK_SYNC_TO_SHEETS=1), en el diario local
+  (spool.py), que el hilo de envío de la aplicación vacía en lotes
+  respetando el presupuesto de escrituras.
+
+Las filas repetidas (mismo ID_Respuesta y Evento) se descartan, y las
+respuestas se reclaman en el índice de envíos (dedup.py) antes de cargarlas,
+así que una respuesta que ya guardó la aplicación o una carga anterior no se
+vuelve a escribir. Los archivos terminados se anotan en un punto de control
+(`datos_locales/replay.json`): si la carga se interrumpe, al repetirla se
+continúa por el primer archivo sin terminar.
+
+Uso:
+    python replay.py descargas/
+    python replay.py descargas/ otra_respuesta.csv --batch-rows 2000 --validar
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+
+from codebook import CODEBOOK, decode_row, encode, encode_rows
+from dedup import get_submission_index
+from localdb import DATA_DIR
+from schema import RESPONSE_COLUMNS, detect_version
+from sharding import shard_for_rows
+from storage import response_date
+
+CHECKPOINT_PATH = os.path.join(DATA_DIR, "replay.json")
+
+# Filas por escritura en el backend
+REPLAY_BATCH_ROWS = int(os.environ.get("CCK_REPLAY_BATCH_ROWS", "5000"))
+
+# Filas rechazadas que se muestran (el resto solo se cuentan)
+MAX_REPORTED_ERRORS = 20
+
+_CAMPOS_CODIFICADOS = [(i, campo) for i, campo in enumerate(RESPONSE_COLUMNS) if campo in CODEBOOK]
+_I_ID, _I_CLIENTE, _I_FECHA, _I_EVENTO, _I_VERSION = (
+    RESPONSE_COLUMNS.index(c) for c in
+    ("ID_Respuesta", "Nombre_Cliente", "Fecha_Respuesta", "Evento", "Version_Codigos"))
+
+
+def csv_files(paths):
+    """Archivos .csv de `paths` (directorios, recorridos en orden, o archivos sueltos)."""
+    archivos = []
+    for path in paths:
+        if os.path.isdir(path):
+            for raiz, _, nombres in os.walk(path):
+                archivos += [os.path.join(raiz, n) for n in nombres if n.lower().endswith(".csv")]
+        else:
+            archivos.append(path)
+    return sorted(archivos)
+
+
+def normalize_row(row, headers):
+    """
+    Devuelve la fila con etiquetas en el orden de RESPONSE_COLUMNS, o lanza
+    ValueError con el motivo si no es válida.
+    """
+    if len(row) > len(headers) and any(v.strip() for v in row[len(headers):]):
+        raise ValueError(f"{len(row)} columnas (se esperaban {len(headers)})")
+    row = [v.strip() for v in row[:len(headers)]] + [""] * (len(headers) - len(row))
+    if "Version_Codigos" in headers:
+        try:
+            row = decode_row(row, headers)
+        except (KeyError, ValueError):
+            raise ValueError(f"versión del libro de códigos desconocida: {row[headers.index('Version_Codigos')]!r}")
+    # Columnas que faltan en versiones anteriores del esquema: vacías
+    valores = dict(zip(headers, row))
+    fila = [valores.get(c, "") for c in RESPONSE_COLUMNS]
+    fila[_I_VERSION] = ""
+    if not fila[_I_ID]:
+        raise ValueError("falta ID_Respuesta")
+    if not fila[_I_CLIENTE]:
+        raise ValueError("falta Nombre_Cliente")
+    if response_date(fila[_I_FECHA]) is None:
+        raise ValueError(f"Fecha_Respuesta no válida: {fila[_I_FECHA]!r}")
+    for i, campo in _CAMPOS_CODIFICADOS:
+        if not isinstance(encode(campo, fila[i]), int):
+            raise ValueError(f"valor no válido en {campo}: {fila[i]!r}")
+    return fila
+
+
+def read_csv(path):
+    """Genera (número de línea, encabezados, fila) de un CSV; lanza ValueError si los encabezados no son de ningún esquema."""
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        reader = csv.reader(f)
+        headers = next(reader, [])
+        if detect_version(headers) is None:
+            raise ValueError("los encabezados no corresponden a ninguna versión del esquema")
+        headers = [h for h in headers if h != ""]
+        for row in reader:
+            if any(v.strip() for v in row):
+                yield reader.line_num, headers, row
+
+
+class Checkpoint:
+    """
+    Archivos ya cargados (ruta -> tamaño y fecha de modificación), en un JSON,
+    por separado para cada combinación de destinos.
+    """
+
+    def __init__(self, destinos, path=CHECKPOINT_PATH):
+        self.path = path
+        self.scope = "+".join(destinos)
+        try:
+            with open(path, encoding="utf-8") as f:
+                self.data = json.load(f)
+        except (FileNotFoundError, ValueError):
+            self.data = {}
+        self.done = self.data.setdefault(self.scope, {})
+
+    @staticmethod
+    def _firma(archivo):
+        info = os.stat(archivo)
+        return [info.st_size, info.st_mtime_ns]
+
+    def is_done(self, archivo):
+        return self.done.get(os.path.abspath(archivo)) == self._firma(archivo)
+
+    def mark_done(self, archivo):
+        self.done[os.path.abspath(archivo)] = self._firma(archivo)
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.data, f, ensure_ascii=False, indent=1)
+        os.replace(tmp, self.path)
+
+    def reset(self):
+        self.done.clear()
+
+
+class Replayer:
+    """
+    Valida y carga filas de CSV. `storage` es el backend local (o None) y
+    `spool` el diario de envíos a Google Sheets (o None); con ambos en None
+    solo se valida.
+    """
+
+    def __init__(self, storage=None, spool=None, index=None, batch_rows=REPLAY_BATCH_ROWS,
+                 checkpoint=None, log=print):
+        self.storage = storage
+        self.spool = spool
+        if index is None and (storage is not None or spool is not None):
+            index = get_submission_index()
+        self.index = index
+        self.batch_rows = batch_rows
+        self.checkpoint = checkpoint
+        self.log = log
+        self.stats = dict.fromkeys(("archivos", "omitidos", "filas", "rechazadas", "duplicadas",
+                                    "respuestas", "cargadas"), 0)
+        self.errores = []
+        self._seen = set()  # (ID_Respuesta, Evento)
+        self._pending = {}  # ID_Respuesta -> filas con etiquetas
+        self._pending_rows = 0
+
+    def _reject(self, archivo, linea, motivo):
+        self.stats["rechazadas"] += 1
+        if len(self.errores) < MAX_REPORTED_ERRORS:
+            self.errores.append(f"{archivo}:{linea}: {motivo}")
+
+    def _destinos(self):
+        destinos = []
+        if self.storage is not None:
+            destinos.append(self.storage.name)
+        if self.spool is not None:
+            destinos.append("sheets")
+        return destinos
+
+    def flush(self):
+        """Carga las respuestas pendientes que no se hayan enviado antes a cada destino."""
+        pendientes, self._pending, self._pending_rows = self._pending, {}, 0
+        if not pendientes:
+            return
+        self.stats["respuestas"] += len(pendientes)
+        if not self._destinos():
+            return
+        cargadas = set()
+        for destino in self._destinos():
+            reclamadas = [rid for rid in pendientes if self.index.claim(rid, destino)]
+            if not reclamadas:
+                continue
+            try:
+                if destino == "sheets":
+                    self.spool.enqueue_many(
+                        [(rid, encode_rows(pendientes[rid], RESPONSE_COLUMNS),
+                          shard_for_rows(pendientes[rid])) for rid in reclamadas])
+                else:
+                    self.storage.append_rows(
+                        encode_rows([f for rid in reclamadas for f in pendientes[rid]], RESPONSE_COLUMNS))
+            except Exception:
+                for rid in reclamadas:
+                    self.index.release(rid, destino)
+                raise
+            cargadas.update(reclamadas)
+        self.stats["cargadas"] += sum(len(pendientes[rid]) for rid in cargadas)
+        self.stats["duplicadas"] += sum(len(pendientes[rid]) for rid in pendientes if rid not in cargadas)
+
+    def load_file(self, archivo):
+        if self.checkpoint is not None and self.checkpoint.is_done(archivo):
+            self.stats["omitidos"] += 1
+            return
+        inicio = dict(self.stats)
+        try:
+            for linea, headers, row in read_csv(archivo):
+                self.stats["filas"] += 1
+                try:
+                    fila = normalize_row(row, headers)
+                except ValueError as e:
+                    self._reject(archivo, linea, e)
+                    continue
+                clave = (fila[_I_ID], fila[_I_EVENTO])
+                if clave in self._seen:
+                    self.stats["duplicadas"] += 1
+                    continue
+                self._seen.add(clave)
+                # Los lotes se cortan entre respuestas: una respuesta se carga entera
+                if self._pending_rows >= self.batch_rows and fila[_I_ID] not in self._pending:
+                    self.flush()
+                self._pending.setdefault(fila[_I_ID], []).append(fila)
+                self._pending_rows += 1
+        except (ValueError, UnicodeDecodeError, csv.Error) as e:
+            self._reject(archivo, 1, e)
+        self.flush()
+        self.stats["archivos"] += 1
+        if self.checkpoint is not None and self._destinos():
+            self.checkpoint.mark_done(archivo)
+        self.log(f"[{self.stats['archivos'] + self.stats['omitidos']}] {archivo}: "
+                 f"{self.stats['filas'] - inicio['filas']} filas, "
+                 f"{self.stats['cargadas'] - inicio['cargadas']} cargadas, "
+                 f"{self.stats['duplicadas'] - inicio['duplicadas']} duplicadas, "
+                 f"{self.stats['rechazadas'] - inicio['rechazadas']} rechazadas")
+
+    def run(self, archivos):
+        for archivo in archivos:
+            self.load_file(archivo)
+        return self.stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("rutas", nargs="+", help="directorios o archivos CSV")
+    parser.add_argument("--batch-rows", type=int, default=REPLAY_BATCH_ROWS, help="filas por escritura")
+    parser.add_argument("--validar", action="store_true", help="solo validar, sin cargar nada")
+    parser.add_argument("--desde-cero", action="store_true",
+                        help="ignorar el punto de control y revisar todos los archivos")
+    args = parser.parse_args()
+
+    from spool import Spool
+    from storage import STORAGE_BACKEND, SYNC_TO_SHEETS, get_storage
+
+    storage = spool = checkpoint = None
+    if not args.validar:
+        storage = get_storage(None) if STORAGE_BACKEND != "sheets" else None
+        spool = Spool() if storage is None or SYNC_TO_SHEETS else None
+        checkpoint = Checkpoint(([storage.name] if storage is not None else [])
+                                + (["sheets"] if spool is not None else []))
+        if args.desde_cero:
+            checkpoint.reset()
+
+    archivos = csv_files(args.rutas)
+    inicio = time.perf_counter()
+    replayer = Replayer(storage, spool, batch_rows=args.batch_rows, checkpoint=checkpoint)
+    stats = replayer.run(archivos)
+    segundos = time.perf_counter() - inicio
+
+    for error in replayer.errores:
+        print(error, file=sys.stderr)
+    if stats["rechazadas"] > len(replayer.errores):
+        print(f"... y {stats['rechazadas'] - len(replayer.errores)} filas rechazadas más", file=sys.stderr)
+    print(f"{stats['archivos']} archivos ({stats['omitidos']} ya cargados), {stats['filas']} filas "
+          f"({stats['respuestas']} respuestas) en {segundos:.1f} s: {stats['cargadas']} cargadas, {stats['duplicadas']} duplicadas, "
+          f"{stats['rechazadas']} rechazadas")
+    if spool is not None and stats["cargadas"]:
+        print("Las respuestas están en el diario local; la aplicación las enviará a Google Sheets.")
+    return 1 if stats["rechazadas"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,198 @@
+"""
+Reintentos y circuit breaker para las llamadas a la API de Google Sheets.
+
+Los errores se clasifican en:
+- "auth": credenciales inválidas o caducadas (401/403); no se reintentan.
+- "transient": 429, 5xx, timeouts y errores de red; se reintentan con espera
+  exponencial y jitter, respetando la cabecera Retry-After.
+- "permanent": cualquier otro error; no se reintentan.
+
+Un CircuitBreaker compartido por el proceso cuenta los errores transitorios
+seguidos (salvo 429): al llegar a `threshold` se abre y durante `cooldown` segundos las
+llamadas fallan de inmediato con CircuitOpenError, sin esperar a la API.
+Después se deja pasar una llamada de prueba; si va bien, el circuito se cierra.
+"""
+import os
+import random
+import threading
+import time
+
+import metrics
+
+# Timeout (segundos) de cada petición HTTP a la API
+SHEETS_TIMEOUT = float(os.environ.get("CCK_SHEETS_TIMEOUT", "20"))
+
+# Intentos por llamada (el primero incluido)
+RETRY_ATTEMPTS = int(os.environ.get("CCK_SHEETS_RETRIES", "3"))
+
+# Espera base y máxima (segundos) entre reintentos
+RETRY_BASE_DELAY = float(os.environ.get("CCK_SHEETS_RETRY_BASE", "0.5"))
+RETRY_MAX_DELAY = float(os.environ.get("CCK_SHEETS_RETRY_MAX", "8"))
+
+# Tiempo máximo (segundos) que puede tardar una llamada con todos sus reintentos
+CALL_DEADLINE = float(os.environ.get("CCK_SHEETS_CALL_DEADLINE", "30"))
+
+# Errores transitorios seguidos que abren el circuito y segundos que permanece abierto
+BREAKER_THRESHOLD = int(os.environ.get("CCK_BREAKER_THRESHOLD", "5"))
+BREAKER_COOLDOWN = float(os.environ.get("CCK_BREAKER_COOLDOWN", "30"))
+
+_TRANSIENT_STATUS = {408, 429, 500, 502, 503, 504}
+_NETWORK_ERRORS = ("Timeout", "ReadTimeout", "ConnectTimeout", "ConnectionError",
+                   "TimeoutError", "TransportError", "ChunkedEncodingError")
+
+
+class CircuitOpenError(Exception):
+    """La API se considera caída: la llamada no se ha intentado."""
+
+
+def status_code(exc):
+    """Código HTTP de la respuesta asociada al error, o None."""
+    return getattr(getattr(exc, "response", None), "status_code", None)
+
+
+def classify_error(exc):
+    """Devuelve "auth", "transient" o "permanent"."""
+    if isinstance(exc, CircuitOpenError):
+        return "transient"
+    if type(exc).__name__ in ("RefreshError", "DefaultCredentialsError"):
+        return "auth"
+    status = status_code(exc)
+    if status in (401, 403):
+        return "auth"
+    if status in _TRANSIENT_STATUS:
+        return "transient"
+    if any(cls.__name__ in _NETWORK_ERRORS for cls in type(exc).__mro__):
+        return "transient"
+    return "permanent"
+
+
+def write_not_applied(exc):
+    """
+    Indica si el error garantiza que una escritura no se aplicó (429/503 o
+    conexión no establecida), de modo que reintentarla no duplica filas.
+    """
+    return status_code(exc) in (429, 503) or type(exc).__name__ == "ConnectTimeout"
+
+
+def retry_after(exc):
+    """Segundos indicados por la cabecera Retry-After del error, o None."""
+    headers = getattr(getattr(exc, "response", None), "headers", None) or {}
+    try:
+        return max(0.0, float(headers.get("Retry-After")))
+    except (TypeError, ValueError):
+        return None
+
+
+class CircuitBreaker:
+    """Circuit breaker (cerrado / abierto / semiabierto), seguro para varios hilos."""
+
+    def __init__(self, name="sheets", threshold=BREAKER_THRESHOLD, cooldown=BREAKER_COOLDOWN):
+        self.name = name
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self.opened_at is None:
+                return "closed"
+            if time.monotonic() - self.opened_at < self.cooldown:
+                return "open"
+            return "half_open"
+
+    def before_call(self):
+        """Lanza CircuitOpenError si el circuito está abierto (o ya hay una llamada de prueba)."""
+        with self._lock:
+            if self.opened_at is None:
+                return
+            if time.monotonic() - self.opened_at < self.cooldown or self._probing:
+                metrics.inc("cck_circuit_rejections_total", circuit=self.name)
+                raise CircuitOpenError(f"Google Sheets no disponible (circuito {self.name} abierto)")
+            self._probing = True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+        metrics.set_gauge("cck_circuit_open", 0, circuit=self.name)
+
+    def end_probe(self):
+        """Termina la llamada de prueba del estado semiabierto sin cambiar de estado (p. ej. tras un 429)."""
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.opened_at is None and self.failures < self.threshold:
+                return
+            self.opened_at = time.monotonic()
+        metrics.set_gauge("cck_circuit_open", 1, circuit=self.name)
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+# Función para obtener un CircuitBreaker compartido por nombre
+def get_breaker(name="sheets"):
+    with _breakers_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name)
+        return _breakers[name]
+
+
+def backoff_delay(attempt, base=RETRY_BASE_DELAY, maximum=RETRY_MAX_DELAY):
+    """Espera exponencial con jitter completo para el reintento número `attempt` (desde 1)."""
+    return random.uniform(0, min(maximum, base * 2 ** attempt))
+
+
+def call_with_retry(fn, *args, attempts=RETRY_ATTEMPTS, deadline=CALL_DEADLINE,
+                    breaker=None, retry_on=None, operation="call", **kwargs):
+    """
+    Llama a `fn(*args, **kwargs)` reintentando los errores transitorios.
+
+    `retry_on(exc)` puede restringir qué errores transitorios se reintentan
+    (p. ej. solo los que garantizan que una escritura no se aplicó). No se
+    espera más allá de `deadline` segundos desde la primera llamada: si la
+    siguiente espera lo superaría, se lanza el último error.
+    """
+    breaker = breaker or get_breaker()
+    limite = time.monotonic() + deadline
+    attempt = 0
+    while True:
+        attempt += 1
+        breaker.before_call()
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            if not isinstance(e, Exception):
+                # Interrupciones: la llamada de prueba no llegó a terminar
+                breaker.end_probe()
+                raise
+            clase = classify_error(e)
+            if clase != "transient":
+                # La API respondió: el error no indica que esté caída
+                breaker.record_success()
+                raise
+            # Un 429 indica cuota agotada, no que la API esté caída
+            if status_code(e) != 429:
+                breaker.record_failure()
+            else:
+                breaker.end_probe()
+            if attempt >= attempts or (retry_on is not None and not retry_on(e)):
+                raise
+            wait = max(backoff_delay(attempt), retry_after(e) or 0)
+            if time.monotonic() + wait > limite:
+                raise
+            metrics.inc("cck_sheets_retries_total", operation=operation)
+            time.sleep(wait)
+            continue
+        breaker.record_success()
+        return result
@@ -0,0 +1,128 @@
+"""
+Asignación de eventos equilibrando la cobertura por cliente.
+
+En lugar de elegir los eventos de cada participante al azar, `assign` elige
+los que menos veces se han asignado a ese cliente (los empates se resuelven
+al azar), de modo que todos los eventos reúnen respuestas al mismo ritmo y
+cada uno llega antes al tamaño de muestra objetivo. Los eventos que ya tienen
+`CCK_SAMPLE_TARGET` respuestas completas pasan al final de la cola.
+
+Los contadores (asignados y completados por cuestionario, cliente y evento)
+se guardan en una base SQLite local compartida por todos los procesos. La
+lectura de los contadores y el incremento de los elegidos se hacen en la
+misma transacción, así que dos sesiones simultáneas no eligen con los mismos
+contadores.
+
+CCK_SAMPLING=aleatorio vuelve a la selección al azar (sin contadores).
+"""
+import os
+import random
+import threading
+import time
+
+import metrics
+from localdb import DATA_DIR, connect
+from sharding import client_slug
+
+COVERAGE_PATH = os.path.join(DATA_DIR, "cobertura.sqlite3")
+
+# Estrategia de selección: "cobertura" o "aleatorio"
+SAMPLING = os.environ.get("CCK_SAMPLING", "cobertura")
+
+# Respuestas completas por evento y cliente a partir de las cuales el evento
+# deja de tener prioridad (0 = sin objetivo)
+SAMPLE_TARGET = int(os.environ.get("CCK_SAMPLE_TARGET", "0"))
+
+
+def least_covered(eventos, total, conteos, target=SAMPLE_TARGET, rng=random):
+    """
+    Elige `total` eventos de `eventos`: primero los que no han llegado al
+    objetivo, y entre ellos los menos asignados. `conteos` es evento ->
+    (asignados, completados). El resultado se devuelve en orden aleatorio.
+    """
+    def prioridad(evento):
+        asignados, completados = conteos.get(evento, (0, 0))
+        return (bool(target) and completados >= target, asignados, rng.random())
+
+    elegidos = sorted(eventos, key=prioridad)[:total]
+    rng.shuffle(elegidos)
+    return elegidos
+
+
+class CoverageSampler:
+    """Tabla `cobertura` (encuesta, cliente, evento, asignados, completados)."""
+
+    def __init__(self, path=COVERAGE_PATH, target=SAMPLE_TARGET):
+        self.path = path
+        self.target = target
+        self._lock = threading.Lock()
+        self._conn = connect(path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cobertura ("
+            " encuesta TEXT NOT NULL,"
+            " cliente TEXT NOT NULL,"
+            " evento TEXT NOT NULL,"
+            " asignados INTEGER NOT NULL DEFAULT 0,"
+            " completados INTEGER NOT NULL DEFAULT 0,"
+            " updated REAL NOT NULL,"
+            " PRIMARY KEY (encuesta, cliente, evento))"
+        )
+
+    def _conteos(self, encuesta, cliente):
+        return {evento: (asignados, completados) for evento, asignados, completados in self._conn.execute(
+            "SELECT evento, asignados, completados FROM cobertura WHERE encuesta = ? AND cliente = ?",
+            (encuesta, cliente))}
+
+    def _increment(self, encuesta, cliente, eventos, columna):
+        self._conn.executemany(
+            f"INSERT INTO cobertura (encuesta, cliente, evento, {columna}, updated) VALUES (?, ?, ?, 1, ?)"
+            f" ON CONFLICT (encuesta, cliente, evento) DO UPDATE SET"
+            f" {columna} = {columna} + 1, updated = excluded.updated",
+            [(encuesta, cliente, evento, time.time()) for evento in eventos],
+        )
+
+    def assign(self, encuesta, nombre_cliente, eventos, total):
+        """Elige `total` eventos para un participante del cliente y los cuenta como asignados."""
+        cliente = client_slug(nombre_cliente)
+        with self._lock:
+            with self._conn:
+                # IMMEDIATE: bloquea a otros procesos entre la lectura y el incremento
+                self._conn.execute("BEGIN IMMEDIATE")
+                elegidos = least_covered(eventos, total, self._conteos(encuesta, cliente), self.target)
+                self._increment(encuesta, cliente, elegidos, "asignados")
+        metrics.inc("cck_events_assigned_total", len(elegidos))
+        return elegidos
+
+    def complete(self, encuesta, nombre_cliente, eventos):
+        """Cuenta los eventos de una respuesta guardada como completados."""
+        cliente = client_slug(nombre_cliente)
+        with self._lock:
+            with self._conn:
+                self._conn.execute("BEGIN")
+                self._increment(encuesta, cliente, eventos, "completados")
+
+    def coverage(self, encuesta, nombre_cliente, eventos):
+        """Filas (evento, asignados, completados) del cliente, para todos los `eventos`."""
+        with self._lock:
+            conteos = self._conteos(encuesta, client_slug(nombre_cliente))
+        return [(evento, *conteos.get(evento, (0, 0))) for evento in eventos]
+
+
+_sampler = None
+_sampler_lock = threading.Lock()
+
+
+# Función para obtener el contador de cobertura compartido por todo el proceso
+def get_coverage_sampler(path=COVERAGE_PATH):
+    global _sampler
+    with _sampler_lock:
+        if _sampler is None:
+            _sampler = CoverageSampler(path)
+        return _sampler
+
+
+# Función para elegir los eventos de un participante según CCK_SAMPLING
+def select_events(encuesta, nombre_cliente, eventos, total, sampling=SAMPLING):
+    if sampling == "aleatorio":
+        return random.sample(eventos, total)
+    return get_coverage_sampler().assign(encuesta, nombre_cliente, eventos, total)
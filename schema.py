@@ -0,0 +1,169 @@
+"""
+Esquema versionado de la hoja "Respuestas".
+
+Cada versión solo puede añadir columnas al final de la anterior, de modo que
+una hoja con los encabezados de una versión antigua se migra escribiendo
+únicamente las celdas de las columnas nuevas.
+"""
+import threading
+
+from codebook import CODEBOOK, CODEBOOK_VERSION, dictionary_rows
+
+# Columnas por versión del esquema. Las versiones nuevas amplían la anterior.
+SCHEMA_VERSIONS = {
+    1: [
+        "ID_Respuesta", "Nombre_Cliente", "Fecha_Respuesta",
+        "Nivel_Cargo", "Fecha_Inicio", "Departamento",
+        "Evento", "Probabilidad", "Ocurrencia", "Detección",
+        "Estructura", "Impacto", "Responsabilidad", "Autoeficacia"
+    ],
+    # v2: valores codificados con el libro de códigos (codebook.py)
+    2: [
+        "ID_Respuesta", "Nombre_Cliente", "Fecha_Respuesta",
+        "Nivel_Cargo", "Fecha_Inicio", "Departamento",
+        "Evento", "Probabilidad", "Ocurrencia", "Detección",
+        "Estructura", "Impacto", "Responsabilidad", "Autoeficacia",
+        "Version_Codigos"
+    ],
+    # v3: id del cuestionario (survey.py) con el que se respondió
+    3: [
+        "ID_Respuesta", "Nombre_Cliente", "Fecha_Respuesta",
+        "Nivel_Cargo", "Fecha_Inicio", "Departamento",
+        "Evento", "Probabilidad", "Ocurrencia", "Detección",
+        "Estructura", "Impacto", "Responsabilidad", "Autoeficacia",
+        "Version_Codigos", "Encuesta"
+    ],
+}
+
+SCHEMA_VERSION = max(SCHEMA_VERSIONS)
+
+# Encabezados de la versión vigente
+HEADERS = SCHEMA_VERSIONS[SCHEMA_VERSION]
+
+# Columnas de una respuesta con etiquetas (filas de build_rows y CSV de
+# respaldo): las del esquema vigente, con Version_Codigos vacía
+RESPONSE_COLUMNS = HEADERS
+
+# Cuestionario de las filas anteriores a la columna Encuesta (Encuesta vacía)
+LEGACY_SURVEY = "cck"
+
+# Hoja con el diccionario de etiquetas de cada versión del libro de códigos
+CODEBOOK_WORKSHEET = "Codigos"
+
+# Opciones de cada pregunta de la página "evaluacion", en orden creciente.
+# El código numérico de una respuesta es su posición en la lista + 1.
+DIMENSIONES = ["Probabilidad", "Ocurrencia", "Detección", "Estructura",
+               "Impacto", "Responsabilidad", "Autoeficacia"]
+ESCALAS = {dimension: CODEBOOK[dimension] for dimension in DIMENSIONES}
+
+# Eventos críticos y opciones de los datos demográficos
+EVENTOS = CODEBOOK["Evento"]
+NIVELES_CARGO = CODEBOOK["Nivel_Cargo"]
+DEPARTAMENTOS = CODEBOOK["Departamento"]
+
+_validated = set()
+_validated_lock = threading.Lock()
+
+
+def column_letter(n):
+    """Convierte un número de columna (1 = A) en su letra (27 = AA)."""
+    letters = ""
+    while n > 0:
+        n, rem = divmod(n - 1, 26)
+        letters = chr(65 + rem) + letters
+    return letters
+
+
+def detect_version(header):
+    """Devuelve la versión del esquema cuyos encabezados coinciden con `header`, o None."""
+    header = [h for h in header if h != ""]
+    for version, columns in SCHEMA_VERSIONS.items():
+        if header == columns:
+            return version
+    return None
+
+
+def response_survey(row):
+    """Id del cuestionario de una fila en el orden de HEADERS (LEGACY_SURVEY si no lo tiene)."""
+    i = HEADERS.index("Encuesta")
+    return (row[i] if i < len(row) else None) or LEGACY_SURVEY
+
+
+def _worksheet_key(worksheet):
+    return (getattr(worksheet, "spreadsheet_id", None), worksheet.id)
+
+
+# Función para comprobar (y si hace falta escribir) la fila de encabezados
+def ensure_header(worksheet, known_empty=False):
+    """
+    Garantiza que la fila 1 de la hoja contiene HEADERS.
+
+    La comprobación se hace una sola vez por hoja y proceso. Solo se escribe
+    si la fila falta, si pertenece a una versión anterior del esquema (se
+    añaden las columnas nuevas) o si no coincide con ninguna versión.
+    Devuelve el número de escrituras realizadas (0 o 1).
+    """
+    key = _worksheet_key(worksheet)
+    with _validated_lock:
+        if key in _validated:
+            return 0
+
+    writes = 0
+    header = [] if known_empty else worksheet.row_values(1)
+    version = detect_version(header)
+
+    if version == SCHEMA_VERSION:
+        pass
+    elif version is not None:
+        # Migración: escribir solo las columnas añadidas desde esa versión
+        start = len(SCHEMA_VERSIONS[version])
+        worksheet.update(f"{column_letter(start + 1)}1", [HEADERS[start:]])
+        writes = 1
+    else:
+        worksheet.update("A1", [HEADERS])
+        writes = 1
+
+    with _validated_lock:
+        _validated.add(key)
+    return writes
+
+
+def reset_header_cache():
+    """Olvida qué hojas se han validado (p. ej. tras editar la hoja a mano)."""
+    with _validated_lock:
+        _validated.clear()
+
+
+_dictionaries = set()
+
+
+# Función para publicar el diccionario de etiquetas en la hoja "Codigos"
+def ensure_codebook_dictionary(spreadsheet, version=CODEBOOK_VERSION):
+    """
+    Añade a la hoja "Codigos" (Version, Campo, Codigo, Etiqueta) las filas de
+    `version` si todavía no están. Se comprueba una sola vez por proceso.
+    Devuelve el número de escrituras realizadas.
+    """
+    import gspread
+
+    key = (getattr(spreadsheet, "id", None), version)
+    with _validated_lock:
+        if key in _dictionaries:
+            return 0
+
+    writes = 0
+    try:
+        worksheet = spreadsheet.worksheet(CODEBOOK_WORKSHEET)
+        publicadas = worksheet.col_values(1)
+    except gspread.WorksheetNotFound:
+        worksheet = spreadsheet.add_worksheet(title=CODEBOOK_WORKSHEET, rows=200, cols=4)
+        worksheet.update("A1", [["Version", "Campo", "Codigo", "Etiqueta"]])
+        publicadas = []
+        writes += 1
+    if str(version) not in publicadas:
+        worksheet.append_rows(dictionary_rows(version), value_input_option="RAW", table_range="A1")
+        writes += 1
+
+    with _validated_lock:
+        _dictionaries.add(key)
+    return writes
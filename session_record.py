@@ -0,0 +1,78 @@
+"""
+Registro compacto de las respuestas de una sesión.
+
+En lugar de un diccionario de diccionarios con las etiquetas completas,
+cada sesión guarda un `ResponseRecord`: los eventos y las respuestas como
+códigos del libro de códigos (ver codebook.py) en arrays de bytes, con
+`__slots__` para no crear un __dict__ por instancia. Las etiquetas se
+recuperan solo al final (página "guardar") o al mostrarlas.
+
+SESSION_BUDGET_BYTES es el presupuesto de memoria de un registro completo;
+benchmarks/bench_session.py lo mide con tracemalloc.
+"""
+from array import array
+
+from codebook import CODEBOOK_VERSION, CODEBOOKS, decode, encode
+from schema import DIMENSIONES
+
+# Bytes como máximo por registro (medidos con tracemalloc en bench_session.py)
+SESSION_BUDGET_BYTES = 400
+
+
+class ResponseRecord:
+    """Respuestas de una sesión: códigos de los eventos y de sus respuestas (0 = sin responder)."""
+
+    __slots__ = ("eventos", "codigos", "version")
+
+    def __init__(self, eventos=(), version=CODEBOOK_VERSION):
+        self.version = version
+        self.eventos = array("B", [self._code("Evento", e) for e in eventos])
+        self.codigos = array("B", bytes(len(self.eventos) * len(DIMENSIONES)))
+
+    def _code(self, campo, etiqueta):
+        codigo = encode(campo, etiqueta, self.version)
+        if not isinstance(codigo, int):
+            raise ValueError(f"'{etiqueta}' no está en el libro de códigos ({campo})")
+        return codigo
+
+    def _index(self, evento):
+        try:
+            return self.eventos.index(self._code("Evento", evento))
+        except ValueError:
+            raise KeyError(evento)
+
+    def set(self, evento, respuestas):
+        """Guarda las respuestas del evento (diccionario campo -> etiqueta)."""
+        inicio = self._index(evento) * len(DIMENSIONES)
+        for i, campo in enumerate(DIMENSIONES):
+            self.codigos[inicio + i] = self._code(campo, respuestas[campo])
+
+    def __contains__(self, evento):
+        """Indica si el evento ya tiene respuestas."""
+        try:
+            return self.codigos[self._index(evento) * len(DIMENSIONES)] != 0
+        except KeyError:
+            return False
+
+    @property
+    def respondidos(self):
+        return sum(1 for i in range(len(self.eventos)) if self.codigos[i * len(DIMENSIONES)])
+
+    @property
+    def etiquetas_eventos(self):
+        return [decode("Evento", c, self.version) for c in self.eventos]
+
+    def as_dict(self):
+        """Respuestas con etiquetas, evento -> {campo: etiqueta}, en el orden de los eventos."""
+        n = len(DIMENSIONES)
+        libro = CODEBOOKS[self.version]
+        resultado = {}
+        for i, codigo_evento in enumerate(self.eventos):
+            codigos = self.codigos[i * n:(i + 1) * n]
+            if not codigos[0]:
+                continue
+            evento = libro["Evento"][codigo_evento - 1]
+            resultado[evento] = {"Evento": evento}
+            for campo, codigo in zip(DIMENSIONES, codigos):
+                resultado[evento][campo] = libro[campo][codigo - 1]
+        return resultado
@@ -0,0 +1,93 @@
+"""
+Reparto (sharding) de las respuestas de Google Sheets por cliente.
+
+Con CCK_SHARDING=cliente, las respuestas de cada cliente se escriben en su
+propia hoja "Respuestas_<cliente>" de la hoja de cálculo principal, que se crea
+la primera vez que se usa. CCK_SHARD_MAP apunta a un JSON {cliente: clave de
+hoja de cálculo} para llevar a algunos clientes a su propia hoja de cálculo
+(hoja "Respuestas"), que debe existir y estar compartida con la cuenta de servicio.
+
+Cada shard se identifica por un texto ("" = hoja principal, sin sharding) y
+tiene su propio presupuesto de escrituras por minuto, además del presupuesto
+global del proceso (throttle.py), de modo que un cliente con mucho volumen no
+agota el de los demás.
+"""
+import json
+import os
+import re
+
+from schema import HEADERS
+from throttle import WRITE_BURST, get_bucket
+
+SHARDING = os.environ.get("CCK_SHARDING", "none")
+
+SHARD_MAP_PATH = os.environ.get("CCK_SHARD_MAP")
+
+# Presupuesto de escrituras por minuto de cada shard
+SHARD_WRITES_PER_MINUTE = float(os.environ.get("CCK_SHARD_WRITES_PER_MINUTE", "20"))
+
+WORKSHEET_NAME = "Respuestas"
+SHARD_PREFIX = WORKSHEET_NAME + "_"
+
+
+def client_slug(nombre_cliente):
+    """Nombre del cliente apto para rutas y nombres de hoja."""
+    return re.sub(r"[^0-9A-Za-z_-]+", "_", str(nombre_cliente)).strip("_") or "sin_cliente"
+
+
+def _load_map(path):
+    if not path:
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return {client_slug(cliente): clave for cliente, clave in json.load(f).items()}
+
+
+SHARD_MAP = _load_map(SHARD_MAP_PATH)
+
+
+def shard_for(nombre_cliente, sharding=SHARDING):
+    """Shard de las respuestas del cliente ("" si no hay sharding)."""
+    if sharding != "cliente":
+        return ""
+    # Los nombres de hoja admiten como máximo 100 caracteres
+    return client_slug(nombre_cliente)[:100 - len(SHARD_PREFIX)]
+
+
+def shard_for_rows(rows, sharding=SHARDING):
+    """Shard de las filas de una respuesta (todas son del mismo cliente)."""
+    return shard_for(rows[0][HEADERS.index("Nombre_Cliente")], sharding) if rows else ""
+
+
+def shard_target(shard, default_key):
+    """(clave de la hoja de cálculo, nombre de la hoja) de un shard."""
+    if not shard:
+        return default_key, WORKSHEET_NAME
+    if shard in SHARD_MAP:
+        return SHARD_MAP[shard], WORKSHEET_NAME
+    return default_key, SHARD_PREFIX + shard
+
+
+def shard_from_title(title):
+    """Shard de una hoja de la hoja de cálculo principal, o None si no es de respuestas."""
+    if title == WORKSHEET_NAME:
+        return ""
+    if title.startswith(SHARD_PREFIX):
+        return title[len(SHARD_PREFIX):]
+    return None
+
+
+def acquire_write_budget(shard, timeout=None):
+    """
+    Consume una ficha del presupuesto del shard y otra del global. Devuelve
+    False si se agota `timeout` esperando alguna de las dos.
+    """
+    if shard and not get_bucket(f"sheets:{shard}", SHARD_WRITES_PER_MINUTE, WRITE_BURST).acquire(timeout):
+        return False
+    return get_bucket("sheets").acquire(timeout)
+
+
+def has_write_budget(shard):
+    """Consume una ficha del shard si hay alguna disponible, sin esperar."""
+    if not shard:
+        return True
+    return get_bucket(f"sheets:{shard}", SHARD_WRITES_PER_MINUTE, WRITE_BURST).try_acquire()
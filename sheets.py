@@ -0,0 +1,395 @@
+"""
+Acceso a la hoja "Respuestas" de Google Sheets.
+
+Las funciones de este módulo reciben cualquier objeto con la interfaz de
+``gspread.Worksheet`` que usa la encuesta (``append_rows``, ``get_all_values``,
+``row_values``, ``update``), de modo que pueden ejecutarse contra la hoja real
+o contra ``MemoryWorksheet``, un sustituto en memoria que cuenta llamadas y bytes.
+"""
+import csv
+import io
+import json
+import os
+import random
+import re
+import threading
+import time
+
+import metrics
+from credentials import invalidate_credentials
+from resilience import call_with_retry, classify_error, status_code, write_not_applied
+from schema import HEADERS, RESPONSE_COLUMNS
+
+# Backend de hoja a usar: "gspread" (Google Sheets) o "memory" (sustituto local)
+SHEETS_BACKEND = os.environ.get("CCK_SHEETS_BACKEND", "gspread")
+
+# Latencia (ms) y tasa de errores simuladas por la hoja en memoria
+MEMORY_LATENCY_MS = float(os.environ.get("CCK_FAKE_LATENCY_MS", "0"))
+MEMORY_ERROR_RATE = float(os.environ.get("CCK_FAKE_ERROR_RATE", "0"))
+
+# Segundos que se considera vigente el resultado de la verificación de conexión
+CONNECTIVITY_TTL = int(os.environ.get("CCK_CONNECTIVITY_TTL", "300"))
+
+# Segundos que se reutiliza una conexión (cliente autorizado + hoja) antes de reabrirla
+CONNECTION_TTL = int(os.environ.get("CCK_CONNECTION_TTL", "3600"))
+
+
+# Función para construir las filas de una respuesta (una fila por evento)
+def build_rows(response_id, nombre_cliente, fecha_respuesta, demograficos, respuestas, encuesta):
+    """
+    Devuelve una lista de filas con etiquetas, en el orden de RESPONSE_COLUMNS.
+    `respuestas` es el diccionario evento -> respuestas (ResponseRecord.as_dict())
+    y `encuesta` el id del cuestionario.
+    """
+    filas = []
+    for evento, r in respuestas.items():
+        filas.append([
+            response_id,
+            nombre_cliente,
+            fecha_respuesta,
+            demograficos["Nivel_Cargo"],
+            demograficos["Fecha_Inicio"],
+            demograficos["Departamento"],
+            evento,
+            r["Probabilidad"],
+            r["Ocurrencia"],
+            r["Detección"],
+            r["Estructura"],
+            r["Impacto"],
+            r["Responsabilidad"],
+            r["Autoeficacia"],
+            "",  # Version_Codigos: filas con etiquetas
+            encuesta,
+        ])
+    return filas
+
+
+# Función para convertir filas en texto CSV (con encabezados)
+def rows_to_csv(rows, headers=RESPONSE_COLUMNS):
+    """Escribe las filas fila a fila con el módulo csv, sin construir un DataFrame."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(headers)
+    writer.writerows(rows)
+    return buffer.getvalue()
+
+
+# Función para añadir filas al final de la hoja
+def append_response_rows(worksheet, rows):
+    """
+    Añade todas las filas con una única llamada a `append_rows`.
+
+    No se lee la hoja para calcular la siguiente fila: la API de Sheets
+    añade los valores tras la última fila de la tabla que empieza en A1.
+    """
+    if worksheet is None:
+        return False
+    if not rows:
+        return True
+    worksheet.append_rows(rows, value_input_option="RAW", table_range="A1")
+    return True
+
+
+_connections = {}
+_connection_locks = {}
+_connections_lock = threading.Lock()
+
+
+# Función para obtener una hoja reutilizando la conexión del proceso
+def get_cached_worksheet(spreadsheet_key, worksheet_name, credentials_source, opener, ttl=None):
+    """
+    Devuelve la hoja cacheada para (spreadsheet_key, worksheet_name,
+    credentials_source) o la abre con `opener()` si no existe o ha caducado.
+
+    La caché es compartida por todas las sesiones y reruns del proceso, así que
+    la autorización OAuth y la búsqueda de la hoja se hacen una sola vez.
+    Si `opener()` devuelve None no se guarda nada y se reintentará en la
+    siguiente llamada.
+    """
+    ttl = CONNECTION_TTL if ttl is None else ttl
+    key = (spreadsheet_key, worksheet_name, credentials_source)
+
+    with _connections_lock:
+        entry = _connections.get(key)
+        if entry is not None and entry[1] > time.monotonic():
+            return entry[0]
+        key_lock = _connection_locks.setdefault(key, threading.Lock())
+
+    # Un solo hilo abre la conexión; el resto espera y reutiliza el resultado
+    with key_lock:
+        with _connections_lock:
+            entry = _connections.get(key)
+            if entry is not None and entry[1] > time.monotonic():
+                return entry[0]
+
+        worksheet = opener()
+        if worksheet is not None:
+            with _connections_lock:
+                _connections[key] = (worksheet, time.monotonic() + ttl)
+        return worksheet
+
+
+# Función para descartar conexiones cacheadas (p. ej. tras un error de autenticación)
+def invalidate_cached_worksheets(spreadsheet_key=None):
+    with _connections_lock:
+        for key in list(_connections):
+            if spreadsheet_key is None or key[0] == spreadsheet_key:
+                del _connections[key]
+    # Sin clave: también se vuelven a cargar las credenciales y el token
+    if spreadsheet_key is None:
+        invalidate_credentials()
+
+
+class ConnectivityCheck:
+    """
+    Verificación de la conexión con la hoja, hecha en un hilo en segundo plano
+    y compartida por todas las sesiones del proceso.
+
+    `opener` es una función sin argumentos que devuelve la hoja (o None).
+    """
+
+    def __init__(self, opener, ttl=CONNECTIVITY_TTL):
+        self.opener = opener
+        self.ttl = ttl
+        self.ok = None
+        self.error = None
+        self.checked_at = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _run(self):
+        try:
+            ok = self.opener() is not None
+            error = None if ok else "No se pudieron cargar las credenciales"
+        except Exception as e:
+            ok, error = False, str(e)
+        with self._lock:
+            self.ok, self.error, self.checked_at = ok, error, time.monotonic()
+
+    def status(self):
+        """
+        Devuelve el último resultado (True/False), o None si todavía no hay
+        ninguno. No bloquea: si no hay resultado vigente lanza la verificación
+        en segundo plano y devuelve el resultado anterior.
+        """
+        with self._lock:
+            expired = self.checked_at is None or time.monotonic() - self.checked_at > self.ttl
+            if expired and (self._thread is None or not self._thread.is_alive()):
+                self._thread = threading.Thread(target=self._run, name="cck-connectivity-check", daemon=True)
+                self._thread.start()
+            return self.ok
+
+
+_connectivity_check = None
+
+
+# Función para obtener la verificación de conexión del proceso
+def get_connectivity_check(opener):
+    global _connectivity_check
+    with _connections_lock:
+        if _connectivity_check is None:
+            _connectivity_check = ConnectivityCheck(opener)
+        return _connectivity_check
+
+
+def is_auth_error(exc):
+    """Indica si la excepción se debe a credenciales inválidas o caducadas."""
+    return classify_error(exc) == "auth"
+
+
+def is_permission_error(exc):
+    """Indica si la API denegó el acceso a un libro concreto (403) y no a las credenciales."""
+    return status_code(exc) == 403
+
+
+def _payload_size(value):
+    return len(json.dumps(value, ensure_ascii=False).encode("utf-8"))
+
+
+class InstrumentedWorksheet:
+    """
+    Envoltorio de una hoja que registra en metrics.py la duración, el número
+    de llamadas, los errores y los bytes (estimados) de cada llamada a la API.
+    Las llamadas pasan por resilience.call_with_retry: las lecturas se
+    reintentan ante cualquier error transitorio y las escrituras solo si el
+    error garantiza que no se aplicaron.
+    El resto de atributos se delegan en la hoja original.
+    """
+
+    _READS = ("get_all_values", "get_all_records", "row_values", "col_values", "get_values", "get")
+    _WRITES = ("update", "append_rows")
+
+    def __init__(self, worksheet):
+        self._worksheet = worksheet
+
+    def __getattr__(self, name):
+        attr = getattr(self._worksheet, name)
+        if name not in self._READS + self._WRITES:
+            return attr
+
+        def call(*args, **kwargs):
+            metrics.inc("cck_sheets_calls_total", method=name)
+            if name in self._WRITES:
+                values = args[-1] if args else kwargs.get("values")
+                metrics.inc("cck_sheets_bytes_sent_total", _payload_size(values), method=name)
+            retry_on = write_not_applied if name in self._WRITES else None
+            with metrics.timed("cck_sheets_call_seconds", method=name):
+                result = call_with_retry(attr, *args, retry_on=retry_on, operation=name, **kwargs)
+            if name in self._READS:
+                metrics.inc("cck_sheets_bytes_received_total", _payload_size(result), method=name)
+            return result
+        return call
+
+
+class InstrumentedSpreadsheet:
+    """
+    Lo mismo que InstrumentedWorksheet para el libro: `worksheet`,
+    `worksheets` y `add_worksheet` pasan por resilience.call_with_retry y se
+    miden (sin bytes: devuelven hojas, no valores), y las hojas que devuelven
+    se envuelven en InstrumentedWorksheet. add_worksheet, como las demás
+    escrituras, solo se reintenta si el error garantiza que no se aplicó.
+    """
+
+    _READS = ("worksheet", "worksheets")
+    _WRITES = ("add_worksheet",)
+
+    def __init__(self, spreadsheet):
+        self._spreadsheet = spreadsheet
+
+    def __getattr__(self, name):
+        attr = getattr(self._spreadsheet, name)
+        if name not in self._READS + self._WRITES:
+            return attr
+
+        def call(*args, **kwargs):
+            metrics.inc("cck_sheets_calls_total", method=name)
+            retry_on = write_not_applied if name in self._WRITES else None
+            with metrics.timed("cck_sheets_call_seconds", method=name):
+                result = call_with_retry(attr, *args, retry_on=retry_on, operation=name, **kwargs)
+            if isinstance(result, list):
+                return [InstrumentedWorksheet(w) for w in result]
+            return InstrumentedWorksheet(result)
+        return call
+
+
+class FakeAPIError(Exception):
+    """Error simulado por MemoryWorksheet, con la forma de `gspread.exceptions.APIError`."""
+
+    class _Response:
+        def __init__(self, status_code):
+            self.status_code = status_code
+            self.headers = {}
+
+    def __init__(self, status_code=503):
+        super().__init__(f"Error simulado de la API ({status_code})")
+        self.response = self._Response(status_code)
+
+
+class MemoryWorksheet:
+    """
+    Sustituto en memoria de `gspread.Worksheet`.
+
+    Registra el número de llamadas por método (`calls`) y los bytes enviados y
+    recibidos, estimados como el tamaño JSON de los valores intercambiados.
+    Puede simular latencia (`latency_ms`) y errores 503 con probabilidad
+    `error_rate` en cada llamada.
+    """
+
+    def __init__(self, title="Respuestas", rows=None, latency_ms=0.0, error_rate=0.0):
+        self.title = title
+        self.id = id(self)
+        self._rows = [list(r) for r in (rows or [])]
+        self._lock = threading.Lock()
+        self.latency_ms = latency_ms
+        self.error_rate = error_rate
+        self.calls = {}
+        self.errors = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    def _count(self, method):
+        self.calls[method] = self.calls.get(method, 0) + 1
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000.0)
+        if self.error_rate and random.random() < self.error_rate:
+            self.errors += 1
+            raise FakeAPIError(503)
+
+    @property
+    def total_calls(self):
+        return sum(self.calls.values())
+
+    def get_all_values(self):
+        with self._lock:
+            self._count("get_all_values")
+            values = [list(r) for r in self._rows]
+            self.bytes_received += _payload_size(values)
+            return values
+
+    def row_values(self, row):
+        with self._lock:
+            self._count("row_values")
+            values = list(self._rows[row - 1]) if row <= len(self._rows) else []
+            self.bytes_received += _payload_size(values)
+            return values
+
+    def col_values(self, col):
+        with self._lock:
+            self._count("col_values")
+            values = [r[col - 1] for r in self._rows if len(r) >= col]
+            self.bytes_received += _payload_size(values)
+            return values
+
+    def get(self, range_name, **kwargs):
+        with self._lock:
+            self._count("get")
+            # Rango de filas completas "A2:N20001" (se ignoran las columnas)
+            first, last = re.match(r"[A-Z]+(\d+):[A-Z]+(\d*)$", range_name).groups()
+            end = int(last) if last else len(self._rows)
+            values = [list(r) for r in self._rows[int(first) - 1:end]]
+            self.bytes_received += _payload_size(values)
+            return values
+
+    def update(self, range_name, values, **kwargs):
+        with self._lock:
+            self._count("update")
+            self.bytes_sent += _payload_size(values)
+            # Solo se admiten rangos indicados por su celda inicial ("A1", "O1"...)
+            letters, number = re.match(r"([A-Z]+)(\d+)$", range_name).groups()
+            col = 0
+            for letter in letters:
+                col = col * 26 + ord(letter) - 64
+            start = int(number) - 1
+            for offset, row in enumerate(values):
+                index = start + offset
+                while len(self._rows) <= index:
+                    self._rows.append([])
+                current = self._rows[index]
+                current.extend([""] * (col - 1 + len(row) - len(current)))
+                current[col - 1:col - 1 + len(row)] = list(row)
+
+    def append_rows(self, values, value_input_option="RAW", table_range=None, **kwargs):
+        with self._lock:
+            self._count("append_rows")
+            self.bytes_sent += _payload_size(values)
+            self._rows.extend(list(r) for r in values)
+
+
+_memory_worksheets = {}
+_memory_lock = threading.Lock()
+
+
+# Función para obtener una hoja en memoria compartida por todo el proceso
+def get_memory_worksheet(title="Respuestas"):
+    with _memory_lock:
+        if title not in _memory_worksheets:
+            _memory_worksheets[title] = MemoryWorksheet(
+                title, rows=[HEADERS],
+                latency_ms=MEMORY_LATENCY_MS, error_rate=MEMORY_ERROR_RATE)
+        return _memory_worksheets[title]
+
+
+def memory_worksheet_titles():
+    """Títulos de las hojas en memoria creadas en el proceso."""
+    with _memory_lock:
+        return list(_memory_worksheets)
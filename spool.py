@@ -0,0 +1,311 @@
+"""
+Cola local y persistente de respuestas pendientes de enviar a Google Sheets.
+
+La página "guardar" solo añade las filas a un diario SQLite (operación local y
+rápida) y un hilo en segundo plano las envía a la hoja en lotes, agrupando las
+respuestas de todas las sesiones y reintentando con espera exponencial si la
+API falla. Las filas no se borran del diario hasta que se han escrito.
+
+El hilo es el único escritor del proceso: espera una ventana corta para
+agrupar las respuestas que llegan a la vez, hace una sola llamada
+`append_rows` por lote y respeta el presupuesto de escrituras por minuto
+(ver throttle.py). Como `append_rows` añade tras la última fila de la tabla,
+dos lotes nunca pueden escribir en la misma fila.
+
+Con sharding por cliente (sharding.py) cada entrada guarda su shard y cada
+lote contiene solo entradas de un shard: se envía primero el shard de la
+respuesta más antigua que tenga presupuesto, y un shard que falla espera su
+propio reintento sin bloquear a los demás.
+
+Los envíos son idempotentes: `submit` reclama la respuesta en el índice de
+dedup.py y no la encola dos veces, y antes de reintentar un lote cuyo envío
+falló se comprueba en la columna de IDs de la hoja qué respuestas llegaron a
+escribirse (un timeout no garantiza que la escritura no se aplicara).
+"""
+import json
+import os
+import random
+import threading
+import time
+
+import metrics
+from dedup import get_submission_index
+from localdb import DATA_DIR, connect
+from resilience import retry_after
+from sharding import SHARD_WRITES_PER_MINUTE, has_write_budget, shard_for_rows, shard_target
+from sheets import append_response_rows, invalidate_cached_worksheets, is_auth_error, is_permission_error
+from throttle import WRITE_BURST, get_bucket
+
+# Diario local de envíos
+SPOOL_PATH = os.path.join(DATA_DIR, "spool.sqlite3")
+
+# Máximo de filas por escritura en la hoja
+BATCH_ROWS = int(os.environ.get("CCK_SPOOL_BATCH_ROWS", "1000"))
+
+# Segundos entre vaciados del diario cuando no hay errores
+FLUSH_INTERVAL = float(os.environ.get("CCK_SPOOL_FLUSH_INTERVAL", "2"))
+
+# Ventana (segundos) para agrupar respuestas de varias sesiones en una escritura
+COALESCE_WINDOW = float(os.environ.get("CCK_SPOOL_WINDOW", "1"))
+
+# Espera máxima (segundos) entre reintentos tras errores consecutivos
+MAX_BACKOFF = float(os.environ.get("CCK_SPOOL_MAX_BACKOFF", "300"))
+
+
+class Spool:
+    """Diario SQLite de respuestas pendientes (una entrada por respuesta)."""
+
+    def __init__(self, path=SPOOL_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = connect(path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS spool ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " response_id TEXT NOT NULL,"
+            " rows TEXT NOT NULL,"
+            " n_rows INTEGER NOT NULL,"
+            " created REAL NOT NULL,"
+            " attempts INTEGER NOT NULL DEFAULT 0,"
+            " last_error TEXT)"
+        )
+        # Diarios creados antes del sharding por cliente
+        columnas = [r[1] for r in self._conn.execute("PRAGMA table_info(spool)")]
+        if "shard" not in columnas:
+            self._conn.execute("ALTER TABLE spool ADD COLUMN shard TEXT NOT NULL DEFAULT ''")
+
+    def enqueue(self, response_id, rows, shard=""):
+        """Guarda las filas de una respuesta. Devuelve el id de la entrada."""
+        with self._lock:
+            cur = self._conn.execute(
+                "INSERT INTO spool (response_id, rows, n_rows, created, shard) VALUES (?, ?, ?, ?, ?)",
+                (response_id, json.dumps(rows, ensure_ascii=False), len(rows), time.time(), shard),
+            )
+            return cur.lastrowid
+
+    def enqueue_many(self, entries):
+        """Guarda varias respuestas, [(response_id, rows, shard)], en una sola transacción."""
+        ahora = time.time()
+        with self._lock:
+            with self._conn:
+                self._conn.execute("BEGIN")
+                self._conn.executemany(
+                    "INSERT INTO spool (response_id, rows, n_rows, created, shard) VALUES (?, ?, ?, ?, ?)",
+                    [(response_id, json.dumps(rows, ensure_ascii=False), len(rows), ahora, shard)
+                     for response_id, rows, shard in entries],
+                )
+        return len(entries)
+
+    def pending(self, max_rows=BATCH_ROWS, shard=None):
+        """
+        Devuelve las entradas más antiguas (de `shard`, si se indica) cuyo
+        total de filas no supera `max_rows` (al menos una entrada), como lista
+        de (id, response_id, rows).
+        """
+        with self._lock:
+            if shard is None:
+                cur = self._conn.execute("SELECT id, response_id, rows, n_rows FROM spool ORDER BY id")
+            else:
+                cur = self._conn.execute(
+                    "SELECT id, response_id, rows, n_rows FROM spool WHERE shard = ? ORDER BY id", (shard,))
+            entries = []
+            total = 0
+            for entry_id, response_id, rows, n_rows in cur:
+                if entries and total + n_rows > max_rows:
+                    break
+                entries.append((entry_id, response_id, json.loads(rows)))
+                total += n_rows
+            return entries
+
+    def attempted(self, entry_ids):
+        """Indica si alguna de las entradas ya tuvo un intento de envío fallido."""
+        with self._lock:
+            return any(self._conn.execute("SELECT attempts FROM spool WHERE id = ?", (i,)).fetchone()[0]
+                       for i in entry_ids)
+
+    def pending_shards(self):
+        """Shards con entradas pendientes, empezando por el de la entrada más antigua."""
+        with self._lock:
+            return [r[0] for r in self._conn.execute(
+                "SELECT shard FROM spool GROUP BY shard ORDER BY MIN(id)")]
+
+    def remove(self, entry_ids):
+        """Elimina del diario las entradas ya escritas en la hoja."""
+        with self._lock:
+            self._conn.executemany("DELETE FROM spool WHERE id = ?", [(i,) for i in entry_ids])
+
+    def record_failure(self, entry_ids, error):
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE spool SET attempts = attempts + 1, last_error = ? WHERE id = ?",
+                [(str(error)[:500], i) for i in entry_ids],
+            )
+
+    def pending_count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM spool").fetchone()[0]
+
+
+class SpoolWorker(threading.Thread):
+    """
+    Hilo que vacía el diario en la hoja.
+
+    `get_worksheet` es una función que devuelve la hoja destino (o None si no
+    hay conexión); se llama sin argumentos para la hoja principal y con el
+    shard para las demás. Cada ciclo escribe hasta BATCH_ROWS filas de varias
+    respuestas de un mismo shard con una sola llamada a `append_rows`.
+    `spreadsheet_key` es el libro principal: ante un 403 solo se descartan las
+    conexiones del libro del shard (ver sharding.shard_target).
+    """
+
+    def __init__(self, spool, get_worksheet, flush_interval=FLUSH_INTERVAL,
+                 max_backoff=MAX_BACKOFF, batch_rows=BATCH_ROWS,
+                 window=COALESCE_WINDOW, bucket=None, index=None, spreadsheet_key=None):
+        super().__init__(name="cck-spool-worker", daemon=True)
+        self.spool = spool
+        self.get_worksheet = get_worksheet
+        self.flush_interval = flush_interval
+        self.max_backoff = max_backoff
+        self.batch_rows = batch_rows
+        self.window = window
+        self.bucket = bucket or get_bucket("sheets")
+        self.index = index or get_submission_index()
+        self.spreadsheet_key = spreadsheet_key
+        self.writes = 0
+        self.failures = 0
+        self.last_error = None
+        self._shard_failures = {}  # shard -> (errores seguidos, instante del siguiente intento)
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+
+    def submit(self, response_id, rows):
+        """
+        Añade una respuesta al diario y despierta al hilo. Devuelve None sin
+        encolar nada si la respuesta ya se había enviado.
+        """
+        if not self.index.claim(response_id, "sheets"):
+            return None
+        try:
+            entry_id = self.spool.enqueue(response_id, rows, shard_for_rows(rows))
+        except Exception:
+            self.index.release(response_id, "sheets")
+            raise
+        metrics.inc("cck_spool_submissions_total")
+        self._wake.set()
+        return entry_id
+
+    def stop(self):
+        self._stopping.set()
+        self._wake.set()
+
+    def flush_once(self):
+        """
+        Envía un lote del diario. Devuelve True si se envió un lote y False
+        si el diario estaba vacío o sus shards esperan el siguiente reintento.
+        Lanza la excepción de la escritura si falla.
+        """
+        now = time.monotonic()
+        shards = [s for s in self.spool.pending_shards()
+                  if self._shard_failures.get(s, (0, 0))[1] <= now]
+        if not shards:
+            return False
+
+        # Respetar el presupuesto de escrituras por minuto: el del shard (el
+        # primero que tenga fichas o, si ninguno, esperando al más antiguo) y el global
+        shard = next((s for s in shards if has_write_budget(s)), None)
+        if shard is None:
+            shard = shards[0]
+            get_bucket(f"sheets:{shard}", SHARD_WRITES_PER_MINUTE, WRITE_BURST).acquire()
+        entries = self.spool.pending(self.batch_rows, shard)
+        rows = [row for _, _, entry_rows in entries for row in entry_rows]
+        ids = [entry_id for entry_id, _, _ in entries]
+        self.bucket.acquire()
+        try:
+            worksheet = self.get_worksheet(shard) if shard else self.get_worksheet()
+            if worksheet is None:
+                raise RuntimeError("No hay conexión con la hoja de respuestas")
+            if self.spool.attempted(ids):
+                entries, rows = self._unwritten(worksheet, entries)
+            if rows:
+                with metrics.timed("cck_spool_flush_seconds"):
+                    append_response_rows(worksheet, rows)
+                self.writes += 1
+        except Exception as e:
+            self.spool.record_failure(ids, e)
+            errores = self._shard_failures.get(shard, (0, 0))[0] + 1
+            self._shard_failures[shard] = (errores, time.monotonic() + self._backoff(errores))
+            metrics.inc("cck_spool_retries_total")
+            # Credenciales caducadas: la siguiente llamada abrirá una conexión nueva.
+            # Un 403 solo deniega el acceso al libro del shard: el resto de
+            # libros y las credenciales siguen siendo válidos
+            if is_permission_error(e):
+                invalidate_cached_worksheets(shard_target(shard, self.spreadsheet_key)[0])
+            elif is_auth_error(e):
+                invalidate_cached_worksheets()
+            raise
+        self.spool.remove(ids)
+        self._shard_failures.pop(shard, None)
+        metrics.inc("cck_spool_rows_written_total", len(rows))
+        metrics.inc("cck_spool_batches_total")
+        metrics.set_gauge("cck_spool_pending", self.spool.pending_count())
+        return True
+
+    def _unwritten(self, worksheet, entries):
+        """
+        Quita del diario las entradas cuyas filas ya están en la hoja (un
+        intento anterior se aplicó aunque fallara) y devuelve (entradas, filas) pendientes.
+        """
+        escritas = set(worksheet.col_values(1))
+        duplicadas = [e for e in entries if e[1] in escritas]
+        if duplicadas:
+            self.spool.remove([e[0] for e in duplicadas])
+            metrics.inc("cck_spool_duplicates_skipped_total", len(duplicadas))
+        entries = [e for e in entries if e[1] not in escritas]
+        return entries, [row for _, _, entry_rows in entries for row in entry_rows]
+
+    def _backoff(self, failures=None):
+        # Espera exponencial con jitter completo
+        failures = self.failures if failures is None else failures
+        return random.uniform(0, min(self.max_backoff, self.flush_interval * 2 ** failures))
+
+    def run(self):
+        while not self._stopping.is_set():
+            try:
+                # Ventana de agrupación: dar tiempo a que lleguen más respuestas
+                if self.window and self.spool.pending_count():
+                    self._stopping.wait(self.window)
+                while self.flush_once() and not self._stopping.is_set():
+                    pass
+                self.failures = 0
+                self.last_error = None
+                wait = self.flush_interval
+            except Exception as e:
+                self.failures += 1
+                self.last_error = str(e)
+                wait = max(self._backoff(), retry_after(e) or 0)
+
+            # Tras un error no se adelanta el reintento aunque lleguen envíos nuevos
+            if self.failures:
+                self._stopping.wait(wait)
+            else:
+                self._wake.wait(wait)
+            self._wake.clear()
+
+
+_worker = None
+_worker_lock = threading.Lock()
+
+
+# Función para obtener el hilo de envío compartido por todo el proceso
+def get_spool_worker(get_worksheet, path=SPOOL_PATH, spreadsheet_key=None):
+    """
+    Devuelve el SpoolWorker del proceso, creándolo y arrancándolo la primera
+    vez. Al arrancar, el hilo también envía lo que quedara en el diario de
+    ejecuciones anteriores.
+    """
+    global _worker
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = SpoolWorker(Spool(path), get_worksheet, spreadsheet_key=spreadsheet_key)
+            _worker.start()
+        return _worker
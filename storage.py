@@ -0,0 +1,529 @@
+"""
+Backends de almacenamiento intercambiables para las respuestas.
+
+- "sheets": la hoja "Respuestas" de Google Sheets (por defecto).
+- "sqlite": una base SQLite local en modo WAL.
+- "parquet": archivos Parquet particionados por cliente y fecha (requiere pyarrow).
+
+El backend se elige con CCK_STORAGE. Con un backend local las respuestas se
+escriben en el momento en disco; si además CCK_SYNC_TO_SHEETS=1, se
+envían a Google Sheets en segundo plano a través del diario (spool.py).
+
+Todos los backends guardan filas codificadas en el orden de schema.HEADERS y
+ofrecen `append_rows`, `read_rows(start, limit, shard)` (lectura por
+desplazamiento dentro de un shard, 0 = primera fila de datos), `shards()`
+(el backend "sheets" con sharding por cliente tiene una hoja por cliente, ver
+sharding.py; el backend parquet, una partición por cliente y fecha; sqlite, un
+único shard None), `iter_rows(chunk_rows)` e
+`iter_filtered(chunk_rows, cliente, desde, hasta, encuesta)` (filas de un
+cliente, rango de fechas y/o cuestionario; el backend parquet solo lee las
+particiones que coinciden).
+"""
+import os
+import threading
+import time
+from datetime import date, datetime
+
+import metrics
+from localdb import DATA_DIR, connect
+from schema import HEADERS, LEGACY_SURVEY, column_letter, response_survey
+from sharding import client_slug, shard_for, shard_for_rows
+from sheets import append_response_rows
+
+STORAGE_BACKEND = os.environ.get("CCK_STORAGE", "sheets")
+
+# Con un backend local, enviar también las respuestas a Google Sheets
+SYNC_TO_SHEETS = os.environ.get("CCK_SYNC_TO_SHEETS", "0") == "1"
+
+SQLITE_PATH = os.environ.get("CCK_SQLITE_PATH", os.path.join(DATA_DIR, "respuestas.sqlite3"))
+PARQUET_DIR = os.environ.get("CCK_PARQUET_DIR", os.path.join(DATA_DIR, "parquet"))
+
+# Compactación del backend parquet (en segundo plano): segundos entre pasadas,
+# archivos pequeños que se acumulan en una partición antes de unirlos, segundos
+# que debe tener un archivo para compactarlo y filas máximas de un archivo
+# compactado al que se siguen añadiendo archivos
+PARQUET_COMPACT_INTERVAL = float(os.environ.get("CCK_PARQUET_COMPACT_INTERVAL", "60"))
+PARQUET_COMPACT_FILES = int(os.environ.get("CCK_PARQUET_COMPACT_FILES", "20"))
+PARQUET_COMPACT_AGE = float(os.environ.get("CCK_PARQUET_COMPACT_AGE", "10"))
+PARQUET_TARGET_ROWS = int(os.environ.get("CCK_PARQUET_TARGET_ROWS", "100000"))
+
+# Segundos que se conservan los archivos ya compactados (lecturas en curso)
+PARQUET_DELETE_GRACE = 300
+
+# Columnas que se guardan como enteros en Parquet (valores del libro de códigos)
+INT_COLUMNS = ("Nivel_Cargo", "Departamento", "Evento", "Probabilidad", "Ocurrencia",
+               "Detección", "Estructura", "Impacto", "Responsabilidad", "Autoeficacia",
+               "Version_Codigos")
+
+
+def response_date(fecha_respuesta):
+    """Fecha (date) de un valor de Fecha_Respuesta "dd/mm/AAAA HH:MM:SS", o None."""
+    try:
+        return datetime.strptime(str(fecha_respuesta)[:10], "%d/%m/%Y").date()
+    except ValueError:
+        return None
+
+
+def row_matches(row, cliente=None, desde=None, hasta=None, encuesta=None):
+    """
+    Indica si la fila es de `cliente` y del cuestionario `encuesta` y su fecha
+    está en [desde, hasta] (None = sin límite).
+    """
+    if cliente is not None and row[HEADERS.index("Nombre_Cliente")] != cliente:
+        return False
+    if encuesta is not None and response_survey(row) != encuesta:
+        return False
+    if desde is None and hasta is None:
+        return True
+    fecha = response_date(row[HEADERS.index("Fecha_Respuesta")])
+    if fecha is None:
+        return False
+    return (desde is None or fecha >= desde) and (hasta is None or fecha <= hasta)
+
+
+class StorageBackend:
+    """Interfaz común de los backends."""
+
+    name = None
+    is_local = False
+
+    def append_rows(self, rows):
+        raise NotImplementedError
+
+    def read_rows(self, start, limit, shard=None):
+        raise NotImplementedError
+
+    def shards(self):
+        """Shards en los que se leen las filas (cada uno con sus propios desplazamientos)."""
+        return [None]
+
+    def iter_rows(self, chunk_rows=10000, start=0, shard=None):
+        """Genera las filas del shard en bloques de hasta `chunk_rows` filas."""
+        while True:
+            rows = self.read_rows(start, chunk_rows, shard)
+            if not rows:
+                return
+            yield rows
+            start += len(rows)
+            if len(rows) < chunk_rows:
+                return
+
+    def iter_filtered(self, chunk_rows=10000, cliente=None, desde=None, hasta=None, encuesta=None):
+        """
+        Como `iter_rows` sobre todos los shards, pero solo con las filas que
+        cumplen `row_matches`. Con un cliente se omiten los shards de otros
+        clientes (la hoja principal se lee siempre: tiene las filas anteriores al sharding).
+        """
+        for shard in self.shards():
+            if cliente is not None and shard and shard != shard_for(cliente, "cliente"):
+                continue
+            for rows in self.iter_rows(chunk_rows, shard=shard):
+                rows = [r for r in rows if row_matches(r, cliente, desde, hasta, encuesta)]
+                if rows:
+                    yield rows
+
+
+class SheetsStorage(StorageBackend):
+    """
+    Backend de Google Sheets. `get_worksheet()` devuelve la hoja principal
+    cacheada y `get_worksheet(shard)` la de un shard; `list_shards()` devuelve
+    los shards existentes ("" = hoja principal).
+    """
+
+    name = "sheets"
+
+    def __init__(self, get_worksheet, list_shards=None):
+        self.get_worksheet = get_worksheet
+        self.list_shards = list_shards
+
+    def _worksheet(self, shard):
+        return self.get_worksheet(shard) if shard else self.get_worksheet()
+
+    def shards(self):
+        return self.list_shards() if self.list_shards is not None else [""]
+
+    def append_rows(self, rows):
+        return append_response_rows(self._worksheet(shard_for_rows(rows)), rows)
+
+    def read_rows(self, start, limit, shard=""):
+        worksheet = self._worksheet(shard)
+        if worksheet is None:
+            raise RuntimeError("No hay conexión con la hoja de respuestas")
+        first = start + 2  # la fila 1 son los encabezados
+        return worksheet.get(f"A{first}:{column_letter(len(HEADERS))}{first + limit - 1}")
+
+
+class SQLiteStorage(StorageBackend):
+    """Tabla `respuestas` en SQLite (WAL), una columna por encabezado."""
+
+    name = "sqlite"
+    is_local = True
+
+    def __init__(self, path=SQLITE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = connect(path)
+        columnas = ", ".join(f'"{c}"' for c in HEADERS)
+        self._conn.execute(f"CREATE TABLE IF NOT EXISTS respuestas ({columnas})")
+        # Columnas añadidas por versiones nuevas del esquema
+        existentes = [r[1] for r in self._conn.execute("PRAGMA table_info(respuestas)")]
+        for columna in HEADERS:
+            if columna not in existentes:
+                self._conn.execute(f'ALTER TABLE respuestas ADD COLUMN "{columna}"')
+        self._insert = (f"INSERT INTO respuestas ({columnas}) "
+                        f"VALUES ({', '.join('?' for _ in HEADERS)})")
+        self._select = f"SELECT {columnas} FROM respuestas WHERE rowid > ? ORDER BY rowid LIMIT ?"
+
+    def append_rows(self, rows):
+        width = len(HEADERS)
+        with self._lock:
+            with self._conn:
+                self._conn.execute("BEGIN")
+                self._conn.executemany(
+                    self._insert, [list(r[:width]) + [None] * (width - len(r)) for r in rows])
+        return True
+
+    def read_rows(self, start, limit, shard=None):
+        # Las filas no se borran, así que rowid = desplazamiento + 1
+        with self._lock:
+            return [list(r) for r in self._conn.execute(self._select, (start, limit))]
+
+
+class ParquetCompactor(threading.Thread):
+    """Hilo que compacta periódicamente las particiones de un ParquetStorage."""
+
+    def __init__(self, storage, interval=PARQUET_COMPACT_INTERVAL):
+        super().__init__(name="cck-parquet-compact", daemon=True)
+        self.storage = storage
+        self.interval = interval
+        self._stopping = threading.Event()
+
+    def run(self):
+        while not self._stopping.wait(self.interval):
+            try:
+                self.storage.compact(self.storage.compact_files)
+            except Exception:
+                metrics.inc("cck_errors_total", operation="parquet_compact")
+
+    def stop(self):
+        self._stopping.set()
+
+
+class ParquetStorage(StorageBackend):
+    """
+    Archivos Parquet en `directory/cliente=<cliente>/fecha=<AAAA-MM-DD>/`.
+    Cada llamada a `append_rows` escribe un archivo por partición; los nombres
+    (`part-<marca de tiempo>-<secuencia>`) dan el orden de lectura.
+
+    Cada partición es un shard: `read_rows(start, limit, shard)` lee por
+    desplazamiento dentro de ella. Para que no se acumulen archivos de una
+    respuesta, un hilo en segundo plano (`start_compactor`) une los archivos
+    pequeños más antiguos de cada partición, en orden, en
+    `compacto-<desde>-<hasta>.parquet` dentro de la misma partición (los
+    archivos pequeños con clave en (desde, hasta]). Los compactados se leen
+    antes que los pequeños, así que el orden de las filas de la partición no
+    cambia y los desplazamientos siguen siendo válidos.
+    """
+
+    name = "parquet"
+    is_local = True
+
+    def __init__(self, directory=PARQUET_DIR, compact_files=PARQUET_COMPACT_FILES,
+                 compact_age=PARQUET_COMPACT_AGE, target_rows=PARQUET_TARGET_ROWS):
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise RuntimeError("El backend parquet requiere pyarrow (pip install pyarrow)")
+        self.directory = directory
+        self.compact_files = compact_files
+        self.compact_age = compact_age
+        self.target_rows = target_rows
+        self._lock = threading.Lock()
+        self._compact_lock = threading.Lock()
+        self._compactor = None
+        self._sequence = 0
+        self._row_counts = {}  # archivo -> filas (los archivos no se modifican)
+        os.makedirs(directory, exist_ok=True)
+
+    def _schema(self):
+        import pyarrow as pa
+        return pa.schema([(c, pa.int16() if c in INT_COLUMNS else pa.string()) for c in HEADERS])
+
+    @staticmethod
+    def _fecha(fecha_respuesta):
+        fecha = response_date(fecha_respuesta)
+        return "sin_fecha" if fecha is None else fecha.isoformat()
+
+    def append_rows(self, rows):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        i_cliente, i_fecha = HEADERS.index("Nombre_Cliente"), HEADERS.index("Fecha_Respuesta")
+        particiones = {}
+        for row in rows:
+            clave = (client_slug(row[i_cliente]), self._fecha(row[i_fecha]))
+            particiones.setdefault(clave, []).append(row)
+
+        schema = self._schema()
+        with self._lock:
+            for (cliente, fecha), filas in particiones.items():
+                columnas = {}
+                for i, columna in enumerate(HEADERS):
+                    valores = [r[i] if i < len(r) else None for r in filas]
+                    if columna in INT_COLUMNS:
+                        columnas[columna] = [None if v in (None, "") else int(v) for v in valores]
+                    else:
+                        columnas[columna] = [None if v is None else str(v) for v in valores]
+                destino = os.path.join(self.directory, f"cliente={cliente}", f"fecha={fecha}")
+                os.makedirs(destino, exist_ok=True)
+                self._sequence += 1
+                nombre = f"part-{time.time_ns():020d}-{self._sequence:06d}.parquet"
+                tmp = os.path.join(destino, "." + nombre)
+                pq.write_table(pa.table(columnas, schema=schema), tmp)
+                os.replace(tmp, os.path.join(destino, nombre))
+        return True
+
+    def shards(self):
+        """Particiones existentes ("cliente=<cliente>/fecha=<AAAA-MM-DD>"), ordenadas."""
+        particiones = []
+        for cliente in sorted(os.listdir(self.directory)):
+            ruta = os.path.join(self.directory, cliente)
+            if not cliente.startswith("cliente=") or not os.path.isdir(ruta):
+                continue
+            particiones += [os.path.join(cliente, fecha) for fecha in sorted(os.listdir(ruta))
+                            if fecha.startswith("fecha=")]
+        return particiones
+
+    @staticmethod
+    def _clave(archivo):
+        """Clave de orden de un archivo pequeño: "<marca de tiempo>-<secuencia>"."""
+        return os.path.basename(archivo)[len("part-"):-len(".parquet")]
+
+    @staticmethod
+    def _rango(archivo):
+        """(desde, hasta) de un archivo compactado."""
+        nombre = os.path.basename(archivo)[len("compacto-"):-len(".parquet")]
+        desde, hasta = nombre[:27], nombre[28:]
+        return desde, hasta
+
+    def _listing(self, particion):
+        """
+        (compactados vigentes, archivos pequeños sin compactar, obsoletos) de
+        una partición, en orden. Los obsoletos son pares (archivo, compactado
+        que lo sustituye).
+        """
+        ruta = os.path.join(self.directory, particion)
+        try:
+            nombres = os.listdir(ruta)
+        except FileNotFoundError:
+            return [], [], []
+        compactados = [os.path.join(ruta, a) for a in nombres
+                       if a.startswith("compacto-") and a.endswith(".parquet")]
+        pequenos = [os.path.join(ruta, a) for a in nombres
+                    if a.startswith("part-") and a.endswith(".parquet")]
+        # Un compactado cuyo rango está dentro del de otro ha sido sustituido por él
+        rangos = {c: self._rango(c) for c in compactados}
+        vigentes, obsoletos = [], []
+        for c in compactados:
+            sustituto = next((o for o in compactados if o != c and rangos[o][0] <= rangos[c][0]
+                              and rangos[o][1] >= rangos[c][1] and rangos[o] != rangos[c]), None)
+            if sustituto is None:
+                vigentes.append(c)
+            else:
+                obsoletos.append((c, sustituto))
+        vigentes.sort(key=lambda c: rangos[c][1])
+        sin_compactar = []
+        for p in pequenos:
+            sustituto = next((c for c in vigentes if self._clave(p) <= rangos[c][1]), None)
+            if sustituto is None:
+                sin_compactar.append(p)
+            else:
+                obsoletos.append((p, sustituto))
+        sin_compactar.sort(key=os.path.basename)
+        return vigentes, sin_compactar, obsoletos
+
+    def files(self, shard=None):
+        """
+        Archivos Parquet de una partición en orden de escritura (los
+        compactados primero); sin partición, los de todas, una tras otra.
+        """
+        if shard is None:
+            return [archivo for particion in self.shards() for archivo in self.files(particion)]
+        compactados, pequenos, _ = self._listing(shard)
+        return compactados + pequenos
+
+    def compact(self, min_files=1):
+        """
+        Une en cada partición los archivos pequeños antiguos, si son al menos
+        `min_files`, en un archivo compactado. Devuelve cuántos unió en total.
+        """
+        with self._compact_lock:
+            return sum(self._compact(particion, min_files) for particion in self.shards())
+
+    def _compact(self, particion, min_files):
+        import pyarrow.dataset as ds
+        import pyarrow.parquet as pq
+
+        compactados, pequenos, obsoletos = self._listing(particion)
+        ahora = time.time()
+        # Los archivos sustituidos se borran pasado un margen, para que las
+        # lecturas que ya los habían listado puedan terminar
+        for archivo, sustituto in obsoletos:
+            try:
+                if os.path.getmtime(sustituto) < ahora - PARQUET_DELETE_GRACE:
+                    self._row_counts.pop(archivo, None)
+                    os.remove(archivo)
+            except FileNotFoundError:
+                pass
+
+        # Solo un prefijo de los archivos pequeños, para conservar el orden
+        antiguos = []
+        for archivo in pequenos:
+            if os.path.getmtime(archivo) > ahora - self.compact_age:
+                break
+            antiguos.append(archivo)
+        if not antiguos or len(antiguos) < min_files:
+            return 0
+
+        # Se sigue ampliando el último compactado mientras sea pequeño
+        base = None
+        if compactados and self._num_rows(compactados[-1]) < self.target_rows:
+            base = compactados[-1]
+        desde = (self._rango(base)[0] if base else
+                 self._rango(compactados[-1])[1] if compactados else "0" * 27)
+        hasta = self._clave(antiguos[-1])
+
+        # pyarrow.dataset lee los archivos en paralelo y conserva su orden
+        tabla = ds.dataset(([base] if base else []) + antiguos, format="parquet",
+                           schema=self._schema()).to_table()
+        destino = os.path.join(self.directory, particion, f"compacto-{desde}-{hasta}.parquet")
+        tmp = os.path.join(os.path.dirname(destino), "." + os.path.basename(destino))
+        pq.write_table(tabla, tmp)
+        os.replace(tmp, destino)
+        return len(antiguos)
+
+    def start_compactor(self, interval=PARQUET_COMPACT_INTERVAL):
+        """Arranca (una vez) el hilo que compacta las particiones cada `interval` segundos."""
+        with self._compact_lock:
+            if self._compactor is None or not self._compactor.is_alive():
+                self._compactor = ParquetCompactor(self, interval)
+                self._compactor.start()
+            return self._compactor
+
+    def partition_files(self, cliente=None, desde=None, hasta=None):
+        """
+        Archivos (en orden de escritura) de las particiones que pueden tener
+        filas de `cliente` entre `desde` y `hasta`, según la ruta de la partición.
+        """
+        seleccion = []
+        for particion in self.shards():
+            carpeta_cliente, carpeta_fecha = particion.split(os.sep)
+            if cliente is not None and carpeta_cliente != f"cliente={client_slug(cliente)}":
+                continue
+            if desde is not None or hasta is not None:
+                try:
+                    fecha = date.fromisoformat(carpeta_fecha[len("fecha="):])
+                except ValueError:
+                    continue
+                if (desde is not None and fecha < desde) or (hasta is not None and fecha > hasta):
+                    continue
+            seleccion += self.files(particion)
+        return seleccion
+
+    def _num_rows(self, archivo):
+        import pyarrow.parquet as pq
+
+        if archivo not in self._row_counts:
+            self._row_counts[archivo] = pq.ParquetFile(archivo).metadata.num_rows
+        return self._row_counts[archivo]
+
+    def _iter_batches(self, archivos, chunk_rows, omitir=0, filtro=None):
+        """
+        Filas de `archivos`, en orden, en lotes de hasta `chunk_rows`: se leen
+        por bloques (y varios archivos a la vez) con pyarrow.dataset, sin
+        cargar archivos enteros. `omitir` filas del principio se descartan
+        antes de convertirlas y `filtro` (expresión de pyarrow) se aplica en
+        la lectura.
+        """
+        import pyarrow.dataset as ds
+
+        if not archivos:
+            return
+        dataset = ds.dataset(archivos, format="parquet", schema=self._schema())
+        for batch in dataset.to_batches(batch_size=chunk_rows, filter=filtro,
+                                        batch_readahead=2, fragment_readahead=4):
+            if omitir:
+                n = min(omitir, batch.num_rows)
+                batch, omitir = batch.slice(n), omitir - n
+            if batch.num_rows:
+                yield [list(r) for r in zip(*(c.to_pylist() for c in batch.columns))]
+
+    @staticmethod
+    def _chunks(lotes, chunk_rows):
+        """Reagrupa lotes de filas en bloques de `chunk_rows` filas (el último puede ser menor)."""
+        bloque = []
+        for filas in lotes:
+            bloque += filas
+            while len(bloque) >= chunk_rows:
+                yield bloque[:chunk_rows]
+                bloque = bloque[chunk_rows:]
+        if bloque:
+            yield bloque
+
+    def _pending_files(self, start, shard=None):
+        """Archivos a partir del desplazamiento `start` y filas a omitir del primero."""
+        archivos = self.files(shard)
+        for i, archivo in enumerate(archivos):
+            n = self._num_rows(archivo)
+            if start < n:
+                return archivos[i:], start
+            start -= n
+        return [], 0
+
+    def read_rows(self, start, limit, shard=None):
+        return next(self.iter_rows(limit, start, shard), [])
+
+    def iter_rows(self, chunk_rows=10000, start=0, shard=None):
+        archivos, omitir = self._pending_files(start, shard)
+        yield from self._chunks(self._iter_batches(archivos, chunk_rows, omitir), chunk_rows)
+
+    def iter_filtered(self, chunk_rows=10000, cliente=None, desde=None, hasta=None, encuesta=None):
+        import pyarrow.dataset as ds
+
+        # Solo se leen las particiones candidatas: la carpeta de la partición
+        # ya fija la fecha, y el cliente se filtra en la lectura porque varios
+        # clientes pueden compartir el mismo nombre de carpeta
+        filtro = None if cliente is None else ds.field("Nombre_Cliente") == str(cliente)
+        if encuesta is not None:
+            # Las filas sin Encuesta son del cuestionario original
+            de_encuesta = ds.field("Encuesta") == str(encuesta)
+            if encuesta == LEGACY_SURVEY:
+                de_encuesta = de_encuesta | ds.field("Encuesta").is_null() | (ds.field("Encuesta") == "")
+            filtro = de_encuesta if filtro is None else filtro & de_encuesta
+        archivos = self.partition_files(cliente, desde, hasta)
+        yield from self._chunks(self._iter_batches(archivos, chunk_rows, filtro=filtro), chunk_rows)
+
+_storage = None
+_storage_lock = threading.Lock()
+
+
+# Función para obtener el backend configurado (compartido por el proceso)
+def get_storage(get_worksheet, backend=STORAGE_BACKEND, list_shards=None):
+    """
+    `get_worksheet` y `list_shards` se usan con el backend "sheets" para
+    obtener las hojas cacheadas (ver SheetsStorage).
+    """
+    global _storage
+    with _storage_lock:
+        if _storage is None:
+            if backend == "sqlite":
+                _storage = SQLiteStorage()
+            elif backend == "parquet":
+                _storage = ParquetStorage()
+                if PARQUET_COMPACT_INTERVAL > 0:
+                    _storage.start_compactor()
+            elif backend == "sheets":
+                _storage = SheetsStorage(get_worksheet, list_shards)
+            else:
+                raise ValueError(f"Backend de almacenamiento desconocido: {backend}")
+        return _storage
@@ -0,0 +1,152 @@
+"""
+Definiciones declarativas de los cuestionarios.
+
+Cada archivo JSON de CCK_SURVEYS_DIR (por defecto `encuestas/`) define un
+instrumento:
+
+    {
+      "id": "cck",
+      "nombre": "...",
+      "total_eventos": 3,                 # eventos a evaluar por participante
+      "eventos": ["Fraude interno", ...], # opcional; por defecto todos los del libro de códigos
+      "preguntas": [{"campo": "Probabilidad", "clave": "probabilidad",
+                     "titulo": "Probabilidad", "texto": "... {evento} ..."}, ...],
+      "clientes": {"ACME": {"eventos": [...], "total_eventos": 5}}  # variantes por cliente
+    }
+
+Un archivo elige los textos, qué eventos del libro de códigos se usan, cuántos
+evalúa cada participante y las variantes por cliente. No define eventos,
+preguntas ni escalas nuevas: los eventos y las opciones de cada pregunta son
+los del libro de códigos vigente (ver codebook.py) y las preguntas cubren los
+siete campos de DIMENSIONES, que son las columnas codificadas del esquema.
+Añadir un evento o cambiar una escala requiere una versión nueva del libro.
+Los archivos que lo intentan (eventos fuera del libro, preguntas de otros
+campos o claves no admitidas, como "escalas" u "opciones") se rechazan.
+
+Las respuestas guardadas llevan el id del cuestionario en la columna Encuesta.
+
+Los archivos se leen y validan una sola vez por proceso, y los textos de las
+preguntas de cada evento se generan al cargarlos, no en cada rerun.
+"""
+import json
+import os
+import threading
+
+from schema import DIMENSIONES, ESCALAS, EVENTOS
+
+SURVEYS_DIR = os.environ.get(
+    "CCK_SURVEYS_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "encuestas"))
+
+# Instrumento que se usa si la URL no indica otro (?encuesta=<id>)
+DEFAULT_SURVEY = os.environ.get("CCK_SURVEY", "cck")
+
+
+# Claves admitidas en el archivo, en cada pregunta y en cada variante por cliente
+CLAVES = {"id", "nombre", "total_eventos", "eventos", "preguntas", "clientes"}
+CLAVES_PREGUNTA = {"campo", "clave", "titulo", "texto"}
+CLAVES_CLIENTE = {"eventos", "total_eventos"}
+
+
+def _clave_cliente(nombre_cliente):
+    return " ".join(str(nombre_cliente).split()).casefold()
+
+
+class SurveyDefinition:
+    """Cuestionario validado, con las preguntas de cada evento ya generadas."""
+
+    def __init__(self, data, origen="<dict>"):
+        self.origen = origen
+        self._claves(data, CLAVES, "el archivo")
+        self.id = data.get("id")
+        if not self.id:
+            raise ValueError(f"{origen}: falta el campo 'id'")
+        self.nombre = data.get("nombre", self.id)
+        self.eventos = self._eventos(data.get("eventos", EVENTOS), "eventos")
+        self.total_eventos = self._total(data.get("total_eventos", 3), self.eventos, "total_eventos")
+
+        preguntas = data.get("preguntas") or []
+        campos = [p.get("campo") for p in preguntas]
+        if sorted(campos) != sorted(DIMENSIONES):
+            raise ValueError(f"{origen}: las preguntas deben cubrir una vez cada campo de {DIMENSIONES}")
+        for pregunta in preguntas:
+            self._claves(pregunta, CLAVES_PREGUNTA, f"la pregunta {pregunta['campo']}")
+            for atributo in ("clave", "titulo", "texto"):
+                if not pregunta.get(atributo):
+                    raise ValueError(f"{origen}: la pregunta {pregunta['campo']} no tiene '{atributo}'")
+            try:
+                pregunta["texto"].format(evento="")
+            except (KeyError, IndexError, ValueError) as e:
+                raise ValueError(f"{origen}: texto inválido en la pregunta {pregunta['campo']}: {e}")
+
+        # evento -> [(campo, clave del widget, título, texto, opciones)]
+        self._preguntas = {
+            evento: [(p["campo"], f"{p['clave']}_{evento}", p["titulo"],
+                      p["texto"].format(evento=evento), ESCALAS[p["campo"]])
+                     for p in preguntas]
+            for evento in EVENTOS
+        }
+
+        self._variantes = {}
+        for cliente, variante in (data.get("clientes") or {}).items():
+            self._claves(variante, CLAVES_CLIENTE, f"clientes.{cliente}")
+            eventos = self._eventos(variante.get("eventos", self.eventos), f"clientes.{cliente}.eventos")
+            total = self._total(variante.get("total_eventos", min(self.total_eventos, len(eventos))),
+                                eventos, f"clientes.{cliente}.total_eventos")
+            self._variantes[_clave_cliente(cliente)] = (eventos, total)
+
+    def _claves(self, datos, admitidas, donde):
+        desconocidas = sorted(set(datos) - admitidas)
+        if desconocidas:
+            raise ValueError(f"{self.origen}: {donde} tiene claves no admitidas {desconocidas}; los eventos, "
+                             f"preguntas y escalas son los del libro de códigos (codebook.py)")
+
+    def _eventos(self, eventos, campo):
+        desconocidos = [e for e in eventos if e not in EVENTOS]
+        if desconocidos:
+            raise ValueError(f"{self.origen}: {campo} contiene eventos que no están en el libro "
+                             f"de códigos: {desconocidos}")
+        if not eventos:
+            raise ValueError(f"{self.origen}: {campo} está vacío")
+        return list(eventos)
+
+    def _total(self, total, eventos, campo):
+        if not isinstance(total, int) or not 1 <= total <= len(eventos):
+            raise ValueError(f"{self.origen}: {campo} debe estar entre 1 y {len(eventos)}")
+        return total
+
+    def preguntas(self, evento):
+        """Preguntas del evento como tuplas (campo, clave, titulo, texto, opciones)."""
+        return self._preguntas[evento]
+
+    def variante(self, nombre_cliente):
+        """(eventos, total_eventos) para el cliente, o los del cuestionario si no tiene variante."""
+        return self._variantes.get(_clave_cliente(nombre_cliente), (self.eventos, self.total_eventos))
+
+
+def load_surveys(directory=SURVEYS_DIR):
+    """Lee y valida todos los archivos .json de `directory`. Devuelve id -> SurveyDefinition."""
+    encuestas = {}
+    for nombre in sorted(os.listdir(directory)):
+        if not nombre.endswith(".json"):
+            continue
+        ruta = os.path.join(directory, nombre)
+        with open(ruta, encoding="utf-8") as f:
+            definicion = SurveyDefinition(json.load(f), ruta)
+        if definicion.id in encuestas:
+            raise ValueError(f"{ruta}: id de encuesta repetido: {definicion.id}")
+        encuestas[definicion.id] = definicion
+    return encuestas
+
+
+_surveys = None
+_surveys_lock = threading.Lock()
+
+
+# Función para obtener un cuestionario (cargados una vez por proceso)
+def get_survey(survey_id=None):
+    """Devuelve la definición `survey_id` (o la de CCK_SURVEY). KeyError si no existe."""
+    global _surveys
+    with _surveys_lock:
+        if _surveys is None:
+            _surveys = load_surveys()
+    return _surveys[survey_id or DEFAULT_SURVEY]
@@ -0,0 +1,18 @@
+import os
+
+from streamlit.testing.v1 import AppTest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_admin_link_without_token_or_secrets_shows_the_survey(tmp_path, monkeypatch):
+    # Sin CCK_ADMIN_TOKEN ni secrets.toml, ?admin= no abre la página de resultados ni falla
+    monkeypatch.delenv("CCK_ADMIN_TOKEN", raising=False)
+    monkeypatch.setenv("CCK_SHEETS_BACKEND", "memory")
+    monkeypatch.syspath_prepend(ROOT)
+    monkeypatch.chdir(tmp_path)
+    at = AppTest.from_file(os.path.join(ROOT, "app.py"), default_timeout=60)
+    at.query_params["admin"] = "cualquiera"
+    at.run()
+    assert not at.exception
+    assert at.session_state.page != "resultados"
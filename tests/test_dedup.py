@@ -0,0 +1,50 @@
+from dedup import SubmissionIndex
+from replay import Replayer
+from schema import HEADERS
+from sheets import MemoryWorksheet, rows_to_csv
+from spool import Spool, SpoolWorker
+
+FILA = ["r1", "ACME", "15/01/2025 10:00:00", "Director", "15/01/2025 09:50:00", "Finanzas",
+        "Fraude interno", "Algo probable", "Nunca", "Algo difícil", "Algo de acuerdo",
+        "Muy negativo", "Mucha", "Poco preparada", "", "cck"]
+
+
+def test_claim_and_release(tmp_path):
+    path = str(tmp_path / "enviadas.sqlite3")
+    index = SubmissionIndex(path, memory_entries=1)
+    assert index.claim("r1", "sheets")
+    assert not index.claim("r1", "sheets")
+    assert index.claim("r1", "sqlite")
+
+    # La reclamación persiste fuera de la caché en memoria y entre procesos
+    assert index.claim("r2", "sheets")
+    assert not index.claim("r1", "sheets")
+    assert not SubmissionIndex(path).claim("r1", "sheets")
+
+    index.release("r1", "sheets")
+    assert not index.contains("r1", "sheets")
+    assert index.claim("r1", "sheets")
+
+
+def test_submit_rejects_duplicates(tmp_path):
+    w = SpoolWorker(Spool(str(tmp_path / "spool.sqlite3")), lambda *shard: MemoryWorksheet(),
+                    index=SubmissionIndex(str(tmp_path / "enviadas.sqlite3")))
+    assert w.submit("r1", [["r1", "ACME"]]) is not None
+    assert w.submit("r1", [["r1", "ACME"]]) is None
+    assert w.spool.pending_count() == 1
+
+
+def test_replay_enqueues_each_response_once(tmp_path):
+    index = SubmissionIndex(str(tmp_path / "enviadas.sqlite3"))
+    spool = Spool(str(tmp_path / "spool.sqlite3"))
+    index.claim("r2", "sheets")  # enviada antes desde la app
+    otra, enviada = FILA[:], FILA[:]
+    otra[0], enviada[0] = "r3", "r2"
+    archivo = tmp_path / "respuestas.csv"
+    archivo.write_text(rows_to_csv([FILA, enviada, otra], HEADERS), encoding="utf-8")
+
+    # Dos cargas del mismo archivo: enqueue_many solo recibe las respuestas sin reclamar
+    for _ in range(2):
+        stats = Replayer(spool=spool, index=index, log=lambda *a: None).run([str(archivo)])
+    assert stats["duplicadas"] == 3
+    assert sorted(rid for _, rid, _ in spool.pending()) == ["r1", "r3"]
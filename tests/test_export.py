@@ -0,0 +1,73 @@
+import csv
+import io
+from datetime import date
+
+from codebook import encode_rows
+from export import LABEL_COLUMNS, write_csv
+from schema import HEADERS, RESPONSE_COLUMNS
+from storage import SQLiteStorage
+
+# Fechas con el formato de la app ("%d/%m/%Y %H:%M:%S")
+FILA = ["r1", "ACME", "15/01/2025 10:00:00", "Director", "15/01/2025 09:50:00", "Finanzas",
+        "Fraude interno", "Algo probable", "Nunca", "Algo difícil", "Algo de acuerdo",
+        "Muy negativo", "Mucha", "Poco preparada"]
+
+
+def exportar(tmp_path, **filtros):
+    storage = SQLiteStorage(str(tmp_path / "respuestas.sqlite3"))
+    storage.append_rows(encode_rows([FILA], RESPONSE_COLUMNS))
+    out = io.StringIO()
+    write_csv(storage, out, **filtros)
+    return list(csv.reader(io.StringIO(out.getvalue())))
+
+
+def test_label_columns_follow_the_codes(tmp_path):
+    encabezados, fila = exportar(tmp_path, decodificar=False, etiquetas=True)
+    assert encabezados == HEADERS + LABEL_COLUMNS
+    valores = dict(zip(encabezados, fila))
+    assert valores["Evento"] == "4"
+    assert valores["Evento_Etiqueta"] == "Fraude interno"
+    assert valores["Autoeficacia_Etiqueta"] == "Poco preparada"
+    assert valores["Version_Codigos"] == "1"
+
+
+def test_export_filters_by_survey(tmp_path):
+    storage = SQLiteStorage(str(tmp_path / "respuestas.sqlite3"))
+    otra = FILA[:]
+    otra[0] = "r2"
+    # Filas anteriores a la columna Encuesta (cuestionario original) y de otro cuestionario
+    storage.append_rows(encode_rows([FILA], RESPONSE_COLUMNS))
+    storage.append_rows(encode_rows([otra + ["", "otra"]], RESPONSE_COLUMNS))
+
+    def ids(encuesta):
+        out = io.StringIO()
+        write_csv(storage, out, encuesta=encuesta)
+        return [fila[0] for fila in list(csv.reader(io.StringIO(out.getvalue())))[1:]]
+
+    assert ids("cck") == ["r1"]
+    assert ids("otra") == ["r2"]
+    assert ids(None) == ["r1", "r2"]
+
+
+def test_decoded_export_has_no_label_columns(tmp_path):
+    encabezados, fila = exportar(tmp_path, etiquetas=True)
+    assert encabezados == HEADERS
+    assert fila[:len(FILA)] == FILA
+    assert fila[HEADERS.index("Version_Codigos")] == ""
+
+
+def test_export_filters_by_date(tmp_path):
+    storage = SQLiteStorage(str(tmp_path / "respuestas.sqlite3"))
+    posterior = FILA[:]
+    posterior[0], posterior[2] = "r2", "16/01/2025 08:30:00"
+    storage.append_rows(encode_rows([FILA, posterior], RESPONSE_COLUMNS))
+
+    def ids(**filtros):
+        out = io.StringIO()
+        write_csv(storage, out, **filtros)
+        return [fila[0] for fila in list(csv.reader(io.StringIO(out.getvalue())))[1:]]
+
+    assert ids(desde=date(2025, 1, 15), hasta=date(2025, 1, 15)) == ["r1"]
+    assert ids(desde=date(2025, 1, 16)) == ["r2"]
+    assert ids(hasta=date(2025, 1, 14)) == []
+    assert ids() == ["r1", "r2"]
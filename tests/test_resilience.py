@@ -0,0 +1,92 @@
+import time
+
+import gspread
+import pytest
+
+import metrics
+from codebook import CODEBOOK_VERSION, dictionary_rows
+from resilience import CircuitBreaker, CircuitOpenError, call_with_retry
+from schema import ensure_codebook_dictionary
+from sheets import FakeAPIError, InstrumentedSpreadsheet, MemoryWorksheet
+
+
+def failing(worksheet, *errores):
+    """Hace que las primeras llamadas a append_rows de la hoja lancen `errores`."""
+    pendientes = list(errores)
+    original = worksheet.append_rows
+
+    def append_rows(*args, **kwargs):
+        if pendientes:
+            raise pendientes.pop(0)
+        return original(*args, **kwargs)
+
+    worksheet.append_rows = append_rows
+    return worksheet
+
+
+def test_429_probe_does_not_leave_breaker_stuck_open():
+    breaker = CircuitBreaker("test", threshold=1, cooldown=0.05)
+    worksheet = failing(MemoryWorksheet(), FakeAPIError(503), FakeAPIError(429))
+
+    with pytest.raises(FakeAPIError):
+        call_with_retry(worksheet.append_rows, [["a"]], attempts=1, breaker=breaker)
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpenError):
+        call_with_retry(worksheet.append_rows, [["a"]], attempts=1, breaker=breaker)
+
+    time.sleep(0.06)
+    # La llamada de prueba recibe un 429: no cierra el circuito, pero tampoco lo bloquea
+    with pytest.raises(FakeAPIError):
+        call_with_retry(worksheet.append_rows, [["a"]], attempts=1, breaker=breaker)
+    assert breaker.state == "half_open"
+
+    call_with_retry(worksheet.append_rows, [["b"]], attempts=1, breaker=breaker)
+    assert breaker.state == "closed"
+    assert worksheet.get_all_values() == [["b"]]
+
+
+def test_429_does_not_open_breaker():
+    breaker = CircuitBreaker("test", threshold=1, cooldown=60)
+    worksheet = failing(MemoryWorksheet(), FakeAPIError(429), FakeAPIError(429))
+
+    call_with_retry(worksheet.append_rows, [["a"]], attempts=3, breaker=breaker)
+    assert breaker.state == "closed"
+
+
+class FakeSpreadsheet:
+    """Libro en memoria: `add_worksheet` falla antes con los `errores` indicados."""
+
+    def __init__(self, *errores):
+        self.id = f"libro-{id(self)}"
+        self.hojas = {}
+        self.errores = list(errores)
+
+    def worksheet(self, title):
+        if title not in self.hojas:
+            raise gspread.WorksheetNotFound(title)
+        return self.hojas[title]
+
+    def add_worksheet(self, title, rows, cols):
+        if self.errores:
+            raise self.errores.pop(0)
+        self.hojas[title] = MemoryWorksheet(title)
+        return self.hojas[title]
+
+
+def test_codebook_dictionary_goes_through_retry():
+    metrics.REGISTRY.reset()
+    libro = FakeSpreadsheet(FakeAPIError(503))
+    escrituras = ensure_codebook_dictionary(InstrumentedSpreadsheet(libro))
+
+    # add_worksheet se reintenta tras el 503 y las llamadas a la hoja se miden
+    assert escrituras == 2
+    hoja = libro.hojas["Codigos"]
+    assert hoja.get_all_values()[1:] == dictionary_rows(CODEBOOK_VERSION)
+    assert metrics.REGISTRY.value("cck_sheets_retries_total", operation="add_worksheet") == 1
+    assert metrics.REGISTRY.value("cck_sheets_calls_total", method="append_rows") == 1
+
+
+def test_add_worksheet_is_not_retried_when_it_may_have_applied():
+    libro = FakeSpreadsheet(FakeAPIError(500))
+    with pytest.raises(FakeAPIError):
+        InstrumentedSpreadsheet(libro).add_worksheet(title="Codigos", rows=200, cols=4)
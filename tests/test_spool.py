@@ -0,0 +1,99 @@
+import time
+
+import pytest
+
+import metrics
+import sheets
+from dedup import SubmissionIndex
+from sheets import FakeAPIError, MemoryWorksheet, get_cached_worksheet
+from spool import Spool, SpoolWorker
+
+
+def fallando(worksheet, *errores):
+    """Hace que las primeras llamadas a append_rows de la hoja lancen `errores`."""
+    pendientes = list(errores)
+    original = worksheet.append_rows
+
+    def append_rows(*args, **kwargs):
+        if pendientes:
+            raise pendientes.pop(0)
+        return original(*args, **kwargs)
+
+    worksheet.append_rows = append_rows
+    return worksheet
+
+
+def worker(tmp_path, worksheet, **kwargs):
+    return SpoolWorker(Spool(str(tmp_path / "spool.sqlite3")), lambda *shard: worksheet, window=0,
+                       index=SubmissionIndex(str(tmp_path / "enviadas.sqlite3")), **kwargs)
+
+
+def conexiones():
+    with sheets._connections_lock:
+        return sorted(key[0] for key in sheets._connections)
+
+
+@pytest.mark.parametrize("status, quedan", [(403, ["libro-b"]), (401, [])])
+def test_auth_errors_invalidate_connections(tmp_path, status, quedan):
+    sheets.invalidate_cached_worksheets()
+    for libro in ("libro-a", "libro-b"):
+        get_cached_worksheet(libro, "Respuestas", "test", MemoryWorksheet)
+    w = worker(tmp_path, fallando(MemoryWorksheet(), FakeAPIError(status)), spreadsheet_key="libro-a")
+    w.spool.enqueue("r1", [["r1", "ACME"]])
+
+    # Un 403 solo descarta las conexiones del libro del shard; un 401, todas
+    with pytest.raises(FakeAPIError):
+        w.flush_once()
+    assert conexiones() == quedan
+    sheets.invalidate_cached_worksheets()
+
+
+def test_failed_flush_records_the_error_and_backs_off(tmp_path, monkeypatch):
+    monkeypatch.setattr("random.uniform", lambda a, b: b)
+    hoja = fallando(MemoryWorksheet(), FakeAPIError(503))
+    w = worker(tmp_path, hoja, flush_interval=10, max_backoff=15)
+    entrada = w.spool.enqueue("r1", [["r1", "ACME"]])
+
+    with pytest.raises(FakeAPIError):
+        w.flush_once()
+    assert w.spool.attempted([entrada])
+    ((error,),) = w.spool._conn.execute("SELECT last_error FROM spool").fetchall()
+    assert "503" in error
+    # El shard espera min(max_backoff, flush_interval * 2 ** errores) antes de reintentar
+    errores, siguiente = w._shard_failures[""]
+    assert errores == 1 and siguiente == pytest.approx(time.monotonic() + 15, abs=1)
+    assert w.flush_once() is False
+    assert hoja.calls.get("append_rows", 0) == 0
+
+    w._shard_failures[""] = (errores, 0)
+    assert w.flush_once() is True
+    assert hoja.get_all_values() == [["r1", "ACME"]]
+    assert w.spool.pending_count() == 0
+    assert w._shard_failures == {}
+
+
+def test_retry_after_applied_write_does_not_duplicate_rows(tmp_path):
+    metrics.REGISTRY.reset()
+    hoja = MemoryWorksheet()
+    original = hoja.append_rows
+
+    def aplicada_y_fallida(*args, **kwargs):
+        # La escritura llega a la hoja pero la respuesta se pierde
+        hoja.append_rows = original
+        original(*args, **kwargs)
+        raise FakeAPIError(500)
+
+    hoja.append_rows = aplicada_y_fallida
+    w = worker(tmp_path, hoja, flush_interval=0)
+    w.spool.enqueue("r1", [["r1", "ACME"], ["r1", "ACME"]])
+    w.spool.enqueue("r2", [["r2", "Beta"]])
+    with pytest.raises(FakeAPIError):
+        w.flush_once()
+
+    # El reintento comprueba la columna de IDs y no vuelve a escribir
+    w.spool.enqueue("r3", [["r3", "Beta"]])
+    assert w.flush_once() is True
+    assert [r[0] for r in hoja.get_all_values()] == ["r1", "r1", "r2", "r3"]
+    assert hoja.calls["col_values"] == 1
+    assert metrics.REGISTRY.value("cck_spool_duplicates_skipped_total") == 2
+    assert w.spool.pending_count() == 0
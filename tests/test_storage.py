@@ -0,0 +1,87 @@
+import os
+
+import pytest
+
+pytest.importorskip("pyarrow")
+
+from storage import ParquetStorage  # noqa: E402
+
+I_ID = 0
+
+
+def fila(response_id, cliente, fecha):
+    return [response_id, cliente, f"{fecha} 10:00:00", 1, "2020", 1, 1, 1, 1, 1, 1, 1, 1, 1, 1]
+
+
+def escribir(storage):
+    for i in range(6):
+        storage.append_rows([fila(f"a{i}", "ACME", "15/01/2025")])
+        storage.append_rows([fila(f"b{i}", "Beta", "15/01/2025")])
+        storage.append_rows([fila(f"c{i}", "ACME", "16/01/2025")])
+
+
+def ids(storage, **kwargs):
+    return [r[I_ID] for rows in storage.iter_rows(4, **kwargs) for r in rows]
+
+
+def test_compaction_keeps_partitions_and_offsets(tmp_path):
+    storage = ParquetStorage(str(tmp_path), compact_age=0)
+    escribir(storage)
+    shards = storage.shards()
+    antes = {shard: ids(storage, shard=shard) for shard in shards}
+    desde_2 = {shard: ids(storage, start=2, shard=shard) for shard in shards}
+
+    assert storage.compact() == 18
+    assert storage.shards() == shards
+    for shard in shards:
+        # Un archivo compactado por partición, dentro de la propia partición
+        (archivo,) = storage.files(shard)
+        assert os.path.dirname(archivo) == os.path.join(str(tmp_path), shard)
+        assert ids(storage, shard=shard) == antes[shard]
+        assert ids(storage, start=2, shard=shard) == desde_2[shard]
+    assert antes[os.path.join("cliente=ACME", "fecha=2025-01-15")] == [f"a{i}" for i in range(6)]
+
+
+def test_new_rows_follow_compacted_ones(tmp_path):
+    storage = ParquetStorage(str(tmp_path), compact_age=0)
+    escribir(storage)
+    storage.compact()
+    storage.append_rows([fila("a6", "ACME", "15/01/2025")])
+    shard = os.path.join("cliente=ACME", "fecha=2025-01-15")
+    assert ids(storage, start=6, shard=shard) == ["a6"]
+
+
+def test_partition_files_skip_other_clients_after_compaction(tmp_path):
+    storage = ParquetStorage(str(tmp_path), compact_age=0)
+    escribir(storage)
+    storage.compact()
+    archivos = storage.partition_files(cliente="Beta")
+    assert len(archivos) == 1
+    assert [r[I_ID] for rows in storage.iter_filtered(100, cliente="Beta") for r in rows] == \
+        [f"b{i}" for i in range(6)]
+
+
+def test_reads_stream_in_bounded_chunks(tmp_path):
+    storage = ParquetStorage(str(tmp_path), compact_age=0)
+    storage.append_rows([fila(f"a{i}", "ACME", "15/01/2025") for i in range(250)])
+    storage.append_rows([fila(f"b{i}", "Beta", "15/01/2025") for i in range(10)])
+    storage.compact()
+
+    bloques = list(storage.iter_rows(40, start=205))
+    assert [len(b) for b in bloques] == [40, 15]
+    assert [r[I_ID] for b in bloques for r in b] == [f"a{i}" for i in range(205, 250)] + \
+        [f"b{i}" for i in range(10)]
+
+    # Mismo nombre de carpeta para los dos clientes: el cliente se filtra en la lectura
+    storage.append_rows([fila("z0", "ACME ", "15/01/2025")])
+    bloques = list(storage.iter_filtered(100, cliente="ACME"))
+    assert [len(b) for b in bloques] == [100, 100, 50]
+
+
+def test_iter_filtered_by_survey(tmp_path):
+    storage = ParquetStorage(str(tmp_path), compact_age=0)
+    storage.append_rows([fila("a0", "ACME", "15/01/2025")[:-1]])  # fila sin Encuesta
+    storage.append_rows([fila("a1", "ACME", "15/01/2025") + ["otra"]])
+    storage.append_rows([fila("a2", "ACME", "15/01/2025") + ["cck"]])
+    assert [r[I_ID] for rows in storage.iter_filtered(100, encuesta="cck") for r in rows] == ["a0", "a2"]
+    assert [r[I_ID] for rows in storage.iter_filtered(100, encuesta="otra") for r in rows] == ["a1"]
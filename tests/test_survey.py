@@ -0,0 +1,30 @@
+import copy
+import json
+import os
+
+import pytest
+
+from survey import SURVEYS_DIR, SurveyDefinition
+
+with open(os.path.join(SURVEYS_DIR, "cck.json"), encoding="utf-8") as f:
+    CCK = json.load(f)
+
+
+def test_bundled_survey_loads():
+    definicion = SurveyDefinition(CCK)
+    assert definicion.id == "cck"
+    assert len(definicion.preguntas(definicion.eventos[0])) == 7
+
+
+@pytest.mark.parametrize("cambio", [
+    lambda d: d.update(escalas={"Probabilidad": ["Sí", "No"]}),
+    lambda d: d["preguntas"][0].update(opciones=["Sí", "No"]),
+    lambda d: d.update(clientes={"ACME": {"preguntas": []}}),
+    lambda d: d.update(eventos=["Evento nuevo"]),
+    lambda d: d["preguntas"].append({"campo": "Nueva", "clave": "nueva", "titulo": "Nueva", "texto": "¿{evento}?"}),
+])
+def test_survey_files_cannot_define_events_questions_or_scales(cambio):
+    data = copy.deepcopy(CCK)
+    cambio(data)
+    with pytest.raises(ValueError):
+        SurveyDefinition(data, "prueba.json")
@@ -0,0 +1,76 @@
+"""
+Limitación de la tasa de llamadas a la API de Google Sheets (token bucket).
+
+Google Sheets limita las escrituras por minuto y proyecto; todas las
+escrituras del proceso pasan por un TokenBucket compartido para no
+superar el presupuesto configurado y evitar errores 429.
+"""
+import os
+import threading
+import time
+
+# Presupuesto de escrituras por minuto (la cuota de Sheets es 60 por usuario)
+WRITES_PER_MINUTE = float(os.environ.get("CCK_SHEETS_WRITES_PER_MINUTE", "50"))
+
+# Escrituras que se permiten de golpe tras un periodo inactivo
+WRITE_BURST = int(os.environ.get("CCK_SHEETS_WRITE_BURST", "5"))
+
+
+class TokenBucket:
+    """
+    Token bucket con `capacity` fichas que se reponen a `rate_per_minute`.
+    Es seguro usarlo desde varios hilos.
+    """
+
+    def __init__(self, rate_per_minute=WRITES_PER_MINUTE, capacity=WRITE_BURST):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = max(1, capacity)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self):
+        """Consume una ficha si hay disponible. Devuelve True si se consumió."""
+        with self._lock:
+            self._refill()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+    def acquire(self, timeout=None):
+        """
+        Espera hasta obtener una ficha. Devuelve False si se agota `timeout`
+        (segundos) sin conseguirla.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                wait = (1 - self._tokens) / self.rate
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+            time.sleep(wait)
+
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+# Función para obtener un TokenBucket compartido por nombre
+def get_bucket(name="sheets", rate_per_minute=WRITES_PER_MINUTE, capacity=WRITE_BURST):
+    with _buckets_lock:
+        if name not in _buckets:
+            _buckets[name] = TokenBucket(rate_per_minute, capacity)
+        return _buckets[name]